@@ -0,0 +1,258 @@
+"""
+batch_predict.py
+
+Score whole directories (or manifests) of WAVs against a user's model.
+
+    python3 batch_predict.py --user alice clips/ --out scores.csv
+    python3 batch_predict.py --user alice manifest.jsonl --out scores.jsonl --confusion cm.json
+
+Input is either a directory (searched recursively for *.wav; a file's
+parent folder name is taken as its true label when the directory has
+label sub-folders) or a manifest: CSV with a "path" column and optional
+"label" column, or JSONL with {"path": ..., "label": ...} per line.
+
+Decoding runs in a background thread feeding a bounded prefetch queue;
+the main thread featurizes BATCH_SIZE clips at a time, calls predict_proba
+once per batch and applies decide_batch() to the whole batch. Inputs are
+streamed and rows written as they are scored, so memory stays constant no
+matter how many clips there are. When true labels are known a confusion
+matrix (truth x decision) is printed at the end.
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+import metrics
+import sound_matcher as sm
+
+BATCH_SIZE = 64         # clips per featurize + predict_proba call
+PREFETCH = 256          # decoded clips buffered ahead of the scorer
+
+_DONE = object()
+
+
+# ===== Inputs =====
+def iter_directory(root: Path) -> Iterator[dict]:
+    """Every *.wav under root (sorted, walked lazily); label = sub-folder name."""
+    root = Path(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        rel = Path(dirpath).relative_to(root)
+        label = sm.normalize_text(rel.parts[0]) if rel.parts else None
+        for name in sorted(filenames):
+            if name.lower().endswith(".wav"):
+                yield {"path": str(Path(dirpath) / name), "label": label}
+
+
+def iter_manifest(path: Path) -> Iterator[dict]:
+    """Rows of a CSV (path[,label]) or JSONL manifest; relative paths are resolved against it."""
+    path = Path(path)
+    base = path.parent
+
+    def item(p: str, label: Optional[str]) -> dict:
+        p = Path(p)
+        return {"path": str(p if p.is_absolute() else base / p),
+                "label": sm.normalize_text(label) if label else None}
+
+    with open(path, newline="", encoding="utf-8") as fh:
+        if path.suffix.lower() in (".jsonl", ".json"):
+            for line in fh:
+                line = line.strip()
+                if line:
+                    rec = json.loads(line)
+                    yield item(rec["path"], rec.get("label"))
+        else:
+            for rec in csv.DictReader(fh):
+                yield item(rec["path"], rec.get("label"))
+
+
+def iter_inputs(source: Path) -> Iterator[dict]:
+    return iter_directory(source) if Path(source).is_dir() else iter_manifest(source)
+
+
+# ===== Prefetch + scoring =====
+def _reader(items: Iterator[dict], q: "queue.Queue", stop: threading.Event) -> None:
+    try:
+        for it in items:
+            if stop.is_set():
+                return
+            try:
+                it["audio"] = sm.read_wav(Path(it["path"]))
+            except Exception as e:
+                it["error"] = str(e)
+            q.put(it)
+    except Exception as e:
+        # a broken manifest ends the run after everything read so far
+        q.put({"path": "", "label": None, "error": f"input: {e}", "fatal": True})
+    finally:
+        q.put(_DONE)
+
+
+def _batches(items: Iterator[dict], batch_size: int, prefetch: int) -> Iterator[List[dict]]:
+    q: "queue.Queue" = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    t = threading.Thread(target=_reader, args=(items, q, stop), daemon=True)
+    t.start()
+    batch: List[dict] = []
+    try:
+        while True:
+            it = q.get()
+            if it is _DONE:
+                break
+            batch.append(it)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        stop.set()
+        # unblock the reader if it is waiting on a full queue
+        while t.is_alive():
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                t.join(0.01)
+
+
+def iter_predictions(user: str, items: Iterator[dict], batch_size: int = BATCH_SIZE,
+                     prefetch: int = PREFETCH) -> Iterator[dict]:
+    """
+    Yield one result per input item, in input order:
+    {"path", "label", "decision", "top1", "p_top1", "proba" (n_classes,), "error"}.
+    """
+    bundle = sm.get_model(user)
+    if bundle is None:
+        raise RuntimeError(f"no model trained for user '{sm.normalize_text(user)}'")
+    clf = bundle["model"]
+    classes = np.asarray(bundle["classes"], dtype=object)
+
+    for batch in _batches(items, batch_size, prefetch):
+        ok = [it for it in batch if "error" not in it]
+        if ok:
+            with metrics.timer("batch_features", n=len(ok)):
+                X = sm.extract_features_batch([it.pop("audio") for it in ok], bundle["feature_mode"])
+            with metrics.timer("batch_predict", n=len(ok)):
+                P = clf.predict_proba(X)
+            decisions = sm.decide_batch(classes, P, bundle["params"])
+            top = P.argmax(axis=1)
+            for it, p, d, k in zip(ok, P, decisions, top):
+                it.update(decision=d, top1=str(classes[k]), p_top1=float(p[k]), proba=p)
+        for it in batch:
+            if "error" in it:
+                it.update(decision="ERROR", top1="", p_top1=0.0, proba=None)
+            yield it
+
+
+# ===== Outputs =====
+class ResultWriter:
+    """Streams result rows as CSV (one column per class) or JSONL."""
+
+    def __init__(self, fh, classes, fmt: str):
+        self.fh = fh
+        self.classes = [str(c) for c in classes]
+        self.fmt = fmt
+        if fmt == "csv":
+            self.csv = csv.writer(fh)
+            self.csv.writerow(["path", "label", "decision", "top1", "p_top1"]
+                              + [f"p_{c}" for c in self.classes] + ["error"])
+
+    def write(self, r: dict) -> None:
+        proba = r["proba"]
+        if self.fmt == "csv":
+            probs = [f"{x:.6f}" for x in proba] if proba is not None else [""] * len(self.classes)
+            self.csv.writerow([r["path"], r["label"] or "", r["decision"], r["top1"],
+                               f"{r['p_top1']:.6f}"] + probs + [r.get("error", "")])
+        else:
+            rec = {"path": r["path"], "label": r["label"], "decision": r["decision"],
+                   "top1": r["top1"], "p_top1": round(r["p_top1"], 6)}
+            if proba is not None:
+                rec["proba"] = {c: round(float(x), 6) for c, x in zip(self.classes, proba)}
+            if "error" in r:
+                rec["error"] = r["error"]
+            self.fh.write(json.dumps(rec) + "\n")
+
+
+def print_confusion(confusion: Counter, classes) -> None:
+    truths = sorted({t for t, _ in confusion})
+    cols = [str(c) for c in classes] + ["UNKNOWN", "ERROR"]
+    cols = [c for c in cols if any(confusion.get((t, c)) for t in truths)] or cols
+    w = max([len(c) for c in cols + truths] + [5])
+    print(sm.B + "Confusion matrix (rows = truth, columns = decision):" + sm.R)
+    print(" " * w + " " + " ".join(f"{c:>{w}s}" for c in cols))
+    for t in truths:
+        print(f"{t:>{w}s} " + " ".join(f"{confusion.get((t, c), 0):>{w}d}" for c in cols))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("source", type=Path, help="directory of WAVs, or a .csv / .jsonl manifest")
+    ap.add_argument("--user", required=True, help="profile whose model scores the clips")
+    ap.add_argument("--out", type=Path, default=None, help="results file (.csv or .jsonl); default stdout")
+    ap.add_argument("--format", choices=["csv", "jsonl"], default=None,
+                    help="output format (default: from --out extension, else csv)")
+    ap.add_argument("--confusion", type=Path, default=None, help="also write the confusion matrix as JSON")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    ap.add_argument("--prefetch", type=int, default=PREFETCH, help="decoded clips buffered ahead")
+    args = ap.parse_args()
+
+    fmt = args.format or ("jsonl" if args.out and args.out.suffix.lower() in (".jsonl", ".json") else "csv")
+    bundle = sm.get_model(args.user)
+    if bundle is None:
+        print(sm.Y + f"No model trained yet for '{args.user}'." + sm.R, file=sys.stderr)
+        return 2
+
+    out_fh = open(args.out, "w", newline="", encoding="utf-8") if args.out else sys.stdout
+    writer = ResultWriter(out_fh, bundle["classes"], fmt)
+    confusion: Counter = Counter()
+    n = errors = 0
+    t0 = time.perf_counter()
+    try:
+        for r in iter_predictions(args.user, iter_inputs(args.source), args.batch_size, args.prefetch):
+            if r.get("fatal"):
+                print(sm.Y + r["error"] + sm.R, file=sys.stderr)
+                errors += 1
+                continue
+            writer.write(r)
+            n += 1
+            errors += r["decision"] == "ERROR"
+            if r["label"]:
+                confusion[(r["label"], r["decision"])] += 1
+    finally:
+        if args.out:
+            out_fh.close()
+    elapsed = time.perf_counter() - t0
+
+    # summary goes to stderr so stdout can carry the results
+    with_label = sum(confusion.values())
+    with contextlib.redirect_stdout(sys.stderr):
+        print(f"Scored {n} clips in {elapsed:.1f}s ({n / elapsed if elapsed else 0:.1f} clips/s), {errors} errors")
+        if with_label:
+            correct = sum(v for (t, d), v in confusion.items() if t == d)
+            unknown = sum(v for (_, d), v in confusion.items() if d == "UNKNOWN")
+            print(f"Accuracy {correct / with_label:.3f}, UNKNOWN rate {unknown / with_label:.3f} "
+                  f"over {with_label} labeled clips")
+            print_confusion(confusion, bundle["classes"])
+
+    if args.confusion:
+        args.confusion.write_text(json.dumps({
+            "labels": sorted({t for t, _ in confusion}),
+            "counts": [{"truth": t, "decision": d, "n": v} for (t, d), v in sorted(confusion.items())],
+        }, indent=2))
+    return 1 if errors and errors == n else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
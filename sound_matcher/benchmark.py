@@ -0,0 +1,364 @@
+"""
+benchmark.py
+
+Reproducible, headless benchmark for the sound_matcher pipeline.
+
+Synthesizes a deterministic labeled corpus (no microphone needed), then
+measures:
+ - extract         extract_features_from_audio, one clip at a time
+ - extract_batch   extract_features_batch over the whole corpus
+ - train_cold      train_model with an empty feature cache
+ - train_warm      train_model with every feature cached
+ - train_add       train_model after one extra command group is uploaded
+ - train_remove    train_model after that group is deleted again
+ - predict         rf_predict_proba on one clip (features + model)
+ - load_model      loading the prediction model from disk (cold, no cache)
+ - predict_model   predict_proba on one precomputed feature vector
+ - decide          decide_from_proba
+plus held-out accuracy, peak RSS and model size on disk. With
+--dtw-scaling N [N ...] the DTW engine's per-query latency is also
+measured for N synthetic templates each (stages dtw_N, plus the
+exhaustive-alignment latency and pruning rate under "dtw_scaling"):
+
+    python3 benchmark.py --dtw-scaling 100 1000 5000
+
+Results are written as JSON and can be compared against a stored baseline:
+
+    python3 benchmark.py --out bench.json
+    python3 benchmark.py --baseline bench.json --threshold 0.15
+
+The comparison exits with status 1 if any stage's p50 got slower than
+baseline * (1 + threshold). To compare the feature pipelines, run once per
+--feature-mode (or --engine) and compare the two files (accuracy is
+listed as well):
+
+    python3 benchmark.py --feature-mode padded --out padded.json
+    python3 benchmark.py --feature-mode valid --baseline padded.json
+    python3 benchmark.py --engine prototype --baseline padded.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+import soundfile as sf
+
+SAMPLE_RATE = 16000
+
+
+# ===== Synthetic corpus =====
+def synth_clip(rng: np.random.Generator, cmd: int, length_sec: float) -> np.ndarray:
+    """
+    One "utterance" of command `cmd`: a few harmonics with a command-specific
+    pitch contour and syllable envelope, random jitter, noise and silence
+    padding. Same (seed, cmd, length) -> same samples.
+    """
+    n = int(length_sec * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    f0 = 110.0 + 45.0 * cmd
+    f0 *= 1.0 + rng.uniform(-0.05, 0.05)
+    glide = (cmd % 3 - 1) * 0.3 * f0 * t / max(length_sec, 1e-3)
+    phase = 2 * np.pi * np.cumsum(f0 + glide) / SAMPLE_RATE
+
+    y = np.zeros(n)
+    for h in range(1, 6):
+        amp = 1.0 / h * (1.0 + 0.5 * np.sin(cmd * h))
+        y += amp * np.sin(h * phase + rng.uniform(0, 2 * np.pi))
+
+    syllables = 1 + cmd % 3
+    env = np.abs(np.sin(np.pi * syllables * t / max(length_sec, 1e-3))) ** 0.7
+    y *= env
+    y /= np.max(np.abs(y)) + 1e-9
+    y *= rng.uniform(0.3, 0.9)
+    y += rng.normal(0.0, 0.01, n)
+
+    lead = np.zeros(int(rng.uniform(0.05, 0.3) * SAMPLE_RATE))
+    tail = np.zeros(int(rng.uniform(0.05, 0.3) * SAMPLE_RATE))
+    return np.concatenate([lead, y, tail]).astype(np.float32)
+
+
+def make_corpus(root: Path, commands: int, samples: int, min_len: float, max_len: float,
+                seed: int) -> List[dict]:
+    rng = np.random.default_rng(seed)
+    out = []
+    for c in range(commands):
+        d = root / f"cmd{c:02d}"
+        d.mkdir(parents=True, exist_ok=True)
+        for i in range(samples):
+            path = d / f"{i:03d}.wav"
+            sf.write(str(path), synth_clip(rng, c, rng.uniform(min_len, max_len)), SAMPLE_RATE)
+            out.append({"path": str(path), "label": f"cmd{c:02d}"})
+    return out
+
+
+# ===== DTW template scaling =====
+def dtw_scaling(sizes: List[int], commands: int, min_len: float, max_len: float, seed: int,
+                queries: int = 20, exhaustive_up_to: int = 5000) -> Dict[str, dict]:
+    """
+    Latency of one DTW query as the template count grows. The largest set is
+    synthesized once (templates spread evenly over `commands`, so every
+    label has many near-duplicates: the hard case for pruning); every size
+    uses the first N of it. Pruned matching is checked against exhaustive
+    alignment for the nearest label.
+    """
+    import engines
+    import sound_matcher as sm
+
+    rng = np.random.default_rng(seed)
+    n_max = max(sizes)
+    cmds = np.arange(n_max) % commands
+    clips = [synth_clip(rng, int(c), rng.uniform(min_len, max_len)) for c in cmds]
+    X = sm.extract_features_batch(clips, "sequence")
+    labels = np.array([f"cmd{c:02d}" for c in cmds])
+    Q = sm.extract_features_batch(
+        [synth_clip(rng, int(c), rng.uniform(min_len, max_len)) for c in rng.integers(0, commands, queries)],
+        "sequence",
+    )
+
+    out = {}
+    for n in sorted(sizes):
+        label_paths: Dict[str, List[str]] = {}
+        for i in range(n):
+            label_paths.setdefault(labels[i], []).append(f"t{i}")
+        model = engines.DTWMatcher(engines.build_templates(X[:n], labels[:n], label_paths, "bench"))
+        model.distances(Q[0])
+        model.counts = dict.fromkeys(model.counts, 0)
+        pruned = time_each(model.distances, [(q,) for q in Q])
+        counts = dict(model.counts)
+        row = {**summarize(pruned), "templates": n,
+               "aligned_frac": counts["aligned"] / counts["templates"],
+               "abandoned_frac": counts["abandoned"] / max(1, counts["aligned"])}
+        if n <= exhaustive_up_to:
+            full = time_each(lambda q: model.distances(q, exhaustive=True), [(q,) for q in Q])
+            row["exhaustive_p50_ms"] = float(np.percentile(full, 50) * 1000.0)
+            row["same_top1"] = float(np.mean([model.distances(q).argmin() == model.distances(q, True).argmin()
+                                              for q in Q]))
+        out[f"dtw_{n}"] = row
+        print(f"  dtw {n:6d} templates: p50 {row['p50_ms']:.2f} ms, "
+              f"aligned {row['aligned_frac']:.1%}")
+    return out
+
+
+# ===== Measurement helpers =====
+def summarize(lat_sec: List[float], items: int = 1) -> dict:
+    a = np.asarray(lat_sec) * 1000.0
+    total = float(np.sum(lat_sec))
+    return {
+        "n": len(a),
+        "mean_ms": float(a.mean()),
+        "p50_ms": float(np.percentile(a, 50)),
+        "p95_ms": float(np.percentile(a, 95)),
+        "p99_ms": float(np.percentile(a, 99)),
+        "throughput_per_sec": (items * len(a) / total) if total > 0 else 0.0,
+    }
+
+
+def time_each(fn: Callable, args_list: list) -> List[float]:
+    out = []
+    for args in args_list:
+        t0 = time.perf_counter()
+        fn(*args)
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+def peak_rss_mb() -> float:
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return kb / 1024.0 / (1024.0 if sys.platform == "darwin" else 1.0)
+
+
+# ===== Benchmark =====
+def run(args) -> dict:
+    work = Path(tempfile.mkdtemp(prefix="sm_bench_"))
+    os.environ["SOUND_MATCHER_DATA_DIR"] = str(work / "data")
+    import sound_matcher as sm
+
+    if args.n_trees is not None:
+        sm.N_TREES = args.n_trees
+    if args.max_depth is not None:
+        sm.MAX_DEPTH = args.max_depth if args.max_depth > 0 else None
+    if args.train_mode is not None:
+        sm.TRAIN_MODE = args.train_mode
+    if args.model_format is not None:
+        sm.MODEL_FORMAT = args.model_format
+    if args.feature_mode is not None:
+        sm.FEATURE_MODE = args.feature_mode
+    if args.engine is not None:
+        sm.ENGINE = args.engine
+
+    user = "bench"
+    try:
+        examples = make_corpus(work / "train", args.commands, args.samples,
+                               args.min_len, args.max_len, args.seed)
+        heldout = make_corpus(work / "test", args.commands, max(2, args.samples // 2),
+                              args.min_len, args.max_len, args.seed + 1)
+        extra = [ex for ex in make_corpus(work / "extra", args.commands + 1, args.samples,
+                                          args.min_len, args.max_len, args.seed + 2)
+                 if ex["label"] == f"cmd{args.commands:02d}"]
+        clips = [sm.read_wav(Path(ex["path"])) for ex in examples]
+        test_clips = [sm.read_wav(Path(ex["path"])) for ex in heldout]
+
+        stages: Dict[str, dict] = {}
+
+        # first call pays library warm-up (e.g. numba JIT); report separately
+        t0 = time.perf_counter()
+        sm.extract_features_from_audio(clips[0])
+        first_call_ms = (time.perf_counter() - t0) * 1000.0
+
+        stages["extract"] = summarize(time_each(sm.extract_features_from_audio, [(y,) for y in clips]))
+
+        t0 = time.perf_counter()
+        sm.extract_features_batch(clips)
+        stages["extract_batch"] = summarize([time.perf_counter() - t0], items=len(clips))
+
+        sm.add_examples(user, examples)
+        t0 = time.perf_counter()
+        sm.train_model(user)
+        stages["train_cold"] = summarize([time.perf_counter() - t0], items=len(examples))
+        t0 = time.perf_counter()
+        sm.train_model(user)
+        stages["train_warm"] = summarize([time.perf_counter() - t0], items=len(examples))
+
+        # the upload path featurizes before training; only the retrain is timed
+        cache = sm.load_feature_cache(user)
+        sm.featurize_cached(cache, [Path(ex["path"]) for ex in extra])
+        cache.save()
+        sm.add_examples(user, extra)
+        t0 = time.perf_counter()
+        sm.train_model(user)
+        stages["train_add"] = summarize([time.perf_counter() - t0], items=len(extra))
+        sm.remove_label(user, extra[0]["label"])
+        t0 = time.perf_counter()
+        sm.train_model(user)
+        stages["train_remove"] = summarize([time.perf_counter() - t0], items=len(extra))
+
+        sm.get_model(user)  # load once, then measure the steady state
+        stages["predict"] = summarize(time_each(sm.rf_predict_proba, [(user, y) for y in test_clips]))
+
+        stages["load_model"] = summarize(time_each(sm._load_cached_bundle, [(user,)] * 5))
+
+        bundle = sm.get_model(user)
+        clf = bundle["model"]
+        X_test = sm.extract_features_batch(test_clips, bundle["feature_mode"])
+        stages["predict_model"] = summarize(
+            time_each(clf.predict_proba, [(X_test[i:i + 1],) for i in range(len(X_test))])
+        )
+
+        classes = bundle["classes"]
+        P = clf.predict_proba(X_test)
+        stages["decide"] = summarize(time_each(sm.decide_from_proba, [(classes, p) for p in P]))
+
+        truth = np.array([ex["label"] for ex in heldout])
+        decisions = np.array([sm.decide_from_proba(classes, p) for p in P])
+        top1 = classes[np.argmax(P, axis=1)]
+
+        return {
+            "meta": {
+                "commands": args.commands,
+                "samples": args.samples,
+                "min_len": args.min_len,
+                "max_len": args.max_len,
+                "seed": args.seed,
+                "n_trees": sm.N_TREES,
+                "max_depth": sm.MAX_DEPTH,
+                "train_mode": sm.TRAIN_MODE,
+                "model_format": sm.MODEL_FORMAT,
+                "engine": sm.ENGINE,
+                "feature_version": sm.feature_version(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "time": time.time(),
+            },
+            "first_call_ms": first_call_ms,
+            "stages": stages,
+            "accuracy_top1": float(np.mean(top1 == truth)),
+            "accuracy_decision": float(np.mean(decisions == truth)),
+            "unknown_rate": float(np.mean(decisions == "UNKNOWN")),
+            "model_bytes": sm._predict_model_path(user).stat().st_size,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """Stages whose p50 regressed by more than `threshold` (fraction)."""
+    regressions = []
+    print(f"{'stage':16s} {'base p50':>10s} {'now p50':>10s} {'change':>8s}")
+    for stage, cur in current["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base is None or base["p50_ms"] <= 0:
+            continue
+        change = cur["p50_ms"] / base["p50_ms"] - 1.0
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{stage:16s} {base['p50_ms']:10.3f} {cur['p50_ms']:10.3f} {change:+8.1%}{flag}")
+        if flag:
+            regressions.append(stage)
+    for key in ("accuracy_top1", "accuracy_decision", "unknown_rate"):
+        if key in baseline:
+            print(f"{key:16s} {baseline[key]:10.3f} {current[key]:10.3f} {current[key] - baseline[key]:+8.3f}")
+    return regressions
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--commands", type=int, default=5)
+    ap.add_argument("--samples", type=int, default=10, help="training samples per command")
+    ap.add_argument("--min-len", type=float, default=0.4, help="shortest clip, seconds")
+    ap.add_argument("--max-len", type=float, default=1.5, help="longest clip, seconds")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--n-trees", type=int, default=None, help="override sound_matcher.N_TREES")
+    ap.add_argument("--max-depth", type=int, default=None, help="override MAX_DEPTH (0 = None)")
+    ap.add_argument("--train-mode", choices=["full", "incremental"], default=None,
+                    help="override sound_matcher.TRAIN_MODE")
+    ap.add_argument("--model-format", choices=["compact", "joblib"], default=None,
+                    help="override sound_matcher.MODEL_FORMAT")
+    ap.add_argument("--feature-mode", choices=["padded", "valid"], default=None,
+                    help="override sound_matcher.FEATURE_MODE")
+    ap.add_argument("--engine", choices=["rf", "prototype", "dtw"], default=None,
+                    help="override sound_matcher.ENGINE")
+    ap.add_argument("--dtw-scaling", type=int, nargs="+", default=None, metavar="N",
+                    help="also time DTW queries against N synthetic templates")
+    ap.add_argument("--out", type=Path, default=None, help="write results JSON here")
+    ap.add_argument("--baseline", type=Path, default=None, help="compare against this results JSON")
+    ap.add_argument("--threshold", type=float, default=0.15, help="allowed p50 slowdown (fraction)")
+    ap.add_argument("--keep", action="store_true", help="keep the temporary corpus/data dir")
+    args = ap.parse_args()
+
+    # keep stdout clean for the JSON; training progress goes to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args)
+        if args.dtw_scaling:
+            table = dtw_scaling(args.dtw_scaling, args.commands, args.min_len, args.max_len, args.seed)
+            results["dtw_scaling"] = table
+            results["stages"].update(table)   # dtw_N p50s are checked against the baseline too
+    text = json.dumps(results, indent=2)
+    if args.out:
+        args.out.write_text(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        regressions = compare(json.loads(args.baseline.read_text()), results, args.threshold)
+        if regressions:
+            print(f"Regressed stages: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
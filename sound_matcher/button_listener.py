@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 import RPi.GPIO as GPIO
+import os
+import queue
+import threading
 import time
 import sound_matcher as sm
+import home_assistant_interfacing as ha
+import metrics
 
 BUTTON_PIN = 18
 LED_PIN = 21
 
+# Profile this button listens for, and optionally a shared inference service
+# (inference_service.py, e.g. http://pi.local:8090) to classify on instead of
+# loading the model here.
+USER = os.environ.get("SOUND_MATCHER_USER", "default_user")
+SERVICE_URL = os.environ.get("SOUND_MATCHER_SERVICE_URL", "")
+
 # Clean up any previous GPIO setup
 GPIO.cleanup()
 
@@ -14,18 +25,58 @@ GPIO.setup(BUTTON_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 GPIO.setup(LED_PIN, GPIO.OUT)
 GPIO.output(LED_PIN, GPIO.LOW)
 
+def predict_on_service():
+    import inference_service
+    y = sm.capture_utterance()
+    if y is None:
+        print("No speech detected; no command recognized.")
+        return
+    res = inference_service.predict_remote(SERVICE_URL, USER, y)
+    print(f"{res['decision']} (p={res['p_top1']:.2f}, {res['latency_ms']['total']:.0f} ms on service)")
+    if res["script_id"]:
+        ha.dispatch_script(res["script_id"])
+
 def trigger_voice_command():
     print("Button pressed! Running voice command...")
     try:
-        sm.listen_once("default_user")
+        if SERVICE_URL:
+            predict_on_service()
+        else:
+            sm.listen_once(USER)
     except Exception as e:
         print(f"Error in voice command: {e}")
 
+# Presses are handled on one worker thread, so the GPIO callback returns at
+# once; a press while a command is still running is ignored (busy is set by
+# the callback and cleared when the command is done, so nothing queues up).
+presses = queue.Queue(maxsize=1)
+busy = threading.Event()
+
+def press_worker():
+    while True:
+        presses.get()
+        GPIO.output(LED_PIN, GPIO.HIGH)
+        try:
+            with metrics.timer("button_press"):
+                trigger_voice_command()
+        finally:
+            GPIO.output(LED_PIN, GPIO.LOW)
+            busy.clear()
+
 def button_callback(channel):
     print("Button detected!")
-    GPIO.output(LED_PIN, GPIO.HIGH)
-    trigger_voice_command()
-    GPIO.output(LED_PIN, GPIO.LOW)
+    if busy.is_set():
+        print("Still busy; press ignored.")
+        return
+    busy.set()
+    presses.put_nowait(channel)
+
+# Warm start: import the heavy libraries, compile the feature path and load
+# every profile's model now (this button's user last, so the model cache
+# keeps it if not all fit), so the first press is as fast as every later one
+_user = sm.normalize_text(USER)
+sm.warm_up([] if SERVICE_URL else [u for u in sm.list_users() if u != _user] + [_user])
+threading.Thread(target=press_worker, daemon=True).start()
 
 try:
     GPIO.add_event_detect(BUTTON_PIN, GPIO.FALLING, callback=button_callback, bouncetime=500)
@@ -0,0 +1,219 @@
+"""
+compact_forest.py
+
+Flat, memory-mappable export of a trained forest and a pure-NumPy predictor.
+
+flatten() copies every tree of a RandomForestClassifier (or of each label
+in an incremental.OneVsRestForest) into a handful of contiguous arrays:
+
+    feature    int32   (n_nodes,)   split feature, -2 at leaves
+    threshold  float64 (n_nodes,)   split threshold (x <= t goes left)
+    left/right int32   (n_nodes,)   child node index (absolute)
+    leaf       int32   (n_nodes,)   row in `value` for leaves, -1 otherwise
+    value      float32 (n_leaves, k) per-leaf class distribution
+    roots      int32   (n_trees,)   root node of each tree
+    group      int32   (n_trees,)   first output column the tree votes into
+
+save() writes them as an uncompressed .npz; load() maps each member
+straight from the file (np.memmap at the member's data offset), so loading
+is near zero-copy and processes that load the same model share the pages.
+CompactForest.predict_proba() walks all trees for all rows at once and
+matches sklearn's predict_proba up to float32 rounding of the leaf values.
+"""
+
+import json
+import os
+import struct
+import zipfile
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+import incremental
+
+FORMAT_VERSION = 1
+_LOCAL_HEADER = 30      # fixed part of a zip local file header
+
+
+# ===== Export =====
+def _tree_arrays(tree, base: int, leaf_base: int, columns) -> tuple:
+    """One sklearn Tree -> (feature, threshold, left, right, leaf, value) with absolute indices."""
+    t = tree.tree_
+    is_leaf = t.children_left < 0
+    feature = np.where(is_leaf, -2, t.feature).astype(np.int32)
+    left = np.where(is_leaf, -1, t.children_left + base).astype(np.int32)
+    right = np.where(is_leaf, -1, t.children_right + base).astype(np.int32)
+    leaf = np.full(t.node_count, -1, dtype=np.int32)
+    leaf[is_leaf] = leaf_base + np.arange(int(is_leaf.sum()), dtype=np.int32)
+
+    v = t.value[is_leaf, 0, :].astype(np.float64)
+    v /= np.maximum(v.sum(axis=1, keepdims=True), 1e-300)
+    value = v[:, columns] if columns is not None else np.ones((len(v), 1))
+    return feature, t.threshold.astype(np.float64), left, right, leaf, value.astype(np.float32)
+
+
+def flatten(model, classes, feature_version: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """
+    RandomForestClassifier or OneVsRestForest -> dict of flat arrays + meta.
+    `classes` are the label names of the predict_proba columns;
+    feature_version is stored in meta for the loader.
+    """
+    classes = [str(c) for c in classes]
+    if isinstance(model, incremental.OneVsRestForest):
+        # one-vs-rest: each label's trees vote their positive-class score into column j
+        kind = "ovr"
+        forests = []
+        for j, label in enumerate(classes):
+            clf = model.forests[label]
+            cls = list(clf.classes_)
+            forests.append((clf.estimators_, j, [cls.index(1)] if 1 in cls else None))
+        eps = incremental.SCORE_EPS
+    else:
+        kind = "forest"
+        forests = [(model.estimators_, 0, list(range(model.n_classes_)))]
+        eps = 0.0
+
+    parts = {k: [] for k in ("feature", "threshold", "left", "right", "leaf", "value")}
+    roots, group = [], []
+    base = leaf_base = 0
+    max_depth = 0
+    for estimators, col, columns in forests:
+        for tree in estimators:
+            arrs = _tree_arrays(tree, base, leaf_base, columns)
+            for k, a in zip(parts, arrs):
+                parts[k].append(a)
+            roots.append(base)
+            group.append(col)
+            base += tree.tree_.node_count
+            leaf_base += len(arrs[-1])
+            max_depth = max(max_depth, int(tree.tree_.max_depth))
+
+    out = {k: np.concatenate(v) for k, v in parts.items()}
+    out["roots"] = np.asarray(roots, dtype=np.int32)
+    out["group"] = np.asarray(group, dtype=np.int32)
+    meta = {
+        "format": FORMAT_VERSION,
+        "kind": kind,
+        "n_out": len(classes),
+        "n_features": int(forests[0][0][0].n_features_in_),
+        "max_depth": max_depth,
+        "score_eps": eps,
+        "feature_version": feature_version,
+    }
+    out["meta"] = np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)
+    out["classes"] = np.asarray(classes, dtype=np.str_)
+    return out
+
+
+def save(path: Path, arrays: Dict[str, np.ndarray]) -> None:
+    """Atomic uncompressed .npz write (members must stay uncompressed to be mmapped)."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as fh:
+        np.savez(fh, **arrays)
+    os.replace(tmp, path)
+
+
+# ===== Loading =====
+def _mmap_npz(path: Path) -> Dict[str, np.ndarray]:
+    """Map every stored .npy member of an .npz read-only, without copying."""
+    out = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as fh:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                out[name] = np.load(zf.open(info))
+                continue
+            fh.seek(info.header_offset)
+            header = fh.read(_LOCAL_HEADER)
+            name_len, extra_len = struct.unpack("<HH", header[26:30])
+            fh.seek(info.header_offset + _LOCAL_HEADER + name_len + extra_len)
+            version = np.lib.format.read_magic(fh)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(fh)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(fh)
+            if dtype.hasobject or int(np.prod(shape)) == 0:
+                out[name] = np.load(zf.open(info), allow_pickle=False)
+                continue
+            out[name] = np.memmap(path, dtype=dtype, mode="r", offset=fh.tell(),
+                                  shape=shape, order="F" if fortran else "C")
+    return out
+
+
+def load(path: Path, mmap: bool = True) -> "CompactForest":
+    path = Path(path)
+    if mmap:
+        arrays = _mmap_npz(path)
+    else:
+        with np.load(path, allow_pickle=False) as z:
+            arrays = {k: z[k] for k in z.files}
+    return CompactForest(arrays)
+
+
+# ===== Prediction =====
+class CompactForest:
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.meta = json.loads(bytes(np.asarray(arrays["meta"])).decode("utf-8"))
+        if self.meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"unsupported compact model format {self.meta.get('format')}")
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.leaf = arrays["leaf"]
+        self.value = arrays["value"]
+        self.roots = np.asarray(arrays["roots"])
+        self.group = np.asarray(arrays["group"])
+        self.kind = self.meta["kind"]
+        self.n_out = self.meta["n_out"]
+        self.classes_ = np.asarray(arrays["classes"]).astype(object)
+
+        # ovr: (n_trees, n_out) matrix averaging each label's trees into its column
+        self._avg = None
+        if self.kind == "ovr":
+            onehot = np.zeros((len(self.group), self.n_out))
+            onehot[np.arange(len(self.group)), self.group] = 1.0
+            self._avg = onehot / np.maximum(onehot.sum(axis=0), 1.0)
+
+    @property
+    def n_estimators(self) -> int:
+        return len(self.roots)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.left, self.right,
+                                      self.leaf, self.value, self.roots, self.group))
+
+    def set_params(self, **params) -> "CompactForest":
+        return self
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """(n, n_features) -> (n, n_trees) leaf node reached in every tree."""
+        # sklearn compares float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        node = np.repeat(self.roots[None, :], len(X), axis=0)
+        rows = np.arange(len(X))[:, None]
+        for _ in range(self.meta["max_depth"]):
+            feat = self.feature[node]
+            inner = feat >= 0
+            if not inner.any():
+                break
+            go_left = X[rows, np.where(inner, feat, 0)] <= self.threshold[node]
+            node = np.where(inner, np.where(go_left, self.left[node], self.right[node]), node)
+        return node
+
+    def scores(self, X: np.ndarray) -> np.ndarray:
+        """Mean leaf value per output column: class probabilities, or per-label scores for ovr."""
+        votes = self.value[self.leaf[self.apply(X)]]          # (n, n_trees, k)
+        if self._avg is None:
+            return votes.mean(axis=1, dtype=np.float64)
+        return votes[:, :, 0].astype(np.float64) @ self._avg
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        s = self.scores(X)
+        if self.kind != "ovr":
+            return s
+        # same combination as incremental.OneVsRestForest.predict_proba
+        return incremental.combine_scores(s, self.meta["score_eps"])
@@ -0,0 +1,274 @@
+"""
+continuous.py
+
+Hands-free, always-listening mode for sound_matcher.
+
+    python3 continuous.py --user alice
+    python3 continuous.py --user alice --wav test_stream.wav   # replay a file
+
+Audio from the input stream callback goes into a ring buffer and a bounded
+block queue; a worker thread then runs two stages:
+
+ 1. CheapGate: per 20 ms frame RMS + zero-crossing rate against an adaptive
+    noise floor. Only voiced-looking audio (loud enough, not hiss-like)
+    opens the gate; nothing else is done while it is closed.
+ 2. While the gate is open (plus a short tail), a WINDOW_SEC window ending
+    at the newest audio is classified every HOP_SEC with the user's model.
+    Window features come from features.window_features(), which reuses the
+    mel frames shared by overlapping windows (features.FrameCache).
+
+A command fires once it wins DEBOUNCE_WINDOWS consecutive windows; then
+the same gate segment cannot fire again, and nothing fires for
+REFRACTORY_SEC. Classification is also held to MAX_CLASSIFY_DUTY of real
+time (windows are skipped when over budget), and the duty cycle is
+reported every STATS_EVERY_SEC.
+"""
+
+import argparse
+import queue
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+import features
+import home_assistant_interfacing as ha
+import metrics
+import sound_matcher as sm
+import streaming
+
+WINDOW_SEC = 1.5            # classified window length
+HOP_SEC = 0.25              # window step while the gate is open
+GATE_TAIL_SEC = 0.5         # keep classifying this long after the gate closes
+DEBOUNCE_WINDOWS = 2        # consecutive windows that must agree before firing
+REFRACTORY_SEC = 1.5        # no new detection for this long after one fired
+MAX_CLASSIFY_DUTY = 0.5     # cap on classifier time / audio time
+STATS_EVERY_SEC = 60.0
+
+# first-stage gate
+GATE_FRAME_SEC = 0.02
+GATE_ONSET_RATIO = 3.0      # voiced = rms > noise_floor * ratio
+GATE_MIN_RMS = 0.003
+GATE_MAX_ZCR = 0.35         # zero crossings per sample above this look like hiss
+GATE_ONSET_FRAMES = 3
+GATE_NOISE_ALPHA = 0.02
+
+QUEUE_BLOCKS = 256          # audio blocks buffered between callback and worker
+
+
+class CheapGate:
+    """Energy + ZCR first stage; is_open while speech-like audio is present."""
+
+    def __init__(self, sample_rate: int):
+        self.frame_len = int(GATE_FRAME_SEC * sample_rate)
+        self.noise: Optional[float] = None
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._run = 0
+        self.is_open = False
+        self.frames = 0
+        self.open_frames = 0
+
+    def push(self, x: np.ndarray) -> bool:
+        if self._pending.size:
+            x = np.concatenate([self._pending, x])
+        n = len(x) // self.frame_len
+        self._pending = x[n * self.frame_len:].copy()
+        if n == 0:
+            return self.is_open
+        fr = x[: n * self.frame_len].reshape(n, self.frame_len)
+        levels = np.sqrt(np.mean(fr * fr, axis=1))
+        zcr = np.mean(np.signbit(fr[:, 1:]) != np.signbit(fr[:, :-1]), axis=1)
+        for level, z in zip(levels, zcr):
+            floor = self.noise if self.noise is not None else 0.0
+            voiced = level > max(GATE_MIN_RMS, floor * GATE_ONSET_RATIO) and z < GATE_MAX_ZCR
+            if voiced:
+                self._run += 1
+            else:
+                self._run = 0
+                self.noise = float(level) if self.noise is None else (
+                    (1 - GATE_NOISE_ALPHA) * self.noise + GATE_NOISE_ALPHA * float(level)
+                )
+            self.is_open = self._run >= GATE_ONSET_FRAMES
+            self.frames += 1
+            self.open_frames += self.is_open
+        return self.is_open
+
+
+class ContinuousListener:
+    def __init__(
+        self,
+        user: str,
+        stream_factory: Optional[Callable] = None,
+        on_detect: Optional[Callable[[str, float, str], None]] = None,
+        sample_rate: int = sm.SAMPLE_RATE,
+    ):
+        self.user = sm.normalize_text(user)
+        self.sample_rate = sample_rate
+        self.stream_factory = stream_factory or streaming._sounddevice_stream
+        self.on_detect = on_detect or self._dispatch
+
+        hop = features.HOP_LENGTH
+        self.window = max(1, int(round(WINDOW_SEC * sample_rate / hop))) * hop
+        self.step = max(1, int(round(HOP_SEC * sample_rate / hop))) * hop
+        self.target_len = int(sm.REC_LEN_SEC * sample_rate)
+        self.ring = streaming.RingBuffer(self.window + 4 * sample_rate)
+        self.frames = features.FrameCache(self.ring.read, sample_rate,
+                                          capacity=2 * self.ring.capacity // hop)
+        self.gate = CheapGate(sample_rate)
+
+        self._blocks: "queue.Queue" = queue.Queue(maxsize=QUEUE_BLOCKS)
+        self._stop = threading.Event()
+        self._next_window = 0           # absolute sample where the next window may end
+        self._tail_until = -1
+        self._votes: deque = deque(maxlen=DEBOUNCE_WINDOWS)
+        self._segment_fired = False
+        self._refractory_until = -1
+        self.stats = {"audio_sec": 0.0, "busy_sec": 0.0, "classify_sec": 0.0, "windows": 0,
+                      "skipped": 0, "detections": 0, "dropped_blocks": 0}
+
+    # ----- audio in -----
+    def _callback(self, indata, frames, time_info, status):
+        x = np.asarray(indata, dtype=np.float32)
+        if x.ndim > 1:
+            x = x[:, 0]
+        try:
+            self._blocks.put_nowait(x.copy())
+        except queue.Full:
+            self.stats["dropped_blocks"] += 1
+
+    # ----- processing -----
+    def _process(self, x: np.ndarray) -> None:
+        t0 = time.perf_counter()
+        self.ring.write(x)
+        now = self.ring.written
+        self.stats["audio_sec"] += len(x) / self.sample_rate
+
+        if self.gate.push(x):
+            self._tail_until = now + int(GATE_TAIL_SEC * self.sample_rate)
+        elif now > self._tail_until:
+            # segment over: re-arm
+            self._segment_fired = False
+            self._votes.clear()
+
+        end = (now // features.HOP_LENGTH) * features.HOP_LENGTH
+        while now <= self._tail_until and end >= self._next_window and end >= self.window:
+            self._next_window = end + self.step
+            if self.stats["classify_sec"] > MAX_CLASSIFY_DUTY * self.stats["audio_sec"] + HOP_SEC:
+                self.stats["skipped"] += 1
+                break
+            self._classify(end - self.window, end)
+        self.stats["busy_sec"] += time.perf_counter() - t0
+
+    def _classify(self, start: int, end: int) -> None:
+        t0 = time.perf_counter()
+        bundle = sm.get_model(self.user)
+        if bundle is None:
+            return
+        if bundle["feature_mode"] == "sequence":
+            feats = sm.extract_features_from_audio(self.ring.read(start, end), "sequence")
+        else:
+            feats = features.window_features(self.frames, start, end, self.target_len,
+                                             pad=bundle["feature_mode"] == "padded")
+        proba = bundle["model"].predict_proba(feats.reshape(1, -1))[0]
+        decision = sm.decide_from_proba(bundle["classes"], proba, bundle["params"])
+        dt = time.perf_counter() - t0
+        self.stats["classify_sec"] += dt
+        self.stats["windows"] += 1
+        metrics.observe("continuous_window", dt)
+
+        self._votes.append(decision)
+        agreed = (len(self._votes) == DEBOUNCE_WINDOWS and decision != "UNKNOWN"
+                  and all(v == decision for v in self._votes))
+        if agreed and not self._segment_fired and end >= self._refractory_until:
+            self._segment_fired = True
+            self._refractory_until = end + int(REFRACTORY_SEC * self.sample_rate)
+            self.stats["detections"] += 1
+            p = float(proba[list(bundle["classes"]).index(decision)])
+            self.on_detect(decision, p, bundle["scripts"].get(decision, ""))
+
+    def _dispatch(self, label: str, p: float, script_id: str) -> None:
+        if script_id:
+            print(sm.G + f"[DETECTED] {label} p={p:.2f} (script_id={script_id})" + sm.R)
+            ha.dispatch_script(script_id)
+        else:
+            print(sm.G + f"[DETECTED] {label} p={p:.2f}" + sm.R)
+
+    # ----- reporting -----
+    def duty_cycle(self) -> dict:
+        audio = self.stats["audio_sec"] or 1e-9
+        reused = self.frames.requested - self.frames.computed
+        return {
+            **self.stats,
+            "duty_cycle": self.stats["busy_sec"] / audio,
+            "classify_duty": self.stats["classify_sec"] / audio,
+            "gate_open_frac": self.gate.open_frames / max(1, self.gate.frames),
+            "frame_reuse": reused / max(1, self.frames.requested),
+        }
+
+    def print_stats(self) -> None:
+        d = self.duty_cycle()
+        print(
+            sm.C + f"[continuous] {d['audio_sec']:.0f}s audio, duty {d['duty_cycle']:.1%} "
+            f"(classifier {d['classify_duty']:.1%}), gate open {d['gate_open_frac']:.1%}, "
+            f"{d['windows']} windows ({d['skipped']} skipped), frames reused {d['frame_reuse']:.0%}, "
+            f"{d['detections']} detections" + sm.R
+        )
+
+    # ----- main loop -----
+    def run(self, duration_sec: Optional[float] = None) -> dict:
+        """Listen until stop() / Ctrl+C / duration_sec / end of a replayed stream."""
+        if sm.get_model(self.user) is None:
+            raise RuntimeError(f"no model trained for user '{self.user}'")
+        stream = self.stream_factory(
+            samplerate=self.sample_rate,
+            channels=1,
+            dtype="float32",
+            blocksize=int(GATE_FRAME_SEC * self.sample_rate) * 5,
+            callback=self._callback,
+        )
+        deadline = time.monotonic() + duration_sec if duration_sec else None
+        next_stats = time.monotonic() + STATS_EVERY_SEC
+        with stream:
+            while not self._stop.is_set():
+                try:
+                    self._process(self._blocks.get(timeout=0.1))
+                except queue.Empty:
+                    if not getattr(stream, "active", True):
+                        break       # finite source (file replay) ran out
+                if deadline and time.monotonic() > deadline:
+                    break
+                if time.monotonic() > next_stats:
+                    self.print_stats()
+                    next_stats += STATS_EVERY_SEC
+        while not self._blocks.empty():
+            self._process(self._blocks.get_nowait())
+        return self.duty_cycle()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--user", required=True)
+    ap.add_argument("--wav", type=Path, default=None, help="replay this file instead of the microphone")
+    ap.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    args = ap.parse_args()
+
+    factory = streaming.wav_stream_factory(args.wav, sm.SAMPLE_RATE, realtime=True) if args.wav else None
+    listener = ContinuousListener(args.user, stream_factory=factory)
+    sm.warm_up([args.user])
+    print(sm.C + "Listening continuously (Ctrl+C to stop)…" + sm.R)
+    try:
+        listener.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    listener.print_stats()
+    ha.flush()
+
+
+if __name__ == "__main__":
+    main()
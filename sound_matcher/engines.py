@@ -0,0 +1,564 @@
+"""
+engines.py
+
+Matcher engines: the pluggable part of sound_matcher that turns a user's
+feature matrix into a saved model and loads it back for prediction.
+
+ - "rf"         RandomForest (full or incremental one-vs-rest, see
+                TRAIN_MODE), saved with joblib plus the compact export.
+ - "prototype"  nearest-neighbour / centroid matcher. Features are
+                standardized and L2-normalized; the model is one float32
+                matrix holding every example and every label centroid, so
+                a prediction is a single matrix-vector product. Adding or
+                changing a command appends / replaces only that label's
+                rows (O(its samples)); nothing is refit.
+ - "dtw"        template matching on the MFCC frame sequence of every
+                example ("sequence" features), stored as float16 and
+                mmapped. A query is scored with dynamic time warping in a
+                Sakoe-Chiba band of DTW_BAND frames. Templates are pruned
+                by a coarse segment-mean bound, then by LB_Keogh against
+                the query's envelope, and an alignment is abandoned as
+                soon as its partial cost plus the remaining LB_Keogh
+                cannot beat its label's best. Its sequences live in their
+                own feature cache; adding a command only featurizes and
+                re-embeds that command's files.
+
+Every loaded model exposes classes_ and predict_proba(X), so
+decide_from_proba / decide_batch apply unchanged. The prototype and DTW
+matchers turn similarities / distances into probabilities with a softmax
+(PROTO_TEMPERATURE, DTW_TEMPERATURE).
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import compact_forest as cf
+import features
+import incremental
+import lazy_import
+import sound_matcher as sm
+
+joblib = lazy_import.lazy("joblib")
+sk_preprocessing = lazy_import.lazy("sklearn.preprocessing")
+
+PROTO_TEMPERATURE = 0.05     # softmax temperature over cosine similarities
+PROTO_CENTROID_WEIGHT = 0.5  # label score = w * centroid sim + (1 - w) * best example sim
+PROTO_FORMAT_VERSION = 1
+
+DTW_BAND = 3                 # Sakoe-Chiba radius, in frames of features.SEQ_FRAMES
+DTW_TEMPERATURE = 0.05       # softmax temperature over per-frame DTW distances
+DTW_PRUNE_NATS = 8.0         # templates that cannot bring their label within this many
+                             # softmax units of the best label are never aligned
+DTW_SEGMENT = 4              # frames per segment of the coarse lower bound
+DTW_BATCH = 64               # first batch of templates aligned together (then doubling)
+DTW_MAX_ALIGNED = 256        # exact alignments per query, most promising first
+DTW_FORMAT_VERSION = 1
+
+
+# ===== Interface =====
+class MatcherEngine:
+    """
+    train() returns the bundle to save, or None when the saved model already
+    matches the examples; save() writes it atomically; load() returns
+    {"model", "classes", "feature_version"} for get_model(). train() gets
+    X in `feature_mode` (None = sound_matcher.FEATURE_MODE), from the
+    feature cache of that mode.
+    """
+
+    name = ""
+    feature_mode: Optional[str] = None
+
+    def model_files(self, user: str) -> List[Path]:
+        raise NotImplementedError
+
+    def prediction_file(self, user: str) -> Optional[Path]:
+        """File get_model() should load (and watch) for this engine, if trained."""
+        raise NotImplementedError
+
+    def train(self, user: str, X: np.ndarray, labels: np.ndarray,
+              label_paths: Dict[str, List[str]], hp: dict, mode: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def save(self, user: str, bundle: dict) -> None:
+        raise NotImplementedError
+
+    def load(self, path: Path) -> Optional[dict]:
+        raise NotImplementedError
+
+
+# ===== Random forest =====
+class ForestEngine(MatcherEngine):
+    name = "rf"
+
+    def model_files(self, user: str) -> List[Path]:
+        return [sm.model_path(user), sm.compact_model_path(user)]
+
+    def prediction_file(self, user: str) -> Optional[Path]:
+        if sm.MODEL_FORMAT == "compact" and sm.compact_model_path(user).exists():
+            return sm.compact_model_path(user)
+        path = sm.model_path(user)
+        return path if path.exists() else None
+
+    def train(self, user, X, labels, label_paths, hp, mode):
+        if mode == "incremental":
+            clf = sm._fit_incremental(user, X, labels, label_paths, hp)
+            if clf is None:
+                if sm.MODEL_FORMAT == "compact" and not sm.compact_model_path(user).exists():
+                    sm.export_compact(user)
+                return None
+            le = sk_preprocessing.LabelEncoder().fit(clf.classes_)
+        else:
+            le = sk_preprocessing.LabelEncoder()
+            y_enc = le.fit_transform(labels)
+            clf = sm.make_forest(hp["n_trees"], hp["max_depth"])
+            clf.fit(X, y_enc)
+        # single-clip inference is faster without the thread fan-out
+        clf.set_params(n_jobs=None)
+        return {"model": clf, "label_encoder": le, "train_mode": mode,
+                "feature_version": sm.feature_version()}
+
+    def save(self, user, bundle):
+        # write next to the old model and swap in one rename, so readers
+        # never see a half-written file
+        path = sm.model_path(user)
+        tmp = path.with_name(path.name + ".tmp")
+        joblib.dump(bundle, tmp)
+        os.replace(tmp, path)
+        if sm.MODEL_FORMAT == "compact":
+            sm.export_compact(user, bundle)
+
+    def load(self, path):
+        if path.suffix == ".npz":
+            model = cf.load(path)
+            return {"model": model, "classes": model.classes_,
+                    "feature_version": model.meta.get("feature_version")}
+        bundle = joblib.load(path)
+        bundle = dict(bundle)
+        bundle["classes"] = bundle["label_encoder"].classes_
+        return bundle
+
+
+# ===== Prototype / nearest neighbour =====
+class PrototypeMatcher:
+    """
+    Standardized, L2-normalized example rows (grouped by label) followed by
+    one centroid row per label, in a single float32 matrix.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.meta = json.loads(bytes(np.asarray(arrays["meta"])).decode("utf-8"))
+        self.mean = np.asarray(arrays["mean"], dtype=np.float32)
+        self.scale = np.asarray(arrays["scale"], dtype=np.float32)
+        self.matrix = arrays["matrix"]                 # (n_examples + n_classes, d)
+        self.starts = np.asarray(arrays["starts"])     # first example row of each label
+        self.classes_ = np.asarray(arrays["classes"]).astype(object)
+        self.paths = list(self.meta["paths"])          # example row -> file
+        self.digests = dict(self.meta["digests"])
+        self.feature_version = self.meta.get("feature_version")
+
+    @property
+    def n_examples(self) -> int:
+        return len(self.paths)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.matrix.nbytes + self.mean.nbytes + self.scale.nbytes)
+
+    def set_params(self, **params) -> "PrototypeMatcher":
+        return self
+
+    def embed(self, X: np.ndarray) -> np.ndarray:
+        Z = (np.asarray(X, dtype=np.float32) - self.mean) / self.scale
+        return Z / np.maximum(np.linalg.norm(Z, axis=1, keepdims=True), 1e-12)
+
+    def scores(self, X: np.ndarray) -> np.ndarray:
+        """(n, n_classes) label scores: blend of centroid and best-example cosine similarity."""
+        S = self.embed(X) @ self.matrix.T              # one product for examples + centroids
+        n = self.n_examples
+        best = np.maximum.reduceat(S[:, :n], self.starts, axis=1)
+        w = PROTO_CENTROID_WEIGHT
+        return w * S[:, n:] + (1.0 - w) * best
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        s = self.scores(X) / PROTO_TEMPERATURE
+        s -= s.max(axis=1, keepdims=True)
+        e = np.exp(s)
+        return e / e.sum(axis=1, keepdims=True)
+
+
+def _unchanged_rows(prev, digests: Dict[str, str]) -> Dict[str, tuple]:
+    """label -> (start, end) rows of `prev` whose example set has the same digest."""
+    rows: Dict[str, tuple] = {}
+    if prev is not None:
+        ends = list(prev.starts[1:]) + [prev.n_examples]
+        for lbl, s, e in zip(prev.classes_, prev.starts, ends):
+            if prev.digests.get(lbl) == digests.get(lbl):
+                rows[str(lbl)] = (s, e)
+    return rows
+
+
+def build_prototypes(X: np.ndarray, labels: np.ndarray, label_paths: Dict[str, List[str]],
+                     feature_version: str, prev: Optional[PrototypeMatcher] = None) -> Dict[str, np.ndarray]:
+    """
+    Arrays for a PrototypeMatcher. With `prev`, its standardization and the
+    rows of every label whose example set is unchanged are kept; only new
+    or changed labels are embedded.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    classes = sorted(label_paths)
+    digests = {lbl: incremental.label_digest(label_paths[lbl]) for lbl in classes}
+    old_rows = _unchanged_rows(prev, digests)
+    if old_rows:
+        # kept rows are only comparable under the same standardization
+        mean, scale = prev.mean, prev.scale
+    else:
+        mean = X.mean(axis=0)
+        scale = X.std(axis=0)
+        scale = np.where(scale > 1e-6, scale, 1.0).astype(np.float32)
+
+    blocks, paths, starts = [], [], []
+    for lbl in classes:
+        starts.append(sum(len(b) for b in blocks))
+        if lbl in old_rows:
+            s, e = old_rows[lbl]
+            blocks.append(np.asarray(prev.matrix[s:e]))
+            paths.extend(prev.paths[s:e])
+            continue
+        Z = (X[labels == lbl] - mean) / scale
+        blocks.append(Z / np.maximum(np.linalg.norm(Z, axis=1, keepdims=True), 1e-12))
+        paths.extend(label_paths[lbl])
+
+    examples = np.vstack(blocks).astype(np.float32)
+    centroids = np.vstack([examples[s:s + len(b)].mean(axis=0) for s, b in zip(starts, blocks)])
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    meta = {
+        "format": PROTO_FORMAT_VERSION,
+        "feature_version": feature_version,
+        "paths": paths,
+        "digests": digests,
+        "reused": sorted(old_rows),
+    }
+    return {
+        "meta": np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+        "mean": mean.astype(np.float32),
+        "scale": scale.astype(np.float32),
+        "matrix": np.vstack([examples, centroids]).astype(np.float32),
+        "starts": np.asarray(starts, dtype=np.int64),
+        "classes": np.asarray(classes, dtype=np.str_),
+    }
+
+
+class PrototypeEngine(MatcherEngine):
+    name = "prototype"
+
+    def model_files(self, user: str) -> List[Path]:
+        return [sm.prototype_model_path(user)]
+
+    def prediction_file(self, user: str) -> Optional[Path]:
+        path = sm.prototype_model_path(user)
+        return path if path.exists() else None
+
+    def train(self, user, X, labels, label_paths, hp, mode):
+        prev = None
+        path = sm.prototype_model_path(user)
+        if path.exists():
+            prev = self.load(path)["model"]
+            if prev.feature_version != sm.feature_version():
+                prev = None
+        if prev is not None and prev.digests == {
+                lbl: incremental.label_digest(p) for lbl, p in label_paths.items()}:
+            return None
+        arrays = build_prototypes(X, labels, label_paths, sm.feature_version(), prev)
+        reused = json.loads(bytes(arrays["meta"]).decode("utf-8"))["reused"]
+        if prev is not None:
+            print(f"  prototype: kept {len(reused)} labels, embedded {len(label_paths) - len(reused)}")
+        return {"arrays": arrays}
+
+    def save(self, user, bundle):
+        cf.save(sm.prototype_model_path(user), bundle["arrays"])
+
+    def load(self, path):
+        model = PrototypeMatcher(cf._mmap_npz(path))
+        if model.meta.get("format") != PROTO_FORMAT_VERSION:
+            raise ValueError(f"unsupported prototype model format {model.meta.get('format')}")
+        return {"model": model, "classes": model.classes_, "feature_version": model.feature_version}
+
+
+# ===== DTW templates =====
+def _outside(x: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    """Squared distance of x from the [lower, upper] envelope, elementwise."""
+    gap = np.maximum(x - upper, 0.0) + np.maximum(lower - x, 0.0)
+    return gap * gap
+
+
+def _envelope(x: np.ndarray, r: int):
+    """Running max / min over +-r frames of an (L, d) sequence."""
+    padded = np.pad(x, ((r, r), (0, 0)), mode="edge")
+    win = np.lib.stride_tricks.sliding_window_view(padded, 2 * r + 1, axis=0)
+    return win.max(axis=-1), win.min(axis=-1)
+
+
+class DTWMatcher:
+    """
+    Standardized MFCC sequences (n, L, d) in float16, grouped by label, plus
+    each template's per-segment means for the coarse lower bound.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.meta = json.loads(bytes(np.asarray(arrays["meta"])).decode("utf-8"))
+        self.mean = np.asarray(arrays["mean"], dtype=np.float32)
+        self.scale = np.asarray(arrays["scale"], dtype=np.float32)
+        self.templates = arrays["templates"]           # (n, L, d) float16
+        self.seg_means = arrays["seg_means"]           # (n, L // DTW_SEGMENT, d) float32
+        self.starts = np.asarray(arrays["starts"])
+        self.classes_ = np.asarray(arrays["classes"]).astype(object)
+        self.label_of = np.repeat(np.arange(len(self.starts)),
+                                  np.diff(np.append(self.starts, len(self.templates))))
+        self.paths = list(self.meta["paths"])
+        self.digests = dict(self.meta["digests"])
+        self.feature_version = self.meta.get("feature_version")
+        self.band = int(self.meta["band"])
+        self.counts = {"queries": 0, "templates": 0, "lb_keogh": 0, "aligned": 0, "abandoned": 0}
+
+    @property
+    def n_examples(self) -> int:
+        return len(self.paths)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.templates.nbytes + self.seg_means.nbytes)
+
+    def set_params(self, **params) -> "DTWMatcher":
+        return self
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        D = np.stack([self.distances(x) for x in np.asarray(X, dtype=np.float32)])
+        s = -D / DTW_TEMPERATURE
+        s -= s.max(axis=1, keepdims=True)
+        e = np.exp(s)
+        return e / e.sum(axis=1, keepdims=True)
+
+    def distances(self, x: np.ndarray, exhaustive: bool = False) -> np.ndarray:
+        """
+        Per-label DTW distance (per frame) from one flattened sequence to the
+        label's closest template. Labels that cannot come within
+        DTW_PRUNE_NATS of the best one are left at a larger value (inf if
+        none of their templates was aligned). Past DTW_MAX_ALIGNED aligned
+        templates the search stops, so with very many similar templates a
+        label's distance may be slightly overestimated. `exhaustive` aligns
+        every template instead.
+        """
+        n, L, d = self.templates.shape
+        q = (x.reshape(L, d) - self.mean) / self.scale
+        best = np.full(len(self.classes_), np.inf)
+        self.counts["queries"] += 1
+        self.counts["templates"] += n
+        if exhaustive:
+            T = np.asarray(self.templates, dtype=np.float32)
+            np.minimum.at(best, self.label_of, self._align(q, T, np.full(n, np.inf)))
+            return best / L
+
+        upper, lower = _envelope(q, self.band)
+        margin = DTW_PRUNE_NATS * DTW_TEMPERATURE * L
+
+        def limit(idx):
+            return np.minimum(best[self.label_of[idx]], best.min() + margin)
+
+        # coarse bound over every template: LB_Keogh of the segment means
+        # (a lower bound of LB_Keogh, since the squared gap is convex)
+        k = self.seg_means.shape[1]
+        seg_upper = upper[:k * DTW_SEGMENT].reshape(k, DTW_SEGMENT, d).max(axis=1)
+        seg_lower = lower[:k * DTW_SEGMENT].reshape(k, DTW_SEGMENT, d).min(axis=1)
+        lb0 = DTW_SEGMENT * _outside(self.seg_means, seg_lower, seg_upper).sum(axis=(1, 2)) / d
+        order = np.argsort(lb0, kind="stable")
+
+        # most promising first, in growing batches so the bounds tighten
+        # early: LB_Keogh per template frame, then exact DTW with early
+        # abandoning, until the coarse bound rules out everything left or
+        # DTW_MAX_ALIGNED templates were aligned
+        pos, size, budget = 0, DTW_BATCH, DTW_MAX_ALIGNED
+        while pos < n and budget > 0 and lb0[order[pos]] < best.min() + margin:
+            cand = order[pos:pos + size]
+            pos, size = pos + size, size * 2
+            cand = cand[lb0[cand] < limit(cand)]
+            if not cand.size:
+                continue
+            self.counts["lb_keogh"] += len(cand)
+            T = np.asarray(self.templates[cand], dtype=np.float32)
+            lb_frames = _outside(T, lower, upper).sum(axis=2) / d      # (c, L)
+            lb = lb_frames.sum(axis=1)
+            sel = np.argsort(lb, kind="stable")[:budget]
+            lim = limit(cand[sel])
+            sel, lim = sel[lb[sel] < lim], lim[lb[sel] < lim]
+            if sel.size:
+                budget -= len(sel)
+                D = self._align(q, T[sel], lim, lb_frames[sel])
+                np.minimum.at(best, self.label_of[cand[sel]], D)
+        return best / L
+
+    def _align(self, q: np.ndarray, T: np.ndarray, limit: np.ndarray,
+               lb_frames: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Banded DTW cost of q against the (B, L, d) templates T, all at once:
+        one DP row per query frame, vectorized over templates, only the
+        2 * band + 1 cells of the band kept. A template is abandoned (inf)
+        once its cheapest partial path plus the LB_Keogh of the template
+        frames no path has reached yet is at least its limit.
+        """
+        B, L, d = T.shape
+        r = self.band
+        w = 2 * r + 1
+        # band cell (i, k) compares query frame i with template frame i - r + k
+        jj = np.arange(L)[:, None] - r + np.arange(w)[None, :]
+        valid = (jj >= 0) & (jj < L)
+        jj = np.clip(jj, 0, L - 1)
+        G = (T.reshape(B * L, d) @ q.T).reshape(B, L, L)              # template frame x query frame
+        tt = np.sum(T * T, axis=2)
+        C = (np.sum(q * q, axis=1)[:, None, None] + tt[:, jj].transpose(1, 2, 0)
+             - 2.0 * G[:, jj, np.arange(L)[:, None]].transpose(1, 2, 0)) / d
+        np.maximum(C, 0.0, out=C)
+        C[~valid] = np.inf                                              # (L, w, B)
+        # after query row i, template frames > i + r are still unmatched
+        rest = np.zeros((L + 1, B), dtype=np.float32)
+        if lb_frames is not None:
+            tail = np.cumsum(lb_frames[:, ::-1], axis=1)[:, ::-1].T   # tail[j] = sum of frames >= j
+            rest[:L - r - 1] = tail[r + 1:]
+
+        live = np.arange(B)
+        alive = np.ones(B, dtype=bool)
+        limit = np.asarray(limit, dtype=np.float64)
+        prev = np.full((w + 1, B), np.inf, dtype=np.float32)   # last row is an inf sentinel
+        prev[r] = 0.0                                          # the virtual cell (-1, -1)
+        for i in range(L):
+            cur = np.full((w + 1, len(live)), np.inf, dtype=np.float32)
+            ci = C[i]
+            cur[0] = ci[0] + np.minimum(prev[0], prev[1])
+            for k in range(1, w):
+                cur[k] = ci[k] + np.minimum(np.minimum(prev[k], prev[k + 1]), cur[k - 1])
+            prev = cur
+            alive &= cur.min(axis=0) + rest[i] < limit
+            if not alive.any():
+                break
+            if alive.sum() < len(alive) // 2:
+                # compact once enough templates were abandoned
+                live, C, prev, rest, limit = (live[alive], C[:, :, alive], prev[:, alive],
+                                              rest[:, alive], limit[alive])
+                alive = np.ones(len(live), dtype=bool)
+        out = np.full(B, np.inf)
+        out[live[alive]] = prev[r, alive]
+        self.counts["aligned"] += B
+        self.counts["abandoned"] += B - int(alive.sum())
+        return out
+
+
+def build_templates(X: np.ndarray, labels: np.ndarray, label_paths: Dict[str, List[str]],
+                    feature_version: str, band: int = DTW_BAND,
+                    prev: Optional[DTWMatcher] = None) -> Dict[str, np.ndarray]:
+    """
+    Arrays for a DTWMatcher from flattened "sequence" features. With `prev`,
+    X / labels only need the rows of new or changed labels: the rows (and
+    standardization) of unchanged labels are taken from it.
+    """
+    L, d = features.SEQ_FRAMES, features.N_MFCC
+    X = np.asarray(X, dtype=np.float32).reshape(len(X), L, d)
+    labels = np.asarray(labels)
+    digests = {lbl: incremental.label_digest(p) for lbl, p in label_paths.items()}
+    old_rows = _unchanged_rows(prev, digests)
+    # a changed label whose files were all unreadable has no rows: leave it out
+    classes = [lbl for lbl in sorted(label_paths) if lbl in old_rows or np.any(labels == lbl)]
+    if not classes:
+        raise ValueError("no readable examples to build DTW templates from")
+    digests = {lbl: digests[lbl] for lbl in classes}
+    if old_rows:
+        mean, scale = prev.mean, prev.scale
+    else:
+        mean = X.reshape(-1, d).mean(axis=0)
+        scale = X.reshape(-1, d).std(axis=0)
+        scale = np.where(scale > 1e-6, scale, 1.0).astype(np.float32)
+
+    blocks, paths, starts = [], [], []
+    for lbl in classes:
+        starts.append(sum(len(b) for b in blocks))
+        if lbl in old_rows:
+            s, e = old_rows[lbl]
+            blocks.append(np.asarray(prev.templates[s:e]))
+            paths.extend(prev.paths[s:e])
+            continue
+        blocks.append(((X[labels == lbl] - mean) / scale).astype(np.float16))
+        paths.extend(label_paths[lbl])
+
+    T = np.concatenate(blocks).astype(np.float16)
+    k = L // DTW_SEGMENT
+    seg_means = T[:, :k * DTW_SEGMENT].astype(np.float32).reshape(len(T), k, DTW_SEGMENT, d).mean(axis=2)
+    meta = {
+        "format": DTW_FORMAT_VERSION,
+        "feature_version": feature_version,
+        "band": band,
+        "paths": paths,
+        "digests": digests,
+        "reused": sorted(old_rows),
+    }
+    return {
+        "meta": np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+        "mean": mean.astype(np.float32),
+        "scale": scale.astype(np.float32),
+        "templates": T,
+        "seg_means": seg_means,
+        "starts": np.asarray(starts, dtype=np.int64),
+        "classes": np.asarray(classes, dtype=np.str_),
+    }
+
+
+class DTWEngine(MatcherEngine):
+    name = "dtw"
+    feature_mode = "sequence"
+
+    def model_files(self, user: str) -> List[Path]:
+        return [sm.dtw_model_path(user)]
+
+    def prediction_file(self, user: str) -> Optional[Path]:
+        path = sm.dtw_model_path(user)
+        return path if path.exists() else None
+
+    def train(self, user, X, labels, label_paths, hp, mode):
+        version = sm.feature_version("sequence")
+        prev = None
+        path = sm.dtw_model_path(user)
+        if path.exists():
+            prev = self.load(path)["model"]
+            if prev.feature_version != version or prev.band != DTW_BAND:
+                prev = None
+        digests = {lbl: incremental.label_digest(p) for lbl, p in label_paths.items()}
+        if prev is not None and prev.digests == digests:
+            return None
+
+        # X holds the (cached) sequences; only changed labels are re-embedded
+        kept = _unchanged_rows(prev, digests)
+        todo = ~np.isin(labels, list(kept))
+        arrays = build_templates(X[todo], labels[todo], label_paths, version, DTW_BAND, prev)
+        if prev is not None:
+            print(f"  dtw: kept {len(kept)} labels, rebuilt {int(todo.sum())} templates")
+        return {"arrays": arrays}
+
+    def save(self, user, bundle):
+        cf.save(sm.dtw_model_path(user), bundle["arrays"])
+
+    def load(self, path):
+        model = DTWMatcher(cf._mmap_npz(path))
+        if model.meta.get("format") != DTW_FORMAT_VERSION:
+            raise ValueError(f"unsupported DTW model format {model.meta.get('format')}")
+        return {"model": model, "classes": model.classes_, "feature_version": model.feature_version}
+
+
+ENGINES: Dict[str, MatcherEngine] = {e.name: e for e in (ForestEngine(), PrototypeEngine(), DTWEngine())}
+
+
+def get(name: str) -> MatcherEngine:
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError(f"unknown matcher engine {name!r} (choose from {', '.join(ENGINES)})")
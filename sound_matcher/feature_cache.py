@@ -0,0 +1,224 @@
+"""
+feature_cache.py
+
+Persistent per-example feature cache for sound_matcher.
+
+Each user gets one file (sound_profiles/features/<user>.npz) holding the
+feature vector of every example that has been featurized, keyed by:
+ - the example's path
+ - the file's size and mtime (cheap check, done on every lookup)
+ - a SHA-1 of the file contents (only re-checked when size/mtime moved)
+ - the feature-pipeline version that produced the vector
+
+A retrain therefore only decodes and featurizes new or changed WAVs.
+
+Several writers share the file (uploads, retrains, storage.py), so each
+FeatureCache records its own puts / evictions and save() replays them, under
+the lock it was given, on top of whatever is on disk by then: a retrain
+saving its cache cannot drop the features an upload stored meanwhile.
+
+Entries restored from a features-only snapshot (snapshot.py) have no audio
+on this device; they carry mtime DETACHED_MTIME and are served while their
+file is absent. If the file appears later, the usual hash check applies.
+"""
+
+import contextlib
+import hashlib
+import os
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+import numpy as np
+
+HASH_CHUNK = 1 << 20
+DETACHED_MTIME = -1     # entry restored without its audio file
+
+
+def file_sha1(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FeatureCache:
+    """
+    In-memory view of one user's cache file. Call save() to persist;
+    nothing is written unless an entry was added or evicted.
+    """
+
+    def __init__(self, path: Path, version: str, lock: Optional[Callable] = None):
+        self.path = Path(path)
+        self.version = version
+        self.lock = lock or contextlib.nullcontext
+        # path -> {"size", "mtime", "sha1", "version", "feats"}
+        self.entries: Dict[str, dict] = {}
+        self.changes: Dict[str, Optional[dict]] = {}   # path -> entry, None = evicted
+        self._disk = None           # (inode, size, mtime) of the file as loaded
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _load(self) -> None:
+        self.entries = {}
+        self._disk = self._stat()
+        if self._disk is None:
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as z:
+                paths = z["paths"]
+                sizes = z["sizes"]
+                mtimes = z["mtimes"]
+                hashes = z["hashes"]
+                versions = z["versions"]
+                feats = z["feats"]
+        except Exception:
+            # unreadable cache is not fatal; it will be rebuilt
+            self.dirty = True
+            return
+
+        for i, p in enumerate(paths):
+            self.entries[str(p)] = {
+                "size": int(sizes[i]),
+                "mtime": int(mtimes[i]),
+                "sha1": str(hashes[i]),
+                "version": str(versions[i]),
+                "feats": feats[i],
+            }
+
+    def get(self, path: Path) -> Optional[np.ndarray]:
+        """Return cached features for path, or None if missing/stale."""
+        key = str(path)
+        ent = self.entries.get(key)
+        if ent is None or ent["version"] != self.version:
+            self.misses += 1
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            if ent["mtime"] == DETACHED_MTIME:
+                self.hits += 1
+                return ent["feats"]
+            self.misses += 1
+            return None
+
+        if st.st_size == ent["size"] and st.st_mtime_ns == ent["mtime"]:
+            self.hits += 1
+            return ent["feats"]
+
+        # size/mtime moved (copied, touched): fall back to the content hash
+        if st.st_size == ent["size"] and file_sha1(path) == ent["sha1"]:
+            ent["mtime"] = st.st_mtime_ns
+            self.changes[key] = ent
+            self.dirty = True
+            self.hits += 1
+            return ent["feats"]
+
+        self.misses += 1
+        return None
+
+    def detached(self, path: Path) -> bool:
+        """True if path's entry was restored without audio and the file is still absent."""
+        ent = self.entries.get(str(path))
+        return ent is not None and ent["mtime"] == DETACHED_MTIME and not os.path.exists(path)
+
+    def move(self, old: Path, new: Path) -> bool:
+        """
+        Re-key old's entry to new, a file with the same audio in another
+        container (see storage.py). Returns False if old had no entry.
+        """
+        ent = self.entries.pop(str(old), None)
+        if ent is None:
+            return False
+        st = os.stat(new)
+        ent.update(size=int(st.st_size), mtime=int(st.st_mtime_ns), sha1=file_sha1(new))
+        self.entries[str(new)] = ent
+        self.changes[str(old)] = None
+        self.changes[str(new)] = ent
+        self.dirty = True
+        return True
+
+    def put(self, path: Path, feats: np.ndarray) -> None:
+        st = os.stat(path)
+        self.set_entry(path, {
+            "size": int(st.st_size),
+            "mtime": int(st.st_mtime_ns),
+            "sha1": file_sha1(path),
+            "version": self.version,
+            "feats": np.asarray(feats, dtype=np.float32),
+        })
+
+    def set_entry(self, path: Path, ent: dict) -> None:
+        """Store a complete entry as is (e.g. restored from a snapshot)."""
+        self.entries[str(path)] = ent
+        self.changes[str(path)] = ent
+        self.dirty = True
+
+    def evict(self, paths: Iterable) -> int:
+        n = 0
+        for p in paths:
+            if self.entries.pop(str(p), None) is not None:
+                self.changes[str(p)] = None
+                n += 1
+        if n:
+            self.dirty = True
+        return n
+
+    def retain(self, paths: Iterable) -> int:
+        """Evict every entry whose path is not in `paths`."""
+        keep = set(str(p) for p in paths)
+        return self.evict([p for p in self.entries if p not in keep])
+
+    def save(self) -> None:
+        """Write this cache's changes, merged onto the current file, under the lock."""
+        if not self.dirty:
+            return
+        with self.lock():
+            if self._stat() != self._disk:
+                # someone else saved since we loaded: start from their file
+                self._load()
+                for key, ent in self.changes.items():
+                    if ent is None:
+                        self.entries.pop(key, None)
+                    else:
+                        self.entries[key] = ent
+            self._write()
+            self._disk = self._stat()
+        self.changes = {}
+        self.dirty = False
+
+    def _write(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        keys = list(self.entries)
+        dims = {len(self.entries[k]["feats"]) for k in keys}
+        if len(dims) > 1:
+            # mixed pipeline versions with different dims: keep current only
+            keys = [k for k in keys if self.entries[k]["version"] == self.version]
+
+        if keys:
+            feats = np.vstack([self.entries[k]["feats"] for k in keys]).astype(np.float32)
+        else:
+            feats = np.zeros((0, 0), dtype=np.float32)
+
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as fh:
+            np.savez(
+                fh,
+                paths=np.array(keys, dtype=str),
+                sizes=np.array([self.entries[k]["size"] for k in keys], dtype=np.int64),
+                mtimes=np.array([self.entries[k]["mtime"] for k in keys], dtype=np.int64),
+                hashes=np.array([self.entries[k]["sha1"] for k in keys], dtype=str),
+                versions=np.array([self.entries[k]["version"] for k in keys], dtype=str),
+                feats=feats,
+            )
+        os.replace(tmp, self.path)
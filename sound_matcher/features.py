@@ -0,0 +1,541 @@
+"""
+features.py
+
+Pure-NumPy version of the MFCC + delta statistics used by sound_matcher,
+vectorized over a batch of clips.
+
+extract_features_batch() takes an (N, T) array of already preprocessed
+(trimmed, normalized, padded) clips and runs STFT -> mel -> dB -> DCT ->
+delta -> mean/std for all of them with a handful of matrix operations.
+The mel basis, DCT matrix and analysis window are built once and reused.
+Output matches librosa.feature.mfcc / librosa.feature.delta with the
+library defaults (n_fft=2048, hop=512, 128 mels, top_db=80, width=9,
+mode="interp") up to float32 rounding.
+
+extract_sequences() keeps the MFCC frames themselves, resampled to
+SEQ_FRAMES, for the DTW template engine.
+
+FrameCache / window_features() reuse frames across overlapping windows of
+a live stream (continuous.py); StreamingFeatures computes the frames of a
+single utterance while it is being recorded (listen_once).
+"""
+
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+
+import lazy_import
+
+scipy_fft = lazy_import.lazy("scipy.fft")
+scipy_signal = lazy_import.lazy("scipy.signal")
+
+N_FFT = 2048
+HOP_LENGTH = 512
+N_MELS = 128
+N_MFCC = 20
+DELTA_WIDTH = 9
+TOP_DB = 80.0
+AMIN = 1e-10
+
+BATCH_CHUNK = 32        # clips per matrix pass; bounds peak memory
+SEQ_FRAMES = 32         # frames per time-normalized MFCC sequence (template matching)
+
+
+@lru_cache(maxsize=None)
+def mel_basis(sample_rate: int) -> np.ndarray:
+    """(n_fft//2+1, n_mels) slaney mel filterbank, transposed for X @ basis."""
+    import librosa
+    return np.ascontiguousarray(
+        librosa.filters.mel(sr=sample_rate, n_fft=N_FFT, n_mels=N_MELS).T.astype(np.float32)
+    )
+
+
+@lru_cache(maxsize=None)
+def dct_matrix() -> np.ndarray:
+    """(n_mels, n_mfcc) orthonormal DCT-II, transposed for X @ dct."""
+    m = scipy_fft.dct(np.eye(N_MELS), type=2, norm="ortho", axis=0)[:N_MFCC]
+    return np.ascontiguousarray(m.T.astype(np.float32))
+
+
+@lru_cache(maxsize=None)
+def hann_window() -> np.ndarray:
+    return scipy_signal.get_window("hann", N_FFT, fftbins=True).astype(np.float32)
+
+
+def frame_signals(Y: np.ndarray) -> np.ndarray:
+    """
+    (N, T) -> (N, n_frames, n_fft) centered, zero-padded analysis frames
+    (librosa center=True, pad_mode="constant").
+    """
+    pad = N_FFT // 2
+    Yp = np.pad(Y, ((0, 0), (pad, pad)))
+    frames = np.lib.stride_tricks.sliding_window_view(Yp, N_FFT, axis=1)[:, ::HOP_LENGTH]
+    return frames
+
+
+def mel_power(frames: np.ndarray, sample_rate: int) -> np.ndarray:
+    """(..., n_fft) frames -> (..., n_mels) mel power spectrum."""
+    spec = scipy_fft.rfft(frames * hann_window(), axis=-1)
+    power = spec.real ** 2 + spec.imag ** 2
+    return power.astype(np.float32, copy=False) @ mel_basis(sample_rate)
+
+
+def power_to_db(S: np.ndarray) -> np.ndarray:
+    """
+    (N, n_frames, n_mels) power -> dB, with top_db clipping per clip
+    (matches librosa.power_to_db(ref=1.0)).
+    """
+    S_db = 10.0 * np.log10(np.maximum(AMIN, S))
+    peak = S_db.max(axis=(1, 2), keepdims=True)
+    return np.maximum(S_db, peak - TOP_DB)
+
+
+def delta(mfcc: np.ndarray) -> np.ndarray:
+    """
+    First-order delta along the frame axis (axis=1), equal to
+    savgol_filter(width=9, polyorder=1, deriv=1, mode="interp").
+    """
+    half = DELTA_WIDTH // 2
+    n = mfcc.shape[1]
+    k = np.arange(-half, half + 1, dtype=np.float32)
+    denom = float(np.sum(k * k))
+
+    out = np.zeros_like(mfcc)
+    if n < DELTA_WIDTH:
+        return out
+    for i, kk in enumerate(k):
+        if kk:
+            out[:, half:n - half] += kk * mfcc[:, i:n - DELTA_WIDTH + 1 + i]
+    out /= denom
+    # "interp": edge frames take the slope of the first / last full window
+    out[:, :half] = out[:, half:half + 1]
+    out[:, n - half:] = out[:, n - half - 1:n - half]
+    return out
+
+
+def summarize(mfcc: np.ndarray, d: np.ndarray) -> np.ndarray:
+    """(N, n_frames, n_mfcc) mfcc + delta -> (N, 4 * n_mfcc) statistics."""
+    return np.concatenate(
+        [mfcc.mean(axis=1), mfcc.std(axis=1), d.mean(axis=1), d.std(axis=1)],
+        axis=1,
+    ).astype(np.float32)
+
+
+def extract_features_batch(Y: np.ndarray, sample_rate: int, chunk: int = BATCH_CHUNK) -> np.ndarray:
+    """
+    (N, T) preprocessed clips -> (N, 80) feature matrix. Clips are processed
+    `chunk` at a time so memory stays bounded for large N.
+    """
+    Y = np.asarray(Y, dtype=np.float32)
+    if Y.ndim == 1:
+        Y = Y[None, :]
+    out = np.zeros((len(Y), 4 * N_MFCC), dtype=np.float32)
+    for i in range(0, len(Y), chunk):
+        S = mel_power(frame_signals(Y[i:i + chunk]), sample_rate)
+        mfcc = power_to_db(S) @ dct_matrix()
+        out[i:i + chunk] = summarize(mfcc, delta(mfcc))
+    return out
+
+
+def extract_features_valid(clips, sample_rate: int, chunk: int = BATCH_CHUNK) -> np.ndarray:
+    """
+    Length-aware variant: clips are trimmed + normalized but NOT padded, and
+    only the 1 + len // HOP_LENGTH frames of each clip's own signal are
+    transformed and summarized. Clips of similar length are batched together
+    (zero-extended to the longest in the chunk; the extra frames are dropped).
+    Returns an (N, 80) matrix; clips shorter than DELTA_WIDTH frames get
+    zero deltas.
+    """
+    out = np.zeros((len(clips), 4 * N_MFCC), dtype=np.float32)
+    for j, mfcc in _valid_mfcc(clips, sample_rate, chunk):
+        out[j] = summarize(mfcc, delta(mfcc))[0]
+    return out
+
+
+def _valid_mfcc(clips, sample_rate: int, chunk: int):
+    """Yield (index, (1, n_frames, N_MFCC) mfcc) over each non-empty clip's own frames."""
+    order = np.argsort([len(y) for y in clips], kind="stable")
+    order = [i for i in order if len(clips[i])]
+    for i in range(0, len(order), chunk):
+        idx = order[i:i + chunk]
+        Y = np.zeros((len(idx), len(clips[idx[-1]])), dtype=np.float32)
+        for r, j in enumerate(idx):
+            Y[r, :len(clips[j])] = clips[j]
+        S = mel_power(frame_signals(Y), sample_rate)
+        for r, j in enumerate(idx):
+            yield j, power_to_db(S[r:r + 1, :1 + len(clips[j]) // HOP_LENGTH]) @ dct_matrix()
+
+
+def extract_sequences(clips, sample_rate: int, n_frames: int = SEQ_FRAMES,
+                      chunk: int = BATCH_CHUNK) -> np.ndarray:
+    """
+    Trimmed, unpadded clips -> (N, n_frames, N_MFCC) MFCC sequences, each
+    linearly resampled in time to n_frames (empty clips stay zero).
+    """
+    out = np.zeros((len(clips), n_frames, N_MFCC), dtype=np.float32)
+    pos = np.linspace(0.0, 1.0, n_frames)
+    for j, mfcc in _valid_mfcc(clips, sample_rate, chunk):
+        m = mfcc[0]
+        src = np.linspace(0.0, 1.0, len(m))
+        for k in range(N_MFCC):
+            out[j, :, k] = np.interp(pos, src, m[:, k])
+    return out
+
+
+# ===== Frame reuse for overlapping windows =====
+TRIM_DB = 30.0          # librosa.effects.trim(top_db=30) as used by preprocess_audio
+
+
+class FrameCache:
+    """
+    Mel power and RMS of the n_fft frames centered on the stream's global
+    hop grid (sample g * HOP_LENGTH), computed on demand from `read` and
+    kept in a ring of `capacity` frames. Overlapping windows over the same
+    stream ask for mostly the same frames, so each one is transformed once.
+
+    read(start, end) must return the stream samples [start, end) (absolute
+    indices); samples before the stream start are treated as zeros.
+    """
+
+    def __init__(self, read, sample_rate: int, capacity: int = 512):
+        self.read = read
+        self.sample_rate = sample_rate
+        self.capacity = int(capacity)
+        self.index = np.full(self.capacity, -1, dtype=np.int64)
+        self.mel = np.zeros((self.capacity, N_MELS), dtype=np.float32)
+        self.rms = np.zeros(self.capacity, dtype=np.float64)
+        self.computed = 0       # frames transformed (for reuse statistics)
+        self.requested = 0
+
+    def _samples(self, start: int, end: int) -> np.ndarray:
+        lead = max(0, -start)
+        y = np.asarray(self.read(max(start, 0), end), dtype=np.float32)
+        if lead or len(y) < end - start - lead:
+            y = np.concatenate([np.zeros(lead, dtype=np.float32), y,
+                                np.zeros(end - start - lead - len(y), dtype=np.float32)])
+        return y
+
+    def get(self, frames: np.ndarray):
+        """Global frame indices -> (mel power (n, n_mels), rms (n,))."""
+        frames = np.asarray(frames, dtype=np.int64)
+        slots = frames % self.capacity
+        missing = np.flatnonzero(self.index[slots] != frames)
+        self.requested += len(frames)
+        if len(missing):
+            g = frames[missing]
+            lo = int(g.min()) * HOP_LENGTH - N_FFT // 2
+            y = self._samples(lo, int(g.max()) * HOP_LENGTH + N_FFT // 2)
+            offs = (g * HOP_LENGTH - N_FFT // 2 - lo)[:, None] + np.arange(N_FFT)
+            fr = y[offs]
+            self.mel[slots[missing]] = mel_power(fr, self.sample_rate)
+            self.rms[slots[missing]] = np.sqrt(np.mean(fr.astype(np.float64) ** 2, axis=1))
+            self.index[slots[missing]] = g
+            self.computed += len(missing)
+        return self.mel[slots], self.rms[slots]
+
+
+def _segment_frames(y: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """n_fft frames of y (zero outside) centered at the given offsets into y."""
+    yp = np.pad(y, (N_FFT, N_FFT))
+    offs = (centers + N_FFT // 2)[:, None] + np.arange(N_FFT)
+    return yp[offs]
+
+
+def window_features(cache: FrameCache, start: int, end: int, target_len: int,
+                    pad: bool = True) -> np.ndarray:
+    """
+    Features of the stream window [start, end) exactly as
+    preprocess_audio() + extract_features_batch() would compute them (trim
+    to -TRIM_DB, peak normalize, zero-pad to target_len), but with every
+    frame that lies fully inside the trimmed signal taken from `cache`.
+    Only the frames that touch a trim edge are transformed here; frames
+    that lie entirely in the zero padding are known to be zero.
+    pad=False gives the length-aware features (extract_features_valid).
+    start and end must be multiples of HOP_LENGTH.
+    """
+    assert start % HOP_LENGTH == 0 and end % HOP_LENGTH == 0
+    half = N_FFT // 2
+    y = cache._samples(start, end)
+    n = end - start
+
+    # --- trim (librosa.effects.trim: rms frames, ref = max, center=True)
+    t = np.arange(1 + n // HOP_LENGTH)
+    centers = t * HOP_LENGTH
+    inner = (centers - half >= 0) & (centers + half <= n)
+    rms = np.empty(len(t))
+    if inner.any():
+        _, rms[inner] = cache.get(start // HOP_LENGTH + t[inner])
+    if (~inner).any():
+        fr = _segment_frames(y, centers[~inner])
+        rms[~inner] = np.sqrt(np.mean(fr.astype(np.float64) ** 2, axis=1))
+    mse = np.maximum(AMIN, rms ** 2)
+    voiced = np.flatnonzero(10.0 * np.log10(mse / mse.max()) > -TRIM_DB)
+    if len(voiced) == 0:
+        return np.zeros(4 * N_MFCC, dtype=np.float32)
+    a = int(voiced[0]) * HOP_LENGTH
+    b = min(n, (int(voiced[-1]) + 1) * HOP_LENGTH)
+    b = min(b, a + target_len)
+    seg = y[a:b]
+
+    peak = float(np.max(np.abs(seg))) if seg.size else 0.0
+    scale = 1.0 / peak if peak > 1e-6 else 1.0
+
+    # --- mel frames of the padded clip: cached / recomputed / zero
+    L = b - a
+    c = np.arange(1 + (target_len if pad else L) // HOP_LENGTH) * HOP_LENGTH
+    S = np.zeros((len(c), N_MELS), dtype=np.float32)
+    interior = (c - half >= 0) & (c + half <= L)
+    edge = ~interior & (c - half < L)
+    if interior.any():
+        S[interior], _ = cache.get((start + a) // HOP_LENGTH + c[interior] // HOP_LENGTH)
+    if edge.any():
+        S[edge] = mel_power(_segment_frames(seg, c[edge]), cache.sample_rate)
+    S *= np.float32(scale * scale)
+
+    mfcc = power_to_db(S[None]) @ dct_matrix()
+    return summarize(mfcc, delta(mfcc))[0]
+
+
+# ===== Streaming extraction for a single utterance =====
+def _reserve(a: np.ndarray, n: int) -> np.ndarray:
+    """a with room for at least n rows (capacity doubles, contents kept)."""
+    if n <= len(a):
+        return a
+    out = np.zeros((max(n, 2 * len(a)),) + a.shape[1:], dtype=a.dtype)
+    out[: len(a)] = a
+    return out
+
+
+class StreamingFeatures:
+    """
+    Incremental preprocess_audio() + MFCC/delta statistics for an
+    utterance that is still being recorded.
+
+    push() transforms every hop-grid frame as soon as its n_fft samples
+    have arrived (mel, log, DCT, and the delta once its 4 right neighbours
+    exist) and adds it to running sums of mfcc, mfcc^2, delta and delta^2.
+    summary(n) then returns the same 80-dim vector that
+    extract_features_batch(preprocess_audio(y[:n])) gives, with only
+    O(edge) new frame work:
+
+      * trim / peak come from per-frame RMS and per-hop max |y|;
+      * frames inside the trimmed signal are unchanged by trimming, and
+        peak normalisation only adds -20*log10(peak) dB to every bin, i.e.
+        shifts c0 (mfcc mean) and leaves std and deltas alone;
+      * the few frames touching a trim edge are transformed here, frames
+        in the zero padding are a known constant, and interior frames with
+        bins below the top_db floor are re-clipped individually.
+    """
+
+    def __init__(self, sample_rate: int, target_len: int, capacity_sec: float = 4.0,
+                 pad: bool = True):
+        self.sample_rate = sample_rate
+        self.target_len = int(target_len)
+        self.pad = pad          # False: length-aware features (extract_features_valid)
+        cap = int(capacity_sec * sample_rate)
+        nf = cap // HOP_LENGTH + 2
+        self._y = np.zeros(cap, dtype=np.float32)
+        self._blockmax = np.zeros(nf, dtype=np.float32)     # max |y| per hop block
+        self._rms = np.zeros(nf, dtype=np.float64)
+        self._db = np.zeros((nf, N_MELS), dtype=np.float32)  # unscaled log-mel
+        self._dbmax = np.zeros(nf, dtype=np.float32)
+        self._dbmin = np.zeros(nf, dtype=np.float32)
+        self._m = np.zeros((nf, N_MFCC), dtype=np.float64)
+        self._d = np.zeros((nf, N_MFCC), dtype=np.float64)
+        # prefix sums: _cm1[g] = sum of _m[:g], etc.
+        self._cm1 = np.zeros((nf + 1, N_MFCC))
+        self._cm2 = np.zeros((nf + 1, N_MFCC))
+        self._cd1 = np.zeros((nf + 1, N_MFCC))
+        self._cd2 = np.zeros((nf + 1, N_MFCC))
+        self.n = 0              # samples pushed
+        self.n_frames = 0       # frames whose n_fft window is complete
+        self.n_deltas = 0       # frames with a delta (all 4 right neighbours known)
+        self.edge_frames = 0    # frames transformed inside summary() (statistics)
+
+    # ----- incremental part -----
+    def push(self, x: np.ndarray) -> None:
+        x = np.asarray(x, dtype=np.float32).ravel()
+        if not x.size:
+            return
+        n_old, n = self.n, self.n + len(x)
+        self._y = _reserve(self._y, n)
+        self._y[n_old:n] = x
+        self.n = n
+
+        b0, b1 = n_old // HOP_LENGTH, n // HOP_LENGTH
+        if b1 > b0:
+            self._blockmax = _reserve(self._blockmax, b1)
+            blocks = self._y[b0 * HOP_LENGTH:b1 * HOP_LENGTH].reshape(-1, HOP_LENGTH)
+            self._blockmax[b0:b1] = np.abs(blocks).max(axis=1)
+
+        half = N_FFT // 2
+        nf = (n - half) // HOP_LENGTH + 1 if n >= half else 0
+        if nf > self.n_frames:
+            self._add_frames(self.n_frames, nf)
+        nd = nf - DELTA_WIDTH // 2
+        if nd > max(self.n_deltas, DELTA_WIDTH // 2):
+            self._add_deltas(max(self.n_deltas, DELTA_WIDTH // 2), nd)
+
+    def _frames(self, g: np.ndarray, n: int) -> np.ndarray:
+        """n_fft frames centered at hop-grid frames g of y[:n] (zero outside)."""
+        half = N_FFT // 2
+        lo = int(g[0]) * HOP_LENGTH - half
+        hi = int(g[-1]) * HOP_LENGTH + half
+        seg = self._y[max(lo, 0):min(hi, n)]
+        seg = np.pad(seg, (max(0, -lo), hi - lo - len(seg) - max(0, -lo)))
+        offs = ((g - g[0]) * HOP_LENGTH)[:, None] + np.arange(N_FFT)
+        return seg[offs]
+
+    def _add_frames(self, g0: int, g1: int) -> None:
+        for name in ("_rms", "_db", "_dbmax", "_dbmin", "_m", "_d"):
+            setattr(self, name, _reserve(getattr(self, name), g1))
+        for name in ("_cm1", "_cm2", "_cd1", "_cd2"):
+            setattr(self, name, _reserve(getattr(self, name), g1 + 1))
+        fr = self._frames(np.arange(g0, g1), self.n)
+        db = 10.0 * np.log10(np.maximum(AMIN, mel_power(fr, self.sample_rate)))
+        m = (db @ dct_matrix()).astype(np.float64)
+        self._rms[g0:g1] = np.sqrt(np.mean(fr.astype(np.float64) ** 2, axis=1))
+        self._db[g0:g1] = db
+        self._dbmax[g0:g1] = db.max(axis=1)
+        self._dbmin[g0:g1] = db.min(axis=1)
+        self._m[g0:g1] = m
+        self._cm1[g0 + 1:g1 + 1] = self._cm1[g0] + np.cumsum(m, axis=0)
+        self._cm2[g0 + 1:g1 + 1] = self._cm2[g0] + np.cumsum(m * m, axis=0)
+        self.n_frames = g1
+
+    def _add_deltas(self, g0: int, g1: int) -> None:
+        half = DELTA_WIDTH // 2
+        k = np.arange(-half, half + 1)
+        d = np.zeros((g1 - g0, N_MFCC))
+        for kk in k:
+            if kk:
+                d += kk * self._m[g0 + kk:g1 + kk]
+        d /= float(np.sum(k * k))
+        self._d[g0:g1] = d
+        self._cd1[g0 + 1:g1 + 1] = self._cd1[g0] + np.cumsum(d, axis=0)
+        self._cd2[g0 + 1:g1 + 1] = self._cd2[g0] + np.cumsum(d * d, axis=0)
+        self.n_deltas = g1
+
+    # ----- summary -----
+    def _trim(self, n: int):
+        """librosa.effects.trim(y[:n], top_db=TRIM_DB) bounds, or None if nothing is voiced."""
+        half = N_FFT // 2
+        T = 1 + n // HOP_LENGTH
+        k = min(T, self.n_frames, (n - half) // HOP_LENGTH + 1 if n >= half else 0)
+        rms = np.empty(T)
+        rms[:k] = self._rms[:k]
+        if k < T:
+            fr = self._frames(np.arange(k, T), n)
+            rms[k:] = np.sqrt(np.mean(fr.astype(np.float64) ** 2, axis=1))
+        mse = np.maximum(AMIN, rms ** 2)
+        voiced = np.flatnonzero(10.0 * np.log10(mse / mse.max()) > -TRIM_DB)
+        if len(voiced) == 0:
+            return None
+        a = int(voiced[0]) * HOP_LENGTH
+        b = min(n, (int(voiced[-1]) + 1) * HOP_LENGTH, a + self.target_len)
+        return a, b
+
+    def summary(self, n: Optional[int] = None) -> np.ndarray:
+        """Feature vector of the first n pushed samples (default: all of them)."""
+        n = self.n if n is None else min(int(n), self.n)
+        bounds = self._trim(n) if n else None
+        if bounds is None:
+            return np.zeros(4 * N_MFCC, dtype=np.float32)
+        a, b = bounds
+        L = b - a
+        g0 = a // HOP_LENGTH
+        half = N_FFT // 2
+        hw = DELTA_WIDTH // 2
+        dct = dct_matrix().astype(np.float64)
+        u = dct.sum(axis=0)                     # mfcc of a constant 1 dB
+
+        full = b // HOP_LENGTH
+        peak = float(self._blockmax[g0:full].max()) if full > g0 else 0.0
+        if b > full * HOP_LENGTH:
+            peak = max(peak, float(np.abs(self._y[max(a, full * HOP_LENGTH):b]).max()))
+        shift = -20.0 * np.log10(peak) if peak > 1e-6 else 0.0
+
+        # clip frame j is centered at a + j*HOP: [0, lo) and [hi, pad) touch a
+        # trim edge, [lo, hi) are stream frames g0 + j, [pad, J) are all zero
+        J = 1 + (self.target_len if self.pad else L) // HOP_LENGTH
+        lo = min(2, J)
+        hi = max(lo, min(J, (L - half) // HOP_LENGTH + 1)) if L >= half else lo
+        pad = min(J, max(hi, -(-(L + half) // HOP_LENGTH)))
+        edge_j = np.concatenate([np.arange(0, lo), np.arange(hi, pad)]).astype(np.int64)
+        edge_db = np.zeros((0, N_MELS), dtype=np.float32)
+        if len(edge_j):
+            seg = self._y[a:b]
+            edge_db = 10.0 * np.log10(np.maximum(AMIN, mel_power(
+                _segment_frames(seg, edge_j * HOP_LENGTH), self.sample_rate)))
+            self.edge_frames += len(edge_j)
+
+        top = max(float(self._dbmax[g0 + lo:g0 + hi].max()) if hi > lo else -np.inf,
+                  float(edge_db.max()) if len(edge_db) else -np.inf)
+        floor = top - TOP_DB                                 # unscaled dB
+        pad_db = max(10.0 * np.log10(AMIN) - shift, floor)   # zeros stay at AMIN after scaling
+        pad_row = pad_db * u
+        edge_rows = np.maximum(edge_db, floor).astype(np.float64) @ dct
+        corr_j = lo + np.flatnonzero(self._dbmin[g0 + lo:g0 + hi] < floor)
+        corr_rows = np.maximum(self._db[g0 + corr_j], floor).astype(np.float64) @ dct
+
+        def rows(js: np.ndarray) -> np.ndarray:
+            out = np.empty((len(js), N_MFCC))
+            inner = (js >= lo) & (js < hi)
+            out[inner] = self._m[g0 + js[inner]]
+            out[js >= pad] = pad_row
+            e = ~inner & (js < pad)
+            out[e] = edge_rows[np.searchsorted(edge_j, js[e])]
+            c = np.isin(js, corr_j)
+            out[c] = corr_rows[np.searchsorted(corr_j, js[c])]
+            return out
+
+        # mfcc sums: cached interior (re-clipped where needed) + edges + padding
+        s1 = self._cm1[g0 + hi] - self._cm1[g0 + lo]
+        s2 = self._cm2[g0 + hi] - self._cm2[g0 + lo]
+        raw = self._m[g0 + corr_j]
+        s1 += corr_rows.sum(axis=0) - raw.sum(axis=0) + edge_rows.sum(axis=0) + (J - pad) * pad_row
+        s2 += ((corr_rows ** 2).sum(axis=0) - (raw ** 2).sum(axis=0)
+               + (edge_rows ** 2).sum(axis=0) + (J - pad) * pad_row ** 2)
+
+        # delta sums over the core [hw, J - hw); the hw frames at each end
+        # repeat the first / last core value ("interp")
+        d1 = np.zeros(N_MFCC)
+        d2 = np.zeros(N_MFCC)
+        if J >= DELTA_WIDTH:
+            k = np.arange(-hw, hw + 1)
+            denom = float(np.sum(k * k))
+
+            def deltas(js: np.ndarray) -> np.ndarray:
+                z = rows((js[:, None] + k).ravel()).reshape(len(js), len(k), N_MFCC)
+                return np.einsum("k,jkm->jm", k.astype(np.float64), z) / denom
+
+            c0, c1 = max(hw, lo + hw), min(J - hw, hi - hw)   # all 9 frames cached
+            z0 = max(hw, pad + hw)                            # all 9 frames padding
+            clean = np.zeros(J, dtype=bool)
+            if c1 > c0:
+                clean[c0:c1] = True
+                for j in corr_j:
+                    clean[max(0, j - hw):j + hw + 1] = False
+            core = np.arange(hw, J - hw)
+            todo = core[~clean[core] & (core < z0)]
+            if c1 > c0:
+                cj = np.arange(c0, c1)[~clean[c0:c1]]
+                d1 += self._cd1[g0 + c1] - self._cd1[g0 + c0] - self._d[g0 + cj].sum(axis=0)
+                d2 += self._cd2[g0 + c1] - self._cd2[g0 + c0] - (self._d[g0 + cj] ** 2).sum(axis=0)
+            if len(todo):
+                d = deltas(todo)
+                d1 += d.sum(axis=0)
+                d2 += (d ** 2).sum(axis=0)
+            ends = deltas(np.array([hw, J - hw - 1]))
+            d1 += hw * ends.sum(axis=0)
+            d2 += hw * (ends ** 2).sum(axis=0)
+
+        mean = s1 / J
+        dmean = d1 / J
+        return np.concatenate([
+            mean + shift * u,
+            np.sqrt(np.maximum(s2 / J - mean ** 2, 0.0)),
+            dmean,
+            np.sqrt(np.maximum(d2 / J - dmean ** 2, 0.0)),
+        ]).astype(np.float32)
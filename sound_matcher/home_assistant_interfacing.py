@@ -1,24 +1,236 @@
+"""
+home_assistant_interfacing.py
+
+Home Assistant client used to run a script when a command is detected.
+
+ - one keep-alive requests.Session per client (no TCP/TLS handshake per call)
+ - separate connect / read timeouts
+ - bounded retries with exponential backoff; only for failures where HA
+   cannot have run the script yet (connect timeout / connection refused
+   before anything was sent, 502/503), so a slow response never fires a
+   script twice. 504 and connections reset after the request went out
+   are not retried: the script may already be running
+ - dispatch(): fire-and-forget queue drained by a background thread, so the
+   audio path never waits on the HTTP round trip
+ - per-call latency stats (latency_stats())
+
+TriggerScript() / set_hass_credentials() keep working as before.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from typing import Optional
+
 import requests
-def TriggerScript(scriptID):
-    HA_URL = "http://" + HASS_IP + ":8123/api/services/script/turn_on"
-    TOKEN = HASS_TOKEN
-    ENTITY = scriptID
-
-    headers = {
-    "Authorization": f"Bearer {TOKEN}",
-    "Content-Type": "application/json"
-    }
-    data = {
-    "entity_id": ENTITY,
-    }
-    response = requests.post(HA_URL, headers=headers, json=data) # Sends the request to Home Assistant
-    
-     
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+import metrics
+
 HASS_IP = ""
 HASS_TOKEN = ""
+HASS_PORT = 8123
+
+CONNECT_TIMEOUT = 2.0       # seconds
+READ_TIMEOUT = 5.0          # seconds
+MAX_RETRIES = 2             # extra attempts after the first
+BACKOFF_SEC = 0.2           # doubled after every retry
+DISPATCH_QUEUE_SIZE = 32    # pending fire-and-forget calls before dropping
+RETRY_STATUS = {502, 503}    # 504: the proxy already forwarded the request
+
+
+def _not_sent(e: requests.ConnectionError) -> bool:
+    """True if the connection was never established, so HA never saw the request."""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def base_url_for(ip: str, port: int = HASS_PORT) -> str:
+    """'192.168.1.5' -> 'http://192.168.1.5:8123'; full URLs / host:port kept."""
+    ip = ip.strip().rstrip("/")
+    if "://" in ip:
+        return ip
+    if ":" in ip:
+        return "http://" + ip
+    return f"http://{ip}:{port}"
+
+
+class HomeAssistantClient:
+    def __init__(
+        self,
+        base_url: str,
+        token: str,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        retries: int = MAX_RETRIES,
+        backoff: float = BACKOFF_SEC,
+        queue_size: int = DISPATCH_QUEUE_SIZE,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._worker: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        self._recent = deque(maxlen=256)
+        self.stats = {"calls": 0, "errors": 0, "retries": 0, "dropped": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+    # ----- synchronous calls -----
+    def call_service(self, domain: str, service: str, data: dict) -> requests.Response:
+        url = f"{self.base_url}/api/services/{domain}/{service}"
+        t0 = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    resp = self.session.post(url, json=data, timeout=self.timeout)
+                    if resp.status_code not in RETRY_STATUS or attempt >= self.retries:
+                        resp.raise_for_status()
+                        return resp
+                except requests.ConnectionError as e:
+                    # an abort / reset after the body was sent may have run the script
+                    if not _not_sent(e) or attempt >= self.retries:
+                        raise
+                attempt += 1
+                self._count("retries")
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+        except Exception:
+            self._count("errors")
+            raise
+        finally:
+            self._record((time.perf_counter() - t0) * 1000.0)
+
+    def turn_on_script(self, entity_id: str) -> requests.Response:
+        return self.call_service("script", "turn_on", {"entity_id": entity_id})
+
+    # ----- fire-and-forget -----
+    def dispatch(self, entity_id: str) -> bool:
+        """Queue a script turn_on; returns False if the queue is full."""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((entity_id, time.perf_counter()))
+            return True
+        except queue.Full:
+            self._count("dropped")
+            return False
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until every queued call has been sent (or timeout)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self) -> None:
+        self.flush()
+        self.session.close()
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._drain, daemon=True)
+            self._worker.start()
+
+    def _drain(self) -> None:
+        while True:
+            entity_id, queued_at = self._queue.get()
+            metrics.observe("ha_queue_wait", time.perf_counter() - queued_at)
+            try:
+                self.turn_on_script(entity_id)
+            except Exception as e:
+                print(f"[HA] script {entity_id} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    # ----- metrics -----
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _record(self, ms: float) -> None:
+        metrics.observe("ha_call", ms / 1000.0)
+        with self._stats_lock:
+            self.stats["calls"] += 1
+            self.stats["total_ms"] += ms
+            self.stats["max_ms"] = max(self.stats["max_ms"], ms)
+            self._recent.append(ms)
+
+    def latency_stats(self) -> dict:
+        with self._stats_lock:
+            out = dict(self.stats)
+            recent = sorted(self._recent)
+        out["mean_ms"] = out["total_ms"] / out["calls"] if out["calls"] else 0.0
+        for q in (50, 95, 99):
+            out[f"p{q}_ms"] = recent[min(len(recent) - 1, len(recent) * q // 100)] if recent else 0.0
+        out["queued"] = self._queue.qsize()
+        return out
+
+
+# ===== Module-level default client (configured from the website upload) =====
+_client: Optional[HomeAssistantClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> Optional[HomeAssistantClient]:
+    global _client
+    with _client_lock:
+        if _client is None and HASS_IP and HASS_TOKEN:
+            _client = HomeAssistantClient(base_url_for(HASS_IP), HASS_TOKEN)
+        return _client
+
 
 def set_hass_credentials(ip: str, token: str) -> None:
     """Set Home Assistant credentials for use in voice commands"""
-    global HASS_IP, HASS_TOKEN
-    HASS_IP = ip
-    HASS_TOKEN = token
+    global HASS_IP, HASS_TOKEN, _client
+    with _client_lock:
+        if ip == HASS_IP and token == HASS_TOKEN:
+            return
+        HASS_IP = ip
+        HASS_TOKEN = token
+        old, _client = _client, None
+    if old is not None:
+        old.close()
+
+
+def TriggerScript(scriptID):
+    """Run a script and wait for Home Assistant to accept it."""
+    client = get_client()
+    if client is None:
+        print("[HA] no Home Assistant credentials set; not triggering", scriptID)
+        return None
+    return client.turn_on_script(scriptID)  # Sends the request to Home Assistant
+
+
+def dispatch_script(scriptID) -> bool:
+    """Fire-and-forget TriggerScript(); returns False if it could not be queued."""
+    client = get_client()
+    if client is None:
+        print("[HA] no Home Assistant credentials set; not triggering", scriptID)
+        return False
+    return client.dispatch(scriptID)
+
+
+def flush(timeout: float = 5.0) -> bool:
+    client = _client
+    return client.flush(timeout) if client is not None else True
+
+
+def latency_stats() -> dict:
+    client = _client
+    return client.latency_stats() if client is not None else {}
@@ -0,0 +1,203 @@
+"""
+incremental.py
+
+One-vs-rest forest for incremental retraining.
+
+Instead of one multi-class RandomForest over every example, each label gets
+its own small binary forest (label vs. a capped sample of the other labels).
+When a command group is added, changed or deleted, update() only touches
+what the change affects:
+
+ - new / changed label    -> its sub-forest is refit (cost ~ its examples)
+ - deleted label          -> its sub-forest is dropped
+ - every other label      -> GROW_TREES extra trees are grown with
+                             warm_start on its positives + a fresh negative
+                             sample, so it learns the new label as negative
+
+predict_proba() combines the per-label scores (see combine_scores), so the
+object is a drop-in for RandomForestClassifier in the model bundle.
+"""
+
+import hashlib
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+import lazy_import
+
+sk_ensemble = lazy_import.lazy("sklearn.ensemble")
+
+SUB_TREES = 30          # trees per label when a sub-forest is (re)fit
+GROW_TREES = 6          # trees added to unaffected labels per update
+NEG_RATIO = 4           # negatives sampled per positive when fitting a label
+SCORE_EPS = 0.01        # per-label scores are clipped to [eps, 1-eps] before combining
+
+
+def label_digest(paths: Iterable[str]) -> str:
+    """Order-independent fingerprint of one label's example set."""
+    h = hashlib.sha1()
+    for p in sorted(paths):
+        h.update(p.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def combine_scores(scores: np.ndarray, eps: float = SCORE_EPS) -> np.ndarray:
+    """
+    Per-label one-vs-rest scores (n, k) -> probabilities. Each label votes
+    with odds s / (1 - s) against a "no match" share of odds 1, i.e. the
+    chance that every sub-forest is right to say no. A lone weak score thus
+    stays weak (s = 0.3 gives about 0.3) and MIN_PROBA / MARGIN_PROBA can
+    still reject unknown audio; rows sum to less than 1, the rest being
+    the no-match share.
+    """
+    s = np.clip(scores, eps, 1.0 - eps)
+    odds = s / (1.0 - s)
+    return odds / (1.0 + odds.sum(axis=1, keepdims=True))
+
+
+def _balanced(y: np.ndarray) -> dict:
+    """class_weight="balanced" for a 0/1 target, as an explicit dict."""
+    counts = np.bincount(y, minlength=2)
+    return {c: len(y) / (2.0 * n) for c, n in enumerate(counts) if n}
+
+
+class OneVsRestForest:
+    def __init__(self, max_depth=None, random_state: int = 0, n_jobs=None,
+                 sub_trees: int = SUB_TREES, grow_trees: int = GROW_TREES,
+                 neg_ratio: int = NEG_RATIO):
+        self.max_depth = max_depth
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.sub_trees = sub_trees
+        self.grow_trees = grow_trees
+        self.neg_ratio = neg_ratio
+        self.forests: Dict[str, object] = {}
+        self.digests: Dict[str, str] = {}
+        self.classes_ = np.array([], dtype=object)
+        self.n_updates = 0          # incremental updates since the last full fit
+        self.drift = 0.0            # fraction of examples changed since then
+
+    # ----- fitting -----
+    def _new_forest(self, seed: int):
+        return sk_ensemble.RandomForestClassifier(
+            n_estimators=self.sub_trees,
+            max_depth=self.max_depth,
+            random_state=seed,
+            n_jobs=self.n_jobs,
+        )
+
+    def _seed(self, label: str) -> int:
+        return (self.random_state + int(hashlib.sha1(label.encode("utf-8")).hexdigest()[:8], 16)) % (2 ** 31)
+
+    def _negatives(self, label: str, labels: np.ndarray, n_pos: int, salt: int = 0) -> np.ndarray:
+        """Indices of up to neg_ratio * n_pos other-label rows, spread evenly over labels."""
+        others = [lbl for lbl in np.unique(labels) if lbl != label]
+        if not others:
+            return np.array([], dtype=int)
+        rng = np.random.default_rng(self._seed(label) + salt)
+        per = max(1, self.neg_ratio * n_pos // len(others))
+        idx = []
+        for lbl in others:
+            rows = np.flatnonzero(labels == lbl)
+            if len(rows) > per:
+                rows = rng.choice(rows, per, replace=False)
+            idx.append(rows)
+        return np.concatenate(idx)
+
+    def _fit_label(self, label: str, X: np.ndarray, labels: np.ndarray) -> None:
+        pos = np.flatnonzero(labels == label)
+        neg = self._negatives(label, labels, len(pos))
+        rows = np.concatenate([pos, neg])
+        y = (labels[rows] == label).astype(int)
+        clf = self._new_forest(self._seed(label))
+        clf.set_params(class_weight=_balanced(y))
+        clf.fit(X[rows], y)
+        self.forests[label] = clf
+
+    def _grow_label(self, label: str, X: np.ndarray, labels: np.ndarray) -> None:
+        clf = self.forests[label]
+        pos = np.flatnonzero(labels == label)
+        rows = np.concatenate([pos, self._negatives(label, labels, len(pos), salt=clf.n_estimators)])
+        y = (labels[rows] == label).astype(int)
+        # explicit weights: "balanced" is computed per fit() and sklearn
+        # warns about it under warm_start
+        clf.set_params(warm_start=True, n_estimators=clf.n_estimators + self.grow_trees,
+                       class_weight=_balanced(y))
+        clf.fit(X[rows], y)
+        clf.set_params(warm_start=False)
+
+    def fit(self, X: np.ndarray, labels: np.ndarray, label_paths: Dict[str, List[str]]) -> "OneVsRestForest":
+        """Full fit: one sub-forest per label."""
+        labels = np.asarray(labels)
+        self.forests = {}
+        for label in sorted(label_paths):
+            self._fit_label(label, X, labels)
+        self.digests = {lbl: label_digest(p) for lbl, p in label_paths.items()}
+        self.classes_ = np.array(sorted(self.forests), dtype=object)
+        self.n_updates = 0
+        self.drift = 0.0
+        return self
+
+    def plan(self, label_paths: Dict[str, List[str]]) -> dict:
+        """
+        What update() would do: changed/new labels, removed labels,
+        changed-example fraction. A label fit while it was the only one
+        (no negatives) is refit too, but its unchanged examples do not
+        count towards the fraction.
+        """
+        new_digests = {lbl: label_digest(p) for lbl, p in label_paths.items()}
+        edited = [lbl for lbl, d in new_digests.items() if self.digests.get(lbl) != d]
+        changed = sorted(set(edited) | {lbl for lbl in new_digests if not self._usable(lbl)})
+        removed = sorted(set(self.digests) - set(new_digests))
+        total = sum(len(p) for p in label_paths.values()) or 1
+        n_changed = sum(len(label_paths[lbl]) for lbl in edited)
+        return {"changed": changed, "removed": removed, "fraction": n_changed / total,
+                "digests": new_digests}
+
+    def _usable(self, label: str) -> bool:
+        clf = self.forests.get(label)
+        return clf is not None and len(getattr(clf, "classes_", ())) == 2
+
+    def update(self, X: np.ndarray, labels: np.ndarray, label_paths: Dict[str, List[str]],
+               plan: Optional[dict] = None) -> dict:
+        """Incremental update to the current example set; returns the plan that was applied."""
+        labels = np.asarray(labels)
+        plan = plan or self.plan(label_paths)
+        for label in plan["removed"]:
+            self.forests.pop(label, None)
+        for label in plan["changed"]:
+            self._fit_label(label, X, labels)
+        if plan["changed"]:
+            for label in self.forests:
+                if label not in plan["changed"]:
+                    self._grow_label(label, X, labels)
+        self.digests = plan["digests"]
+        self.classes_ = np.array(sorted(self.forests), dtype=object)
+        if plan["changed"] or plan["removed"]:
+            self.n_updates += 1
+            self.drift += plan["fraction"]
+        return plan
+
+    # ----- inference -----
+    def set_params(self, **params) -> "OneVsRestForest":
+        if "n_jobs" in params:
+            self.n_jobs = params["n_jobs"]
+            for clf in self.forests.values():
+                clf.set_params(n_jobs=self.n_jobs)
+        return self
+
+    @property
+    def n_estimators(self) -> int:
+        return sum(clf.n_estimators for clf in self.forests.values())
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Per-label scores combined with combine_scores (rows sum to <= 1)."""
+        X = np.asarray(X)
+        scores = np.ones((len(X), len(self.classes_)))
+        for j, label in enumerate(self.classes_):
+            clf = self.forests[label]
+            # a label fit without negatives only knows its own class
+            if 1 in clf.classes_:
+                scores[:, j] = clf.predict_proba(X)[:, list(clf.classes_).index(1)]
+        return combine_scores(scores)
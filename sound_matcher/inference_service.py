@@ -0,0 +1,317 @@
+"""
+inference_service.py
+
+Long-running prediction service so one Pi can serve several satellite
+microphones (rooms, button boxes) at once.
+
+    python3 inference_service.py                          # 127.0.0.1:8090
+    python3 inference_service.py --unix /run/sound_matcher.sock
+
+POST /predict?user=alice with the utterance as the request body:
+ - "audio/pcm; rate=16000; channels=1" (or application/octet-stream):
+   16-bit little-endian PCM (rate / channels default to SAMPLE_RATE / 1)
+ - "audio/L16; rate=...": 16-bit big-endian PCM (RFC 2586)
+ - "audio/f32; rate=...": float32 little-endian
+ - "audio/wav": a WAV file
+The reply has the decision, top-1 label and probability, the script_id,
+per-class probabilities and the request's latency breakdown.
+
+Requests are handled by a MicroBatcher: the first request of a batch
+waits at most BATCH_WINDOW_MS for others, then the batch is grouped by
+user and every user's clips are featurized and scored together (one
+extract_features_batch + one predict_proba call), using the cached model
+from sound_matcher.get_model. At most MAX_PENDING requests may be waiting;
+beyond that the service answers 503 at once instead of letting latency
+grow. A request whose caller has already timed out (REQUEST_TIMEOUT_SEC)
+is dropped from its batch instead of being classified. GET /stats reports
+queue depth, batch sizes and latency percentiles.
+"""
+
+import argparse
+import io
+import json
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Dict, List
+
+import numpy as np
+import soundfile as sf
+
+import lazy_import
+import metrics
+import sound_matcher as sm
+
+librosa = lazy_import.lazy("librosa")
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8090
+BATCH_WINDOW_MS = 5.0        # how long a batch waits for more requests
+MAX_BATCH = 32               # requests per batch
+MAX_PENDING = 64             # queued requests before answering 503
+WORKERS = 1                  # batching threads
+REQUEST_TIMEOUT_SEC = 10.0
+MAX_BODY_BYTES = 4 * 1024 * 1024
+LATENCY_WINDOW = 1000        # recent requests kept for /stats percentiles
+
+
+class Overloaded(RuntimeError):
+    """The request queue is full."""
+
+
+# ===== Request decoding =====
+def _content_type(header: str):
+    parts = [p.strip() for p in (header or "").split(";")]
+    params = {}
+    for p in parts[1:]:
+        if "=" in p:
+            k, v = p.split("=", 1)
+            params[k.strip().lower()] = v.strip()
+    return parts[0].lower(), params
+
+
+def decode_audio(body: bytes, content_type: str) -> np.ndarray:
+    """Request body -> mono float32 at SAMPLE_RATE. Raises ValueError on bad input."""
+    ctype, params = _content_type(content_type)
+    if ctype in ("audio/wav", "audio/x-wav", "audio/wave"):
+        y, sr = sf.read(io.BytesIO(body), dtype="float32", always_2d=True)
+        y = y[:, 0]
+    else:
+        dtypes = {"audio/l16": ">i2", "audio/f32": "<f4"}
+        dtype = np.dtype(dtypes.get(ctype, "<i2"))
+        try:
+            sr = int(params.get("rate", sm.SAMPLE_RATE))
+            channels = int(params.get("channels", 1))
+        except ValueError:
+            raise ValueError("bad rate / channels parameter")
+        frame = dtype.itemsize * channels
+        if channels < 1 or len(body) % frame:
+            raise ValueError("body is not a whole number of sample frames")
+        y = np.frombuffer(body, dtype=dtype).reshape(-1, channels)[:, 0]
+        y = y.astype(np.float32) / (32768.0 if dtype.kind == "i" else 1.0)
+    if sr != sm.SAMPLE_RATE:
+        y = librosa.resample(y, orig_sr=sr, target_sr=sm.SAMPLE_RATE)
+    if y.size == 0:
+        raise ValueError("empty audio")
+    return np.ascontiguousarray(y, dtype=np.float32)
+
+
+# ===== Micro-batching =====
+class _Pending:
+    __slots__ = ("user", "audio", "arrived", "future")
+
+    def __init__(self, user: str, audio: np.ndarray):
+        self.user = user
+        self.audio = audio
+        self.arrived = time.perf_counter()
+        self.future: Future = Future()
+
+
+class MicroBatcher:
+    def __init__(self, window_ms: float = BATCH_WINDOW_MS, max_batch: int = MAX_BATCH,
+                 max_pending: int = MAX_PENDING, workers: int = WORKERS):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[_Pending]" = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._latency: deque = deque(maxlen=LATENCY_WINDOW)
+        self.counts = {"requests": 0, "rejected": 0, "errors": 0, "abandoned": 0,
+                       "batches": 0, "batched": 0}
+        self._threads = [threading.Thread(target=self._loop, name=f"batcher-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, user: str, audio: np.ndarray) -> Future:
+        """Queue one clip; the future resolves to the result dict. Raises Overloaded."""
+        req = _Pending(sm.normalize_text(user), audio)
+        try:
+            self._queue.put_nowait(req)
+        except queue.Full:
+            with self._lock:
+                self.counts["rejected"] += 1
+            raise Overloaded(f"{self._queue.maxsize} requests already pending")
+        return req.future
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                left = deadline - time.perf_counter()
+                if left <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=left))
+                except queue.Empty:
+                    break
+            try:
+                self._run(batch)
+            except Exception as e:
+                for req in batch:
+                    if not req.future.done():
+                        req.future.set_exception(e)
+
+    def _run(self, batch: List[_Pending]) -> None:
+        started = time.perf_counter()
+        # requests whose caller already timed out (future cancelled) are dropped
+        live = [req for req in batch if req.future.set_running_or_notify_cancel()]
+        by_user: Dict[str, List[_Pending]] = {}
+        for req in live:
+            by_user.setdefault(req.user, []).append(req)
+
+        try:
+            for user, reqs in by_user.items():
+                # one user's failure (model load, features, predict) fails only
+                # that user's requests
+                try:
+                    self._run_user(user, reqs, started, len(batch))
+                except Exception as e:
+                    for req in reqs:
+                        if not req.future.done():
+                            req.future.set_exception(e)
+        finally:
+            with self._lock:
+                self.counts["requests"] += len(batch)
+                self.counts["abandoned"] += len(batch) - len(live)
+                self.counts["errors"] += sum(
+                    1 for r in live if r.future.done() and r.future.exception() is not None
+                )
+                self.counts["batches"] += 1
+                self.counts["batched"] += len(live)
+
+    def _run_user(self, user: str, reqs: List[_Pending], started: float, batch_size: int) -> None:
+        bundle = sm.get_model(user)
+        if bundle is None:
+            for req in reqs:
+                req.future.set_exception(LookupError(f"no model trained for user '{user}'"))
+            return
+        t0 = time.perf_counter()
+        X = sm.extract_features_batch([r.audio for r in reqs], bundle["feature_mode"])
+        t1 = time.perf_counter()
+        P = bundle["model"].predict_proba(X)
+        t2 = time.perf_counter()
+        classes = bundle["classes"]
+        decisions = sm.decide_batch(classes, P, bundle["params"])
+        top = P.argmax(axis=1)
+        for req, p, d, k in zip(reqs, P, decisions, top):
+            done = time.perf_counter()
+            total = done - req.arrived
+            req.future.set_result({
+                "user": user,
+                "decision": d,
+                "top1": str(classes[k]),
+                "p_top1": float(p[k]),
+                "script_id": bundle["scripts"].get(d, "") if d != "UNKNOWN" else "",
+                "proba": {str(c): round(float(x), 6) for c, x in zip(classes, p)},
+                "batch_size": batch_size,
+                "latency_ms": {
+                    "queue": (started - req.arrived) * 1000.0,
+                    "features": (t1 - t0) * 1000.0,
+                    "predict": (t2 - t1) * 1000.0,
+                    "total": total * 1000.0,
+                },
+            })
+            self._latency.append(total)
+            metrics.observe("service_request", total, user=user, batch=batch_size)
+        metrics.observe("service_batch", t2 - t0, user=user, n=len(reqs))
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        lat = np.asarray(self._latency) * 1000.0
+        out = {
+            **counts,
+            "pending": self._queue.qsize(),
+            "mean_batch": counts["batched"] / counts["batches"] if counts["batches"] else 0.0,
+        }
+        if lat.size:
+            out["latency_ms"] = {f"p{q}": float(np.percentile(lat, q)) for q in (50, 95, 99)}
+        return out
+
+
+# ===== HTTP =====
+def create_app(batcher: MicroBatcher):
+    from flask import Flask, jsonify, request
+
+    app = Flask(__name__)
+
+    @app.route("/predict", methods=["POST"])
+    def predict():
+        user = request.args.get("user", "") or request.headers.get("X-User", "")
+        if not user:
+            return jsonify({"error": "Missing user"}), 400
+        if (request.content_length or 0) > MAX_BODY_BYTES:
+            return jsonify({"error": "Body too large"}), 413
+        try:
+            audio = decode_audio(request.get_data(cache=False), request.headers.get("Content-Type", ""))
+        except Exception as e:
+            return jsonify({"error": f"Bad audio: {e}"}), 400
+        try:
+            fut = batcher.submit(user, audio)
+        except Overloaded as e:
+            return jsonify({"error": f"Overloaded: {e}"}), 503, {"Retry-After": "1"}
+        try:
+            return jsonify(fut.result(timeout=REQUEST_TIMEOUT_SEC)), 200
+        except LookupError as e:
+            return jsonify({"error": str(e)}), 404
+        except FutureTimeout:
+            fut.cancel()        # not started yet: the batcher skips it
+            return jsonify({"error": "Timed out"}), 504
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.route("/stats", methods=["GET"])
+    def stats():
+        return jsonify(batcher.stats()), 200
+
+    @app.route("/health", methods=["GET"])
+    def health():
+        return jsonify({"ok": True}), 200
+
+    return app
+
+
+# ===== Client =====
+def predict_remote(url: str, user: str, y: np.ndarray, timeout: float = REQUEST_TIMEOUT_SEC) -> dict:
+    """POST one clip (float, SAMPLE_RATE) to a running service; returns its JSON reply."""
+    pcm = (np.clip(np.asarray(y, dtype=np.float32), -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+    req = urllib.request.Request(
+        f"{url.rstrip('/')}/predict?user={urllib.request.quote(user)}",
+        data=pcm,
+        headers={"Content-Type": f"audio/pcm; rate={sm.SAMPLE_RATE}; channels=1"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default=SERVICE_HOST)
+    ap.add_argument("--port", type=int, default=SERVICE_PORT)
+    ap.add_argument("--unix", default=None, help="listen on this Unix socket instead of TCP")
+    ap.add_argument("--window-ms", type=float, default=BATCH_WINDOW_MS)
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--users", nargs="*", default=None, help="models to load at start (default: all)")
+    args = ap.parse_args()
+
+    from werkzeug.serving import make_server
+
+    sm.warm_up(args.users)
+    app = create_app(MicroBatcher(window_ms=args.window_ms, workers=args.workers))
+    host = f"unix://{args.unix}" if args.unix else args.host
+    server = make_server(host, args.port, app, threaded=True)
+    print(sm.C + f"Inference service on {args.unix or f'{args.host}:{args.port}'}" + sm.R)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+ingest.py
+
+Upload ingestion: every uploaded WAV is converted once, at upload time, to
+the canonical format training reads (SAMPLE_RATE, mono, CANONICAL_SUBTYPE)
+and featurized into the feature cache right away.
+
+Per file:
+ 1. the upload is streamed in COPY_CHUNK pieces to a temp file next to its
+    destination (never held in memory, capped at MAX_UPLOAD_BYTES);
+ 2. the header is validated (readable WAV, sane rate / channels / length)
+    before any samples are decoded;
+ 3. the audio is decoded with sound_matcher.read_wav (same mono / resample
+    as training always did) and written as NNN.wav, renamed into place.
+
+File numbers come from a per-folder counter file, so naming a file no
+longer lists the folder (the old glob made a large group O(n^2)). After
+the batch, features for all accepted files are extracted in one
+extract_features_batch() call and stored in the user's feature cache, so
+the retrain that follows only hits the cache and read_wav never resamples.
+"""
+
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+
+import metrics
+import sound_matcher as sm
+
+ALLOWED_EXTS = {".wav"}
+ALLOWED_FORMATS = {"WAV", "WAVEX", "RF64"}
+CANONICAL_SUBTYPE = "PCM_16"     # or "FLOAT" to keep the decoded samples bit-exact
+MAX_UPLOAD_BYTES = 32 * 1024 * 1024
+MAX_UPLOAD_SEC = 30.0
+MIN_UPLOAD_SEC = 0.05
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 192000
+MAX_CHANNELS = 8
+COPY_CHUNK = 64 * 1024
+COUNTER_FILE = ".next_index"
+
+
+class IngestError(ValueError):
+    """An upload was rejected; the message says why."""
+
+
+# ===== File naming =====
+def allocate_indices(stash_dir: Path, n: int = 1) -> List[int]:
+    """
+    Reserve n consecutive file numbers in stash_dir. The counter file is
+    seeded once from the highest numbered file present. Callers must hold
+    the user's profile_lock.
+    """
+    stash_dir = Path(stash_dir)
+    counter = stash_dir / COUNTER_FILE
+    try:
+        start = int(counter.read_text().strip())
+    except (OSError, ValueError):
+        # any audio suffix: storage.py may have transcoded NNN.wav to NNN.flac
+        stems = [p.stem for p in stash_dir.iterdir() if p.is_file()] if stash_dir.exists() else []
+        start = max([int(s) for s in stems if s.isdigit()], default=0) + 1
+    stash_dir.mkdir(parents=True, exist_ok=True)
+    tmp = counter.with_name(counter.name + ".tmp")
+    tmp.write_text(str(start + n))
+    os.replace(tmp, counter)
+    return list(range(start, start + n))
+
+
+# ===== Per-file steps =====
+def stream_to_temp(src: BinaryIO, directory: Path, max_bytes: int = MAX_UPLOAD_BYTES) -> Path:
+    """Copy a file-like object to a temp file in `directory`, chunk by chunk."""
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, name = tempfile.mkstemp(dir=directory, suffix=".upload")
+    total = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = src.read(COPY_CHUNK)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > max_bytes:
+                    raise IngestError(f"larger than {max_bytes // (1024 * 1024)} MiB")
+                out.write(chunk)
+    except BaseException:
+        os.unlink(name)
+        raise
+    if total == 0:
+        os.unlink(name)
+        raise IngestError("empty file")
+    return Path(name)
+
+
+def validate(path: Path) -> sf.info:
+    """Check the header only; raises IngestError with a readable reason."""
+    try:
+        info = sf.info(str(path))
+    except Exception as e:
+        raise IngestError("not a readable audio file") from e
+    if info.format not in ALLOWED_FORMATS:
+        raise IngestError(f"unsupported container {info.format}")
+    if not MIN_SAMPLE_RATE <= info.samplerate <= MAX_SAMPLE_RATE:
+        raise IngestError(f"unsupported sample rate {info.samplerate}")
+    if not 1 <= info.channels <= MAX_CHANNELS:
+        raise IngestError(f"unsupported channel count {info.channels}")
+    if info.frames <= 0 or info.duration < MIN_UPLOAD_SEC:
+        raise IngestError("too short")
+    if info.duration > MAX_UPLOAD_SEC:
+        raise IngestError(f"longer than {MAX_UPLOAD_SEC:.0f} s")
+    return info
+
+
+def write_canonical(y: np.ndarray, dest: Path) -> None:
+    """Atomically write mono SAMPLE_RATE audio in CANONICAL_SUBTYPE."""
+    tmp = dest.with_name(dest.name + ".tmp")
+    sf.write(str(tmp), y, sm.SAMPLE_RATE, subtype=CANONICAL_SUBTYPE, format="WAV")
+    os.replace(tmp, dest)
+
+
+# ===== Batch =====
+def ingest_uploads(user: str, label: str, uploads, stash_dir: Path) -> Tuple[list, list, list]:
+    """
+    Ingest (filename, file-like) pairs for one label. Returns (examples,
+    saved paths, rejected [{"file", "error"}]). The user's profile_lock is
+    only taken to reserve each file number; streaming, decoding and
+    featurizing run without it. The caller adds the examples to the profile.
+    """
+    stash_dir = Path(stash_dir)
+    examples: list = []
+    saved: list = []
+    rejected: list = []
+    clips: List[np.ndarray] = []
+
+    for filename, stream in uploads:
+        if Path(filename).suffix.lower() not in ALLOWED_EXTS:
+            rejected.append({"file": filename, "error": "unsupported extension"})
+            continue
+        tmp: Optional[Path] = None
+        try:
+            with metrics.timer("ingest_receive"):
+                tmp = stream_to_temp(stream, stash_dir)
+            validate(tmp)
+            with metrics.timer("ingest_convert"):
+                y = sm.read_wav(tmp)
+                with sm.profile_lock(user):
+                    dest = stash_dir / f"{allocate_indices(stash_dir)[0]:03d}.wav"
+                write_canonical(y, dest)
+        except IngestError as e:
+            rejected.append({"file": filename, "error": str(e)})
+            continue
+        except Exception as e:
+            rejected.append({"file": filename, "error": f"could not decode ({e})"})
+            continue
+        finally:
+            if tmp is not None and tmp.exists():
+                tmp.unlink()
+
+        # features are computed from what training will read back
+        y, _ = sf.read(str(dest), dtype="float32")
+        clips.append(y)
+        examples.append({"path": str(dest), "label": label})
+        saved.append(str(dest))
+
+    if clips:
+        with metrics.timer("ingest_features", n=len(clips)):
+            cache = sm.load_feature_cache(user)
+            for path, feats in zip(saved, sm.extract_features_batch(clips)):
+                cache.put(Path(path), feats)
+            cache.save()
+    return examples, saved, rejected
@@ -0,0 +1,44 @@
+"""
+lazy_import.py
+
+Deferred imports for heavy dependencies (librosa, scikit-learn, joblib,
+sounddevice). `librosa = lazy("librosa")` binds a placeholder module; the
+real import happens on first attribute access, so importing sound_matcher
+(e.g. from button_listener at boot) stays cheap until audio is processed.
+"""
+
+import importlib
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_target"] = name
+        self.__dict__["_lazy_module"] = None
+        self.__dict__["_lazy_lock"] = threading.Lock()
+
+    def _load(self):
+        mod = self.__dict__["_lazy_module"]
+        if mod is None:
+            with self.__dict__["_lazy_lock"]:
+                mod = self.__dict__["_lazy_module"]
+                if mod is None:
+                    mod = importlib.import_module(self.__dict__["_lazy_target"])
+                    self.__dict__["_lazy_module"] = mod
+        return mod
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    @property
+    def loaded(self) -> bool:
+        return self.__dict__["_lazy_module"] is not None
+
+
+def lazy(name: str) -> LazyModule:
+    return LazyModule(name)
@@ -0,0 +1,145 @@
+"""
+metrics.py
+
+Lightweight per-stage latency instrumentation.
+
+    with metrics.timer("mfcc"):
+        ...
+
+records the elapsed time of the block into an in-memory histogram named
+"mfcc". render_prometheus() dumps every histogram in Prometheus text format
+(served by server.py at /metrics). With EVENT_LOG set, each timing is also
+appended as one JSON line to that file.
+
+When disabled (the default unless SOUND_MATCHER_METRICS=1 or enable() is
+called) timer() returns a shared no-op context manager, so instrumented
+code pays one attribute check per stage.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Optional
+
+ENABLED = os.environ.get("SOUND_MATCHER_METRICS", "") not in ("", "0")
+EVENT_LOG: Optional[str] = os.environ.get("SOUND_MATCHER_EVENT_LOG") or None
+
+# histogram upper bounds, seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "n")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # last bucket = +Inf
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, sec: float) -> None:
+        self.counts[bisect_left(BUCKETS, sec)] += 1
+        self.total += sec
+        self.n += 1
+
+
+_hists: Dict[str, Histogram] = {}
+
+
+def enable(event_log: Optional[str] = None) -> None:
+    global ENABLED, EVENT_LOG
+    ENABLED = True
+    if event_log is not None:
+        EVENT_LOG = event_log
+
+
+def disable() -> None:
+    global ENABLED
+    ENABLED = False
+
+
+def reset() -> None:
+    with _lock:
+        _hists.clear()
+
+
+def observe(stage: str, sec: float, **fields) -> None:
+    if not ENABLED:
+        return
+    with _lock:
+        h = _hists.get(stage)
+        if h is None:
+            h = _hists[stage] = Histogram()
+        h.observe(sec)
+    if EVENT_LOG:
+        rec = {"ts": time.time(), "stage": stage, "sec": round(sec, 6)}
+        rec.update(fields)
+        with _log_lock, open(EVENT_LOG, "a") as fh:
+            fh.write(json.dumps(rec) + "\n")
+
+
+class _Timer:
+    __slots__ = ("stage", "fields", "t0")
+
+    def __init__(self, stage: str, fields: dict):
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.t0, **self.fields)
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+
+_NOOP = _NoopTimer()
+
+
+def timer(stage: str, **fields):
+    """Context manager timing one stage; free when metrics are disabled."""
+    if not ENABLED:
+        return _NOOP
+    return _Timer(stage, fields)
+
+
+def snapshot() -> Dict[str, dict]:
+    """stage -> {"count", "sum", "buckets": [(le, cumulative count), ...]}"""
+    with _lock:
+        out = {}
+        for stage, h in _hists.items():
+            cum, buckets = 0, []
+            for le, c in zip(BUCKETS + (float("inf"),), h.counts):
+                cum += c
+                buckets.append((le, cum))
+            out[stage] = {"count": h.n, "sum": h.total, "buckets": buckets}
+        return out
+
+
+def render_prometheus(prefix: str = "sound_matcher") -> str:
+    name = f"{prefix}_stage_seconds"
+    lines = [
+        f"# HELP {name} Latency of each pipeline stage.",
+        f"# TYPE {name} histogram",
+    ]
+    for stage, h in sorted(snapshot().items()):
+        for le, cum in h["buckets"]:
+            le_s = "+Inf" if le == float("inf") else repr(le)
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{le_s}"}} {cum}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {h["sum"]:.6f}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {h["count"]}')
+    return "\n".join(lines) + "\n"
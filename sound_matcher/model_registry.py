@@ -0,0 +1,96 @@
+"""
+model_registry.py
+
+Process-wide cache of deserialized models.
+
+Each entry is keyed by user and remembers the (mtime, size) of the files it
+was built from (the model file and the profile JSON). A lookup only stats
+those files; the entry is rebuilt when any of them changes on disk. Entries
+are evicted least-recently-used first once the summed size estimate goes
+over max_bytes.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Tuple
+
+
+def _stamp(paths: Iterable[Path]) -> Optional[Tuple]:
+    out = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+        except OSError:
+            return None
+        out.append((st.st_mtime_ns, st.st_size))
+    return tuple(out)
+
+
+class ModelRegistry:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.hits = 0
+
+    def get(self, user: str, paths: Iterable[Path], loader: Callable[[str], object], token=None):
+        """
+        Return the cached value for user, calling loader(user) when the
+        watched files (or the extra `token`, e.g. a database revision)
+        changed since the last load. Returns None (and drops the entry)
+        when any watched file is missing.
+        """
+        paths = list(paths)
+        with self._lock:
+            stamp = _stamp(paths)
+            if stamp is None:
+                self._entries.pop(user, None)
+                return None
+
+            ent = self._entries.get(user)
+            if ent is not None and ent["stamp"] == stamp and ent["token"] == token:
+                self._entries.move_to_end(user)
+                self.hits += 1
+                return ent["value"]
+
+            value = loader(user)
+            self.loads += 1
+            if value is None:
+                self._entries.pop(user, None)
+                return None
+
+            self._entries[user] = {
+                "stamp": stamp,
+                "token": token,
+                "value": value,
+                # on-disk size is a decent proxy for the unpickled footprint
+                "nbytes": sum(size for _, size in stamp),
+            }
+            self._entries.move_to_end(user)
+            self._evict()
+            return value
+
+    def invalidate(self, user: Optional[str] = None) -> None:
+        with self._lock:
+            if user is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user, None)
+
+    def users(self):
+        with self._lock:
+            return list(self._entries)
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(e["nbytes"] for e in self._entries.values())
+
+    def _evict(self) -> None:
+        total = sum(e["nbytes"] for e in self._entries.values())
+        # always keep the most recently used entry, even if it alone is too big
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, ent = self._entries.popitem(last=False)
+            total -= ent["nbytes"]
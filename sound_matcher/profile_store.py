@@ -0,0 +1,304 @@
+"""
+profile_store.py
+
+Crash-safe storage for profile indices (INDEX_DIR/<user>.json).
+
+Layout per user:
+  <user>.json      snapshot (same format as before, plus "_journal_seq")
+  <user>.journal   append-only JSON lines: one event per change
+  <user>.lock      lock file (flock), shared by the server and the CLI
+
+Small changes (examples added, removed or moved, a label removed, a script
+id set) are appended to the journal instead of rewriting the whole
+snapshot. The journal is folded into a new snapshot every COMPACT_EVERY
+events; the snapshot is written to a temp file, fsynced and renamed into
+place.
+Every event carries a sequence number and the snapshot records the last
+one it contains, so a crash between the rename and the journal truncate
+cannot apply an event twice. A torn last journal line is ignored.
+
+Appending does not read the profile: every event also carries "n", its
+position in the journal, so the next seq / count come from the journal's
+last line, and the snapshot starts with its "_journal_seq" so that is a
+read of its first bytes. An append therefore costs the same however large
+the profile is; only compaction (every COMPACT_EVERY events) loads it.
+"""
+
+import json
+import os
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+COMPACT_EVERY = 200     # journal events before folding into the snapshot
+FSYNC = True            # fsync journal appends / snapshots (power-cut safety)
+
+SEQ_KEY = "_journal_seq"
+TAIL_BYTES = 4096       # first read from the end of the journal (grows if needed)
+_SEQ_HEAD = re.compile(rb'^\{\s*"_journal_seq":\s*(\d+)')
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+_held = threading.local()
+
+
+def snapshot_path(index_dir: Path, user: str) -> Path:
+    return Path(index_dir) / f"{user}.json"
+
+
+def journal_path(index_dir: Path, user: str) -> Path:
+    return Path(index_dir) / f"{user}.journal"
+
+
+def lock_path(index_dir: Path, user: str) -> Path:
+    return Path(index_dir) / f"{user}.lock"
+
+
+# ===== Locking =====
+@contextmanager
+def locked(index_dir: Path, user: str):
+    """
+    Exclusive, re-entrant (per thread) lock on one user's profile. Uses a
+    thread lock plus flock() on the lock file, so other processes (CLI vs
+    server) are excluded as well.
+    """
+    key = str(lock_path(index_dir, user))
+    depth = getattr(_held, "depth", None)
+    if depth is None:
+        depth = _held.depth = {}
+    if depth.get(key):
+        depth[key] += 1
+        try:
+            yield
+        finally:
+            depth[key] -= 1
+        return
+
+    with _thread_locks_guard:
+        tlock = _thread_locks.setdefault(key, threading.Lock())
+    with tlock:
+        Path(index_dir).mkdir(parents=True, exist_ok=True)
+        fh = open(key, "a+")
+        try:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            depth[key] = 1
+            try:
+                yield
+            finally:
+                depth[key] = 0
+                if fcntl is not None:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+        finally:
+            fh.close()
+
+
+# ===== Events =====
+def apply_event(prof: dict, ev: dict) -> None:
+    op = ev.get("op")
+    if op == "add_examples":
+        prof["examples"].extend(ev["examples"])
+    elif op == "remove_label":
+        prof["examples"] = [ex for ex in prof["examples"] if ex.get("label") != ev["label"]]
+        prof["scripts"].pop(ev["label"], None)
+    elif op == "remove_paths":
+        gone = set(ev["paths"])
+        prof["examples"] = [ex for ex in prof["examples"] if ex.get("path") not in gone]
+    elif op == "rename_paths":
+        moved = ev["paths"]
+        for ex in prof["examples"]:
+            if ex.get("path") in moved:
+                ex["path"] = moved[ex["path"]]
+    elif op == "set_script":
+        prof["scripts"][ev["label"]] = ev["script_id"]
+    elif op == "set_key":
+        prof[ev["key"]] = ev["value"]
+
+
+def _read_journal(path: Path) -> List[dict]:
+    if not path.exists():
+        return []
+    events = []
+    with open(path, "r") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # torn write (power cut mid-append); the event never committed
+                continue
+    return events
+
+
+def _fsync_dir(path: Path) -> None:
+    if not FSYNC or os.name != "posix":
+        return
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _snapshot_seq(index_dir: Path, user: str) -> int:
+    """The snapshot's last applied seq, read from its first bytes."""
+    path = snapshot_path(index_dir, user)
+    try:
+        with open(path, "rb") as fh:
+            head = fh.read(256)
+    except FileNotFoundError:
+        return 0
+    m = _SEQ_HEAD.match(head)
+    if m:
+        return int(m.group(1))
+    # snapshot written before the seq was moved to the front
+    return int(json.loads(path.read_text()).get(SEQ_KEY, 0))
+
+
+def _journal_tail(path: Path):
+    """(seq, n) of the last complete journal event, read from the end; (0, 0) if none."""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return 0, 0
+    block = TAIL_BYTES
+    with open(path, "rb") as fh:
+        while True:
+            start = max(0, size - block)
+            fh.seek(start)
+            lines = fh.read(size - start).split(b"\n")
+            if start > 0:
+                lines = lines[1:]       # may start mid-line
+            for line in reversed(lines):
+                try:
+                    ev = json.loads(line)
+                except ValueError:
+                    continue            # blank or torn
+                if "n" not in ev:
+                    # journal written before events were numbered: count once
+                    events = _read_journal(path)
+                    return max(e.get("seq", 0) for e in events), len(events)
+                return ev["seq"], ev["n"]
+            if start == 0:
+                return 0, 0
+            block *= 4
+
+
+def _write_snapshot(index_dir: Path, user: str, prof: dict) -> None:
+    path = snapshot_path(index_dir, user)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as fh:
+        fh.write(json.dumps(prof, indent=2))
+        fh.flush()
+        if FSYNC:
+            os.fsync(fh.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path.parent)
+
+
+# ===== Public API =====
+def _load_unlocked(index_dir: Path, user: str):
+    """Returns (profile, last applied seq, number of journal events)."""
+    p = snapshot_path(index_dir, user)
+    prof = json.loads(p.read_text()) if p.exists() else {}
+    prof.setdefault("examples", [])
+    prof.setdefault("scripts", {})
+    seq = int(prof.pop(SEQ_KEY, 0))
+    events = _read_journal(journal_path(index_dir, user))
+    for ev in events:
+        if ev.get("seq", 0) > seq:
+            apply_event(prof, ev)
+            seq = ev["seq"]
+    return prof, seq, len(events)
+
+
+def load(index_dir: Path, user: str) -> dict:
+    """Snapshot + replayed journal."""
+    with locked(index_dir, user):
+        prof, _, _ = _load_unlocked(index_dir, user)
+    return prof
+
+
+def save(index_dir: Path, user: str, prof: dict) -> None:
+    """Replace the whole profile atomically (compacts the journal)."""
+    with locked(index_dir, user):
+        _, seq, _ = _load_unlocked(index_dir, user)
+        _compact(index_dir, user, prof, seq)
+
+
+def append(index_dir: Path, user: str, events: Iterable[dict]) -> None:
+    """Durably append events; compacts once the journal gets long."""
+    events = list(events)
+    if not events:
+        return
+    with locked(index_dir, user):
+        jpath = journal_path(index_dir, user)
+        seq, n = _journal_tail(jpath)
+        # after a crash between compaction's rename and truncate, the
+        # journal's events are older than the snapshot
+        seq = max(seq, _snapshot_seq(index_dir, user))
+        lines = []
+        for ev in events:
+            seq += 1
+            n += 1
+            lines.append(json.dumps(dict(ev, seq=seq, n=n)))
+        with open(jpath, "ab") as fh:
+            if fh.tell() > 0:
+                # make sure a torn tail stays on its own line
+                with open(jpath, "rb") as rh:
+                    rh.seek(-1, os.SEEK_END)
+                    if rh.read(1) != b"\n":
+                        fh.write(b"\n")
+            fh.write(("\n".join(lines) + "\n").encode())
+            fh.flush()
+            if FSYNC:
+                os.fsync(fh.fileno())
+
+        # first write for a user also creates the snapshot, so the user
+        # shows up in directory listings of INDEX_DIR/*.json
+        if n >= COMPACT_EVERY or not snapshot_path(index_dir, user).exists():
+            prof, seq, _ = _load_unlocked(index_dir, user)
+            _compact(index_dir, user, prof, seq)
+
+
+def compact(index_dir: Path, user: str) -> None:
+    with locked(index_dir, user):
+        prof, seq, _ = _load_unlocked(index_dir, user)
+        _compact(index_dir, user, prof, seq)
+
+
+def _compact(index_dir: Path, user: str, prof: dict, seq: int) -> None:
+    # seq first, so _snapshot_seq() only reads the head of the file
+    snap = {SEQ_KEY: seq, **{k: v for k, v in prof.items() if k != SEQ_KEY}}
+    _write_snapshot(index_dir, user, snap)
+    jpath = journal_path(index_dir, user)
+    if jpath.exists():
+        jpath.unlink()
+
+
+def label_counts(index_dir: Path, user: str) -> Dict[str, int]:
+    """label -> number of examples, in one pass over the examples."""
+    counts = Counter(ex["label"] for ex in load(index_dir, user)["examples"])
+    return dict(sorted(counts.items()))
+
+
+def users(index_dir: Path) -> List[str]:
+    return sorted(p.stem for p in Path(index_dir).glob("*.json"))
+
+
+def delete(index_dir: Path, user: str) -> None:
+    """Remove snapshot and journal (the lock file is left in place)."""
+    with locked(index_dir, user):
+        for p in (snapshot_path(index_dir, user), journal_path(index_dir, user)):
+            if p.exists():
+                p.unlink()
@@ -3,10 +3,14 @@ server.py
 
 Flask API for:
  - receiving training groups (audio files + metadata JSON) from the website
- - saving files into the sound_matcher expected structure
+ - ingesting uploads into the sound_matcher expected structure (ingest.py)
  - updating profile index files
- - retraining the model for a user
- - lightweight status + management endpoints
+ - queueing background retrains for a user (see training_jobs.py)
+ - lightweight status + job + management endpoints
+ - enrollment audio retention / compaction and disk usage (storage.py)
+ - streaming a user's snapshot out / back in (snapshot.py):
+     GET /export_user?user=alice[&audio=0]
+     POST /import_user[?user=bob][&overwrite=1]  (body: the archive)
 
 Usage:
     python3 server.py
@@ -15,14 +19,18 @@ Notes:
  - This expects sound_matcher.py to be in the same folder and expose:
      * normalize_text(user: str) -> str
      * load_profile(user: str) -> dict
-     * save_profile(user: str, prof: dict) -> None
+     * add_examples(user, examples, scripts) / remove_label(user, label)
+     * profile_lock(user: str) (cross-process lock, see profile_store.py)
      * train_model(user: str) -> None
+     * evict_features(user: str, paths) -> int
      * AUDIO_DIR (Path)
- - Adjust BASE_DIR and STATUS_FILE paths if you want them somewhere else.
+ - Endpoints that change a user's examples return 202 with a job id right
+   away; poll GET /jobs/<id> for queued / running / done / failed.
+ - Adjust BASE_DIR if you want the data somewhere else.
  - This is designed to be very lightweight on the Pi.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
 from pathlib import Path
 import os
@@ -33,6 +41,12 @@ from flask_cors import CORS
 
 import sound_matcher as sm
 import home_assistant_interfacing as ha
+import training_jobs as tj
+import tuning
+import ingest
+import metrics
+import snapshot
+import storage
 
 app = Flask(__name__)
 CORS(app, origins=["http://localhost:5173", "http://127.0.0.1:5173"], supports_credentials=True)
@@ -44,12 +58,6 @@ AUDIO_DIR = Path(sm.AUDIO_DIR)            # sound_profiles/audio/
 INDEX_DIR = Path(sm.INDEX_DIR)            # sound_profiles/indices/
 MODEL_DIR = Path(sm.MODEL_DIR)            # sound_profiles/models/
 
-# status text file 
-STATUS_FILE = Path("/home/pi/status.txt") if Path("/home/pi").exists() else Path("status.txt")
-
-# Allowed audio extensions
-ALLOWED_AUDIO_EXTS = {".wav"}
-
 # Ensure folders exist
 BASE_DIR.mkdir(parents=True, exist_ok=True)
 AUDIO_DIR.mkdir(parents=True, exist_ok=True)
@@ -57,27 +65,15 @@ INDEX_DIR.mkdir(parents=True, exist_ok=True)
 MODEL_DIR.mkdir(parents=True, exist_ok=True)
 
 
-# ========== Utility helpers ==========
-def set_status(msg: str) -> None:
-    """Write a short status string to STATUS_FILE (also print)."""
-    try:
-        STATUS_FILE.write_text(msg)
-    except Exception:
-        # best-effort: print stack if can't write
-        print("Could not write status:", traceback.format_exc())
-    print("[STATUS]", msg)
-
-
-def is_audio_filename_ok(name: str) -> bool:
-    ext = Path(name).suffix.lower()
-    return ext in ALLOWED_AUDIO_EXTS
+# Background retrains: one worker per user, back-to-back requests coalesced.
+# Tuning (tuning.py) and storage compaction (storage.py) jobs run on the
+# same per-user worker.
+trainer = tj.TrainingScheduler(sm.train_model, tasks={"tune": tuning.tune_user,
+                                                      "compact": storage.compact_user})
+# /status word for a running job of each task kind
+JOB_VERBS = {"train": "TRAINING", "tune": "TUNING", "compact": "COMPACTING"}
 
 
-def safe_save_file(file_storage, dest_path: Path) -> None:
-    """Save a Werkzeug FileStorage to dest_path (Path)."""
-    dest_path.parent.mkdir(parents=True, exist_ok=True)
-    file_storage.save(str(dest_path))
-
 # ========== API Endpoints ==========
 
 @app.route("/upload_profile_group", methods=["POST"])
@@ -89,21 +85,20 @@ def upload_profile_group():
       - form field 'metadata' (optional JSON string) - extra info
       - one or more file fields named 'audio_files' (the actual audio)
     The route will:
-      - save audio files to AUDIO_DIR/<user>/<label>/
+      - stream, validate and convert audio files to 16 kHz mono WAVs in
+        AUDIO_DIR/<user>/<label>/ and cache their features (see ingest.py)
       - add entries to the user's index JSON (INDEX_DIR/<user>.json)
-      - call train_model(user) after saving files
+      - queue a background retrain and return its job id (202)
     """
     try:
         # Basic params
         user_raw = request.form.get("user", "").strip()
         if not user_raw:
-            set_status("ERROR: Missing 'user' in form")
             return jsonify({"error": "Missing 'user' form field"}), 400
         user = sm.normalize_text(user_raw)
 
         id_raw = request.form.get("id", "").strip()
         if not id_raw:
-            set_status("ERROR: Missing 'id' in form")
             return jsonify({"error": "Missing 'id' form field"}), 400
         
         hass_ip = request.form.get("hass_ip", "")
@@ -124,39 +119,23 @@ def upload_profile_group():
 
         uploaded_files = request.files.getlist("audio_files")
         if not uploaded_files:
-            set_status("ERROR: No audio files uploaded")
             return jsonify({"error": "No audio_files in request"}), 400
 
-        # Load existing profile index for user
-        prof = sm.load_profile(user)
-        examples = prof.get("examples", []) or []
-
         # Save each uploaded file into AUDIO_DIR/<user>/<label>/
         stash_dir = AUDIO_DIR / user / label
         stash_dir.mkdir(parents=True, exist_ok=True)
 
-        saved = []
-        for f in uploaded_files:
-            filename = secure_filename(f.filename or "")
-            if not filename:
-                # skip empty filenames
-                continue
-            if not is_audio_filename_ok(filename):
-                # skip unsupported ext (or optionally convert later)
-                continue
-
-            # determine next filename index
-            next_idx = len(list(stash_dir.glob("*.wav"))) + 1
-            # always save as wav if source is wav; otherwise keep filename extension
-            dest = stash_dir / f"{next_idx:03d}{Path(filename).suffix.lower()}"
-            safe_save_file(f, dest)
-
-            # record in profile examples; label is the group label
-            examples.append({"path": str(dest), "label": label})
-            saved.append(str(dest))
-
-        prof["examples"] = examples
-        sm.save_profile(user, prof)
+        # Decoding and featurizing run unlocked (ingest only locks to reserve
+        # file names); the profile change itself is one journal append.
+        # Files a concurrent /delete_group removed meanwhile are not added.
+        uploads = [(secure_filename(f.filename or "") or "unnamed", f.stream) for f in uploaded_files]
+        examples, saved, rejected = ingest.ingest_uploads(user, label, uploads, stash_dir)
+        if examples:
+            with sm.profile_lock(user):
+                examples = [ex for ex in examples if Path(ex["path"]).exists()]
+                sm.add_examples(user, examples, scripts={label: id_raw})  # Add script_id
+        if not saved:
+            return jsonify({"error": "No valid audio files", "rejected": rejected}), 400
 
         # Optionally write per-group metadata file
         try:
@@ -166,36 +145,25 @@ def upload_profile_group():
                 "uploader_user_field": user_raw,
                 "group_name": group_name_raw,
                 "metadata": metadata,
-                "saved_files": saved
+                "saved_files": saved,
+                "rejected_files": rejected,
             }
             meta_path.write_text(json.dumps(meta_blob, indent=2))
         except Exception:
             # not critical
             pass
 
-        # Train the model for this user (best-effort)
-        try:
-            set_status(f"TRAINING:{user}")
-            prof = sm.load_profile(user)
-            scripts = prof.get("scripts", {})
-            scripts[label] = id_raw  # Add script_id
-            prof["scripts"] = scripts
-            sm.save_profile(user, prof)
-            sm.train_model(user)
-            set_status("OK")
-        except Exception as e:
-            set_status(f"ERROR: training failed: {e}")
-            # return success with training failure detail (so uploader sees it)
-            return jsonify({
-                "message": "Files saved",
-                "saved_files": saved,
-                "train_error": str(e)
-            }), 200
-
-        return jsonify({"message": "Files saved and model retrained", "saved_files": saved}), 200
+        # Retrain in the background; the client polls /jobs/<id>
+        job = trainer.submit(user, reason=f"upload:{label}")
+        return jsonify({
+            "message": "Files saved; retrain queued",
+            "saved_files": saved,
+            "rejected_files": rejected,
+            "job_id": job["id"],
+            "job": job,
+        }), 202
 
     except Exception as exc:
-        set_status(f"ERROR: {str(exc)}")
         traceback.print_exc()
         return jsonify({"error": str(exc)}), 500
 
@@ -212,25 +180,75 @@ def train_user_endpoint():
         if not user_raw:
             return jsonify({"error": "Missing 'user' parameter"}), 400
         user = sm.normalize_text(user_raw)
-        set_status(f"TRAINING:{user}")
-        sm.train_model(user)
-        set_status("OK")
-        return jsonify({"message": "Training complete"}), 200
+        job = trainer.submit(user, reason="manual")
+        return jsonify({"message": "Training queued", "job_id": job["id"], "job": job}), 202
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/tune_user", methods=["POST"])
+def tune_user_endpoint():
+    """
+    Cross-validate forest size/depth and decision thresholds for a user,
+    store them in the profile and retrain (see tuning.py):
+      POST JSON body: {"user": "alice"}
+    """
+    try:
+        j = request.get_json(force=True, silent=True) or {}
+        user_raw = j.get("user") or request.form.get("user")
+        if not user_raw:
+            return jsonify({"error": "Missing 'user' parameter"}), 400
+        user = sm.normalize_text(user_raw)
+        job = trainer.submit(user, reason="manual", task="tune")
+        return jsonify({"message": "Tuning queued", "job_id": job["id"], "job": job}), 202
     except Exception as e:
-        set_status(f"ERROR: training failed: {e}")
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """State of one training job: queued / running / done / failed, with timings."""
+    job = trainer.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    return jsonify(job), 200
+
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    """Recent training jobs, optionally filtered: GET /jobs?user=alice"""
+    user_raw = request.args.get("user", "")
+    user = sm.normalize_text(user_raw) if user_raw else None
+    return jsonify({"jobs": trainer.jobs(user)}), 200
+
+
 @app.route("/status", methods=["GET"])
 def get_status():
-    """Return the current status text (short string)."""
+    """
+    Short status string derived from the job queue (TRAINING / TUNING /
+    COMPACTING:<user>, QUEUED:<user>, OK, "ERROR: <task> failed for <user>:
+    <error>" or NO_STATUS) plus the jobs that are still queued/running.
+    """
     try:
-        if STATUS_FILE.exists():
-            content = STATUS_FILE.read_text().strip()
+        jobs = trainer.jobs()
+        active = [j for j in jobs if j["state"] in ("queued", "running")]
+        running = [j for j in active if j["state"] == "running"]
+        if running:
+            verb = JOB_VERBS.get(running[0]["task"], running[0]["task"].upper())
+            content = f"{verb}:{running[0]['user']}"
+        elif active:
+            content = f"QUEUED:{active[0]['user']}"
+        elif not jobs:
+            content = "NO_STATUS"
         else:
-            content = "NO_STATUS" 
-        return jsonify({"status": content}), 200
+            last = max(jobs, key=lambda j: j["finished_at"] or 0)
+            if last["state"] == "done":
+                content = "OK"
+            else:
+                content = f"ERROR: {last['task']} failed for {last['user']}: {last['error']}"
+        return jsonify({"status": content, "active_jobs": active}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -238,14 +256,11 @@ def get_status():
 @app.route("/list_users", methods=["GET"])
 def list_users():
     """
-    Return a list of users that have profile index files in INDEX_DIR.
+    Return a list of users that have a stored profile (JSON index or SQLite).
     Useful for the website to populate a dropdown.
     """
     try:
-        users = []
-        for p in INDEX_DIR.glob("*.json"):
-            users.append(p.stem)
-        return jsonify({"users": sorted(users)}), 200
+        return jsonify({"users": sm.list_users()}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -261,8 +276,7 @@ def list_labels():
         if not user_raw:
             return jsonify({"error": "Missing user parameter"}), 400
         user = sm.normalize_text(user_raw)
-        prof = sm.load_profile(user)
-        labels = sorted(set(ex["label"] for ex in prof.get("examples", [])))
+        labels = list(sm.label_counts(user))
         return jsonify({"labels": labels}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -276,66 +290,151 @@ def delete_group():
     This:
       - removes files under AUDIO_DIR/<user>/<label>/
       - removes examples from the index for that label
-      - retrains the model (best-effort)
+      - queues a background retrain and returns its job id (202)
     """
     try:
         # Get form fields
         user_raw = request.form.get("user", "").strip()
         group_name_raw = request.form.get("group_name", "").strip()
         if not user_raw or not group_name_raw:
-            set_status("ERROR: Missing 'user' or 'group_name'")
             return jsonify({"error": "Missing 'user' or 'group_name' in form"}), 400
 
         user = sm.normalize_text(user_raw)
         label = sm.normalize_text(group_name_raw)
 
-        # Target folder to delete
-        target_dir = AUDIO_DIR / user / label
-        if not target_dir.exists():
-            return jsonify({"error": "Group not found"}), 404
+        # One lock for check, profile update and file deletion, so a
+        # concurrent upload to this label can't journal files deleted here
+        with sm.profile_lock(user):
+            # The profile decides whether the group exists: after a
+            # features-only snapshot import it has no audio folder
+            if label not in sm.label_counts(user):
+                return jsonify({"error": "Group not found"}), 404
+
+            # Update profile index first: remove examples with this label
+            label_files = sm.label_paths(user, label)
+            sm.remove_label(user, label)
+
+            # Delete all files in the folder, if there is one
+            target_dir = AUDIO_DIR / user / label
+            saved_deleted = []
+            if target_dir.exists():
+                for f in target_dir.glob("*"):
+                    try:
+                        f.unlink()
+                        saved_deleted.append(str(f))
+                    except Exception:
+                        pass
+                try:
+                    target_dir.rmdir()
+                except Exception:
+                    pass  # ignore if folder not empty
+
+            # Drop cached features for the removed audio (and for examples
+            # restored without audio, which have no file to delete)
+            sm.evict_features(user, saved_deleted + label_files)
+
+        # Retrain in the background (same as upload)
+        job = trainer.submit(user, reason=f"delete:{label}")
+        return jsonify({
+            "message": "Group deleted; retrain queued",
+            "deleted_files": saved_deleted,
+            "job_id": job["id"],
+            "job": job,
+        }), 202
 
-        # Delete all files in the folder
-        saved_deleted = []
-        for f in target_dir.glob("*"):
-            try:
-                f.unlink()
-                saved_deleted.append(str(f))
-            except Exception:
-                pass
-        try:
-            target_dir.rmdir()
-        except Exception:
-            pass  # ignore if folder not empty
+    except Exception as exc:
+        traceback.print_exc()
+        return jsonify({"error": str(exc)}), 500
 
-        # Update profile index: remove examples with this label
-        prof = sm.load_profile(user)
-        prof["examples"] = [ex for ex in prof.get("examples", []) if ex.get("label") != label]
-        if "scripts" in prof and label in prof["scripts"]:
-            del prof["scripts"][label]
-        sm.save_profile(user, prof)
 
-        # Retrain model (same as upload)
-        try:
-            set_status(f"TRAINING:{user}")
-            sm.train_model(user)
-            set_status("OK")
-        except Exception as e:
-            set_status(f"ERROR: retrain failed: {e}")
-            return jsonify({
-                "message": "Group deleted",
-                "deleted_files": saved_deleted,
-                "retrain_error": str(e)
-            }), 200
+# ========== Storage ==========
+@app.route("/storage_usage", methods=["GET"])
+def storage_usage():
+    """
+    Disk usage per user and label (see storage.py):
+      GET /storage_usage[?user=alice]
+    """
+    try:
+        user_raw = request.args.get("user", "")
+        return jsonify({"usage": storage.usage(user_raw or None)}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        return jsonify({
-            "message": "Group deleted and model retrained",
-            "deleted_files": saved_deleted
-        }), 200
 
-    except Exception as exc:
-        set_status(f"ERROR: {str(exc)}")
+@app.route("/compact_user", methods=["POST"])
+def compact_user_endpoint():
+    """
+    Cap examples per label, transcode and garbage-collect a user's audio
+    with the storage.py defaults, then retrain if examples were dropped:
+      POST JSON body: {"user": "alice"}
+    """
+    try:
+        j = request.get_json(force=True, silent=True) or {}
+        user_raw = j.get("user") or request.form.get("user")
+        if not user_raw:
+            return jsonify({"error": "Missing 'user' parameter"}), 400
+        user = sm.normalize_text(user_raw)
+        job = trainer.submit(user, reason="manual", task="compact")
+        return jsonify({"message": "Compaction queued", "job_id": job["id"], "job": job}), 202
+    except Exception as e:
         traceback.print_exc()
-        return jsonify({"error": str(exc)}), 500
+        return jsonify({"error": str(e)}), 500
+
+
+# ========== Snapshots ==========
+@app.route("/export_user", methods=["GET"])
+def export_user():
+    """
+    Stream a user's snapshot as a tar archive (see snapshot.py):
+      GET /export_user?user=alice          profile, features, models, audio
+      GET /export_user?user=alice&audio=0  features-only (no raw audio)
+    """
+    user_raw = request.args.get("user", "")
+    if not user_raw:
+        return jsonify({"error": "Missing user parameter"}), 400
+    user = sm.normalize_text(user_raw)
+    if user not in sm.list_users():
+        return jsonify({"error": "Unknown user"}), 404
+    include_audio = request.args.get("audio", "1") not in ("0", "false", "no")
+    kind = "full" if include_audio else "features"
+    return Response(
+        stream_with_context(snapshot.iter_export(user, include_audio)),
+        mimetype="application/x-tar",
+        headers={"Content-Disposition": f'attachment; filename="{user}-{kind}.tar"'},
+    )
+
+
+@app.route("/import_user", methods=["POST"])
+def import_user():
+    """
+    Restore a snapshot sent as the raw request body (streamed, never held
+    in memory):
+      POST /import_user                     as the exported user
+      POST /import_user?user=bob&overwrite=1
+    409 if the user exists and overwrite is not set.
+    """
+    try:
+        user_raw = request.args.get("user") or None
+        overwrite = request.args.get("overwrite", "0") in ("1", "true", "yes")
+        result = snapshot.import_snapshot(request.stream, user_raw, overwrite)
+        return jsonify({"message": "Snapshot imported", **result}), 200
+    except snapshot.UserExists as e:
+        return jsonify({"error": str(e)}), 409
+    except snapshot.SnapshotError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+# ========== Metrics ==========
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Per-stage latency histograms in Prometheus text format. Recording is
+    off unless SOUND_MATCHER_METRICS=1 (or metrics.enable() was called).
+    """
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 # ========== Lightweight health endpoint ==========
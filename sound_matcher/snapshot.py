@@ -0,0 +1,392 @@
+"""
+snapshot.py
+
+Export / import one user's trained setup as a single tar stream, to back
+up a Pi or move it to another one without copying sound_profiles/ by hand.
+
+    python3 snapshot.py export --user alice -o alice.tar
+    python3 snapshot.py export --user alice --features-only -o alice.tar
+    python3 snapshot.py import alice.tar [--user bob] [--overwrite]
+
+Archive members (plain pax tar, `tar -tf` lists them):
+ - snapshot.json          format, user, mode, feature version, creation time
+ - profile.json           examples (paths as archive names), scripts, params
+ - features.npz           the cached feature vectors of those examples
+ - models/<name>          every trained model file, of every engine
+ - audio/<label>/<file>   the example WAVs (left out with features-only)
+ - manifest.json          size + SHA-256 of every member above (last)
+
+iter_export() yields the archive in chunks: each file is read COPY_CHUNK
+at a time and hashed while it is sent, so the archive is never held in
+memory and the server streams it straight to the client. Import reads the
+stream the same way into a staging folder, checks every member against the
+manifest, and only then moves the files into place and writes the profile,
+so a truncated or corrupt upload changes nothing.
+
+A features-only snapshot restores profile, features and models, so
+prediction works at once with no re-featurize or retrain. Its feature-cache
+entries are marked detached (feature_cache.DETACHED_MTIME) and keep
+serving while the audio is absent, so the RF and prototype engines can
+still retrain; the DTW engine needs audio for labels that change.
+Example paths are rewritten for the importing user, so the first retrain
+after an import refits from scratch (from cached features, not audio).
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import engines
+import feature_cache as fc
+import sound_matcher as sm
+
+FORMAT_VERSION = 1
+COPY_CHUNK = 64 * 1024
+META = "snapshot.json"
+PROFILE = "profile.json"
+FEATURES = "features.npz"
+MANIFEST = "manifest.json"
+
+_PART_RE = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]*$")
+
+
+class SnapshotError(ValueError):
+    """The archive is malformed or fails its checksums."""
+
+
+class UserExists(SnapshotError):
+    """Importing would replace an existing user (pass overwrite=True)."""
+
+
+# ===== Naming =====
+def _model_names(user: str) -> Dict[str, Path]:
+    """Archive name -> model file, for every engine's files of `user`."""
+    out = {}
+    for engine in engines.ENGINES.values():
+        for path in engine.model_files(user):
+            out[f"models/{path.name[len(user) + 1:]}"] = path
+    return out
+
+
+def _audio_names(user: str, examples: List[dict]) -> List[str]:
+    """
+    Archive name of every example: audio/<label>/<file> as stored under the
+    user's audio folder; files enrolled from elsewhere get a unique name in
+    their label's folder.
+    """
+    root = (sm.AUDIO_DIR / user).resolve()
+    names, taken = [], set()
+    for i, ex in enumerate(examples):
+        p = Path(ex["path"])
+        try:
+            rel = p.resolve().relative_to(root).as_posix()
+        except ValueError:
+            rel = ""
+        if not rel or rel.count("/") != 1 or not all(_PART_RE.match(x) for x in rel.split("/")):
+            rel = f"{sm.normalize_text(ex['label'])}/ext{i:05d}{p.suffix.lower() or '.wav'}"
+        name = f"audio/{rel}"
+        while name in taken:
+            name = f"audio/{sm.normalize_text(ex['label'])}/dup{len(taken):05d}{p.suffix.lower()}"
+        taken.add(name)
+        names.append(name)
+    return names
+
+
+def _check_name(name: str) -> None:
+    if name in (META, PROFILE, FEATURES, MANIFEST):
+        return
+    parts = name.split("/")
+    ok = (
+        (parts[0] == "models" and len(parts) == 2)
+        or (parts[0] == "audio" and len(parts) == 3)
+    ) and all(_PART_RE.match(p) for p in parts[1:])
+    if not ok:
+        raise SnapshotError(f"unexpected archive member {name!r}")
+
+
+# ===== Export =====
+class _TarStream:
+    """Minimal streaming tar writer that checksums every member it emits."""
+
+    def __init__(self):
+        self.offset = 0
+        self.manifest: Dict[str, dict] = {}
+
+    def _out(self, data: bytes) -> bytes:
+        self.offset += len(data)
+        return data
+
+    def _header(self, name: str, size: int, mtime: float) -> bytes:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        return self._out(info.tobuf(format=tarfile.PAX_FORMAT))
+
+    def _pad(self, size: int) -> Iterator[bytes]:
+        if size % tarfile.BLOCKSIZE:
+            yield self._out(b"\0" * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE))
+
+    def add_bytes(self, name: str, data: bytes, record: bool = True) -> Iterator[bytes]:
+        yield self._header(name, len(data), time.time())
+        yield self._out(data)
+        yield from self._pad(len(data))
+        if record:
+            self.manifest[name] = {"size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+    def add_file(self, name: str, path: Path, chunk: int = COPY_CHUNK) -> Iterator[bytes]:
+        # the open handle pins the inode, so an atomic replace mid-export
+        # cannot change what is sent
+        with open(path, "rb") as fh:
+            st = os.fstat(fh.fileno())
+            yield self._header(name, st.st_size, st.st_mtime)
+            h = hashlib.sha256()
+            left = st.st_size
+            while left:
+                data = fh.read(min(chunk, left))
+                if not data:
+                    raise SnapshotError(f"{path} shrank while being exported")
+                h.update(data)
+                left -= len(data)
+                yield self._out(data)
+        yield from self._pad(st.st_size)
+        self.manifest[name] = {"size": st.st_size, "sha256": h.hexdigest()}
+
+    def close(self) -> Iterator[bytes]:
+        yield from self.add_bytes(MANIFEST, json.dumps(self.manifest, indent=1).encode(), record=False)
+        end = self.offset + 2 * tarfile.BLOCKSIZE
+        end += -end % tarfile.RECORDSIZE
+        yield self._out(b"\0" * (end - self.offset))
+
+
+def _features_npz(cache: fc.FeatureCache, paths: List[str], names: List[str]) -> bytes:
+    rows = [(n, cache.entries[p]) for p, n in zip(paths, names)
+            if p in cache.entries and cache.entries[p]["version"] == cache.version]
+    buf = io.BytesIO()
+    np.savez(
+        buf,
+        names=np.array([n for n, _ in rows], dtype=str),
+        sizes=np.array([e["size"] for _, e in rows], dtype=np.int64),
+        hashes=np.array([e["sha1"] for _, e in rows], dtype=str),
+        versions=np.array([e["version"] for _, e in rows], dtype=str),
+        feats=(np.vstack([e["feats"] for _, e in rows]).astype(np.float32) if rows
+               else np.zeros((0, 0), dtype=np.float32)),
+    )
+    return buf.getvalue()
+
+
+def iter_export(user: str, include_audio: bool = True, chunk: int = COPY_CHUNK) -> Iterator[bytes]:
+    """Yield a snapshot of `user` as tar bytes, a chunk at a time."""
+    user = sm.normalize_text(user)
+    with sm.profile_lock(user):
+        prof = sm.load_profile(user)
+        examples = prof.get("examples", [])
+        names = _audio_names(user, examples)
+        cache = sm.load_feature_cache(user)
+        features = _features_npz(cache, [ex["path"] for ex in examples], names)
+        models = [(n, p) for n, p in _model_names(user).items() if p.exists()]
+        audio = [(n, Path(ex["path"])) for n, ex in zip(names, examples)] if include_audio else []
+        missing = [n for n, p in audio if not p.exists()]
+        audio = [(n, p) for n, p in audio if p.exists()]
+
+    profile = {k: v for k, v in prof.items() if k != "examples"}
+    profile["examples"] = [{"path": n, "label": ex["label"]} for n, ex in zip(names, examples)]
+    meta = {
+        "format": FORMAT_VERSION,
+        "user": user,
+        "features_only": not include_audio,
+        "feature_version": sm.feature_version(),
+        "engine": sm.engine_name(prof.get("params")),
+        "examples": len(examples),
+        "missing_audio": missing,
+        "created": time.time(),
+    }
+
+    tar = _TarStream()
+    yield from tar.add_bytes(META, json.dumps(meta, indent=1).encode())
+    yield from tar.add_bytes(PROFILE, json.dumps(profile).encode())
+    yield from tar.add_bytes(FEATURES, features)
+    for name, path in models + audio:
+        yield from tar.add_file(name, path, chunk)
+    yield from tar.close()
+
+
+def export_to(user: str, dest: Path, include_audio: bool = True) -> dict:
+    """Write a snapshot file (atomically); returns {"path", "bytes", "seconds"}."""
+    t0 = time.perf_counter()
+    dest = Path(dest)
+    tmp = dest.with_name(dest.name + ".tmp")
+    size = 0
+    with open(tmp, "wb") as out:
+        for data in iter_export(user, include_audio):
+            out.write(data)
+            size += len(data)
+    os.replace(tmp, dest)
+    return {"path": str(dest), "bytes": size, "seconds": time.perf_counter() - t0}
+
+
+# ===== Import =====
+def _receive(src: BinaryIO, staging: Path, chunk: int = COPY_CHUNK) -> Dict[str, Tuple[Path, int, str]]:
+    """Stream every member into `staging`; name -> (staged file, size, sha256)."""
+    received: Dict[str, Tuple[Path, int, str]] = {}
+    try:
+        with tarfile.open(fileobj=src, mode="r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    raise SnapshotError(f"unexpected archive member {member.name!r}")
+                _check_name(member.name)
+                if member.name in received:
+                    raise SnapshotError(f"duplicate archive member {member.name!r}")
+                staged = staging / f"{len(received):06d}"
+                h = hashlib.sha256()
+                size = 0
+                with tar.extractfile(member) as fh, open(staged, "wb") as out:
+                    for data in iter(lambda: fh.read(chunk), b""):
+                        h.update(data)
+                        size += len(data)
+                        out.write(data)
+                received[member.name] = (staged, size, h.hexdigest())
+    except tarfile.TarError as e:
+        raise SnapshotError(f"not a readable snapshot ({e})") from e
+    return received
+
+
+def _verify(received: Dict[str, Tuple[Path, int, str]]) -> dict:
+    for name in (META, PROFILE, FEATURES, MANIFEST):
+        if name not in received:
+            raise SnapshotError(f"archive is missing {name} (truncated?)")
+    manifest = json.loads(received[MANIFEST][0].read_bytes())
+    names = set(received) - {MANIFEST}
+    if set(manifest) != names:
+        raise SnapshotError("archive members do not match its manifest")
+    for name in names:
+        _, size, digest = received[name]
+        if manifest[name]["size"] != size or manifest[name]["sha256"] != digest:
+            raise SnapshotError(f"checksum mismatch for {name}")
+    meta = json.loads(received[META][0].read_bytes())
+    if meta.get("format") != FORMAT_VERSION:
+        raise SnapshotError(f"unsupported snapshot format {meta.get('format')}")
+    return meta
+
+
+def import_snapshot(src: BinaryIO, user: Optional[str] = None, overwrite: bool = False) -> dict:
+    """
+    Restore a snapshot read from the file-like `src` as `user` (default: the
+    exported user). Raises UserExists if the user has a profile and
+    overwrite is False, SnapshotError if the archive is bad.
+    """
+    t0 = time.perf_counter()
+    sm.ensure_dirs()
+    staging = Path(tempfile.mkdtemp(prefix=".import-", dir=sm.DATA_DIR))
+    try:
+        received = _receive(src, staging)
+        meta = _verify(received)
+        user = sm.normalize_text(user or meta["user"])
+        profile = json.loads(received[PROFILE][0].read_bytes())
+        with np.load(received[FEATURES][0], allow_pickle=False) as z:
+            feats = {str(n): (int(s), str(h), str(v), f) for n, s, h, v, f in
+                     zip(z["names"], z["sizes"], z["hashes"], z["versions"], z["feats"])}
+
+        models = _model_names(user)
+        audio_dir = sm.AUDIO_DIR / user
+        with sm.profile_lock(user):
+            if user in sm.list_users():
+                if not overwrite:
+                    raise UserExists(f"user '{user}' already exists")
+                sm.reset_user(user)
+
+            restored = {}
+            for name, (staged, _, _) in received.items():
+                if name.startswith("audio/"):
+                    dest = audio_dir / name[len("audio/"):]
+                elif name.startswith("models/"):
+                    if name not in models:
+                        continue        # an engine this version does not know
+                    dest = models[name]
+                else:
+                    continue
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(staged, dest)
+                restored[name] = dest
+
+            examples = []
+            cache = sm.load_feature_cache(user)
+            for ex in profile.get("examples", []):
+                name = ex["path"]
+                if not name.startswith("audio/"):
+                    raise SnapshotError(f"bad example path {name!r}")
+                _check_name(name)
+                path = audio_dir / name[len("audio/"):]
+                examples.append({"path": str(path), "label": ex["label"]})
+                if name in feats:
+                    size, sha1, version, vec = feats[name]
+                    mtime = os.stat(path).st_mtime_ns if name in restored else fc.DETACHED_MTIME
+                    cache.set_entry(path, {"size": size, "mtime": mtime, "sha1": sha1,
+                                           "version": version, "feats": vec})
+            cache.save()
+
+            # the profile goes last: until it exists the user is not visible
+            prof = {k: v for k, v in profile.items() if k != "examples"}
+            prof["examples"] = examples
+            prof.setdefault("scripts", {})
+            sm.save_profile(user, prof)
+        sm._models.invalidate(user)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    return {
+        "user": user,
+        "features_only": bool(meta.get("features_only")),
+        "examples": len(examples),
+        "audio_files": sum(1 for n in restored if n.startswith("audio/")),
+        "models": sorted(n for n in restored if n.startswith("models/")),
+        "features": sum(1 for ex in profile.get("examples", []) if ex["path"] in feats),
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+def import_from(src: Path, user: Optional[str] = None, overwrite: bool = False) -> dict:
+    with open(src, "rb") as fh:
+        return import_snapshot(fh, user, overwrite)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="write a user's snapshot")
+    ex.add_argument("--user", required=True)
+    ex.add_argument("-o", "--out", type=Path, default=None, help="archive path (default <user>.tar)")
+    ex.add_argument("--features-only", action="store_true", help="leave the raw audio out")
+    im = sub.add_parser("import", help="restore a snapshot")
+    im.add_argument("archive", type=Path)
+    im.add_argument("--user", default=None, help="restore under this name (default: the exported user)")
+    im.add_argument("--overwrite", action="store_true", help="replace an existing user")
+    args = ap.parse_args()
+
+    try:
+        if args.cmd == "export":
+            out = args.out or Path(f"{sm.normalize_text(args.user)}.tar")
+            result = export_to(args.user, out, include_audio=not args.features_only)
+        else:
+            result = import_from(args.archive, args.user, args.overwrite)
+    except SnapshotError as e:
+        print(sm.Y + str(e) + sm.R, file=sys.stderr)
+        return 2
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
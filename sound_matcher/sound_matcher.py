@@ -1,15 +1,30 @@
-import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import  List
+from typing import Dict, List, Optional
 
 import numpy as np
-import sounddevice as sd
 import soundfile as sf
-import librosa
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import LabelEncoder
-import joblib
 import home_assistant_interfacing as ha
+import compact_forest as cf
+import incremental
+import lazy_import
+import feature_cache as fc
+import model_registry as mr
+import streaming
+import features
+import profile_store as ps
+import sqlite_store as ss
+import metrics
+
+# Heavy imports are deferred until first use (see warm_up())
+librosa = lazy_import.lazy("librosa")
+joblib = lazy_import.lazy("joblib")
+sk_ensemble = lazy_import.lazy("sklearn.ensemble")
+engines = lazy_import.lazy("engines")   # imports this module
+_IMPORTED_AT = time.perf_counter()
 
 # ===== Terminal colours =====
 B = "\033[1m"
@@ -24,28 +39,103 @@ CHANNELS = 1
 REC_LEN_SEC = 3.0        # window length for commands
 RMS_GATE = 0.001         # permissive gate; adjust if needed
 
+# Streaming capture: stop recording as soon as the utterance ends instead of
+# always waiting REC_LEN_SEC (REC_LEN_SEC stays the maximum utterance length).
+STREAMING_CAPTURE = True
+LISTEN_TIMEOUT_SEC = 5.0  # give up if nobody starts speaking within this
+STREAMING_FEATURES = True # compute MFCC frames while the user is still speaking
+
 ENROLL_SAMPLES = 10      # mic recordings per command
 
 # RandomForest settings
 N_TREES = 200
 MAX_DEPTH = None
 RANDOM_STATE = 0
+FIT_N_JOBS = -1          # cores used by RandomForest.fit (-1 = all)
+
+# Matcher engine (engines.py): "rf" is the RandomForest below; "prototype"
+# is a nearest-neighbour / centroid matcher that predicts with one
+# matrix-vector product and adds a command without refitting anything;
+# "dtw" matches MFCC frame sequences against every enrolled example with
+# banded dynamic time warping (keeps timing, for few-shot commands).
+# A user's profile params may override it with {"engine": ...}.
+ENGINE = "rf"
+
+# Training mode: "full" refits one multi-class forest on every example;
+# "incremental" keeps a small forest per label (incremental.py) and only
+# refits the labels an upload/delete touched. A full refit is forced after
+# MAX_INCREMENTAL_UPDATES updates or once more than MAX_DRIFT of the
+# examples changed since the last full fit. "incremental" retrains faster
+# on large profiles but is opt-in: its per-label scores are less sharply
+# separated, so check false triggers (benchmark.py) before switching.
+TRAIN_MODE = "full"
+MAX_INCREMENTAL_UPDATES = 10
+MAX_DRIFT = 0.5
+
+# Parallel feature extraction (training / directory enrollment)
+FEATURE_WORKERS = 0          # 0 = os.cpu_count()
+FEATURE_EXECUTOR = "process" # "process" or "thread"
+FEATURE_CHUNKSIZE = 8        # files per task; each task is batch-featurized
 
 # Decision thresholds
 MIN_PROBA = 0.60         # minimum probability for top class
 MARGIN_PROBA = 0.15      # top1 - top2 must be at least this, else UNKNOWN
 
 # Storage
-DATA_DIR = Path("sound_profiles")
+DATA_DIR = Path(os.environ.get("SOUND_MATCHER_DATA_DIR", "sound_profiles"))
 AUDIO_DIR = DATA_DIR / "audio"
 INDEX_DIR = DATA_DIR / "indices"
 MODEL_DIR = DATA_DIR / "models"
-AUDIO_DIR.mkdir(parents=True, exist_ok=True)
-INDEX_DIR.mkdir(parents=True, exist_ok=True)
-MODEL_DIR.mkdir(parents=True, exist_ok=True)
+FEATURE_DIR = DATA_DIR / "features"
+PROFILE_DB = DATA_DIR / "profiles.sqlite"
+
+# Profile storage: "json" (snapshot + journal per user in INDEX_DIR) or
+# "sqlite" (indexed tables in PROFILE_DB; JSON profiles are imported on
+# first access)
+PROFILE_BACKEND = "json"
+
+# Feature pipeline for new models: "padded" zero-pads every trimmed clip
+# to REC_LEN_SEC before the MFCC (the original pipeline); "valid" frames
+# only the real signal and takes the statistics over those frames. Each
+# model records the version it was trained on and is always fed matching
+# features, so models trained before a switch keep working. ("sequence",
+# the time-normalized MFCC frames, is what the "dtw" engine trains on.)
+FEATURE_MODE = "valid"
+
+# Bump a version whenever its pipeline changes output, so cached feature
+# vectors from the old pipeline are not reused.
+FEATURE_VERSIONS = {
+    "padded": "mfcc20-delta-stats-v1",
+    "valid": "mfcc20-delta-stats-valid-v1",
+    "sequence": f"mfcc20-seq{features.SEQ_FRAMES}-v1",
+}
+
+# In-memory model cache: deserialized models are kept per user and only
+# reloaded when the model file or profile JSON changes on disk.
+MODEL_CACHE_BYTES = 256 * 1024 * 1024   # LRU budget across all users
+
+# Model file used for prediction: "compact" also exports the trained trees
+# as flat arrays (compact_forest.py) and predicts from a read-only mmap of
+# them; "joblib" unpickles the sklearn model. The joblib file is always
+# written, since incremental retraining starts from it.
+MODEL_FORMAT = "compact"
 
 
 # ===== Helpers =====
+def ensure_dirs() -> None:
+    """Create the data directories (done on first write, not at import)."""
+    for d in (AUDIO_DIR, INDEX_DIR, MODEL_DIR, FEATURE_DIR):
+        d.mkdir(parents=True, exist_ok=True)
+
+
+def _sounddevice():
+    try:
+        import sounddevice as sd
+    except OSError:  # no PortAudio (headless box): everything but capture works
+        raise RuntimeError("sounddevice/PortAudio is not available; cannot record")
+    return sd
+
+
 def normalize_text(s: str) -> str:
     s = (s or "").lower().strip()
     keep = "abcdefghijklmnopqrstuvwxyz0123456789_"
@@ -62,21 +152,114 @@ def model_path(user: str) -> Path:
     return MODEL_DIR / f"{user}_rf.joblib"
 
 
+def compact_model_path(user: str) -> Path:
+    return MODEL_DIR / f"{user}_rf.npz"
+
+
+def prototype_model_path(user: str) -> Path:
+    return MODEL_DIR / f"{user}_proto.npz"
+
+
+def dtw_model_path(user: str) -> Path:
+    return MODEL_DIR / f"{user}_dtw.npz"
+
+
+def feature_cache_path(user: str, mode: Optional[str] = None) -> Path:
+    # sequence features (DTW engine) get their own file, so switching
+    # engines does not evict the other mode's vectors
+    if (mode or FEATURE_MODE) == "sequence":
+        return FEATURE_DIR / f"{user}.seq.npz"
+    return FEATURE_DIR / f"{user}.npz"
+
+
+def _use_sqlite(user: Optional[str] = None) -> bool:
+    if PROFILE_BACKEND != "sqlite":
+        return False
+    if user is not None and not ss.exists(PROFILE_DB, user) and profile_path(user).exists():
+        # one-time import of an existing JSON profile
+        ss.save(PROFILE_DB, user, ps.load(INDEX_DIR, user))
+    return True
+
+
 def load_profile(user: str) -> dict:
-    p = profile_path(user)
-    if p.exists():
-        prof = json.loads(p.read_text())
+    # always has "examples" (list[{"path","label"}]) and "scripts"
+    # (dict[label -> script_id]); see profile_store.py / sqlite_store.py
+    if _use_sqlite(user):
+        return ss.load(PROFILE_DB, user)
+    return ps.load(INDEX_DIR, user)
+
+
+def save_profile(user: str, prof: dict) -> None:
+    """Replace the whole profile (atomic rewrite; prefer the helpers below)."""
+    if _use_sqlite(user):
+        ss.save(PROFILE_DB, user, prof)
     else:
-        prof = {}
+        ps.save(INDEX_DIR, user, prof)
 
-    # ensure keys exist
-    prof.setdefault("examples", [])        # list[{"path","label"}]
-    prof.setdefault("scripts", {})         # dict[label -> script_id]
-    return prof
 
+def _append_events(user: str, events: List[dict]) -> None:
+    if _use_sqlite(user):
+        ss.append(PROFILE_DB, user, events)
+    else:
+        ps.append(INDEX_DIR, user, events)
 
-def save_profile(user: str, prof: dict) -> None:
-    profile_path(user).write_text(json.dumps(prof, indent=2))
+
+def profile_lock(user: str):
+    """Exclusive lock on a user's profile, shared across processes."""
+    return ps.locked(INDEX_DIR, user)
+
+
+def add_examples(user: str, examples: List[dict], scripts: Optional[dict] = None) -> None:
+    """Append examples (and optionally label -> script_id) to the journal."""
+    events = [{"op": "add_examples", "examples": list(examples)}] if examples else []
+    for label, script_id in (scripts or {}).items():
+        events.append({"op": "set_script", "label": label, "script_id": script_id})
+    _append_events(user, events)
+
+
+def remove_label(user: str, label: str) -> None:
+    """Drop every example of a label and its script mapping."""
+    _append_events(user, [{"op": "remove_label", "label": label}])
+
+
+def remove_examples(user: str, paths) -> None:
+    """Drop the examples with these paths (files are left alone)."""
+    _append_events(user, [{"op": "remove_paths", "paths": [str(p) for p in paths]}])
+
+
+def rename_examples(user: str, moved: Dict[str, str]) -> None:
+    """Point examples at new paths (old path -> new path), keeping their order."""
+    _append_events(user, [{"op": "rename_paths", "paths": {str(k): str(v) for k, v in moved.items()}}])
+
+
+def label_counts(user: str) -> dict:
+    """label -> number of examples (an indexed query with the sqlite backend)."""
+    if _use_sqlite(user):
+        return ss.label_counts(PROFILE_DB, user)
+    return ps.label_counts(INDEX_DIR, user)
+
+
+def label_paths(user: str, label: str) -> List[str]:
+    """Example paths of one label (an indexed query with the sqlite backend)."""
+    if _use_sqlite(user):
+        return ss.label_paths(PROFILE_DB, user, label)
+    return [ex["path"] for ex in load_profile(user)["examples"] if ex["label"] == label]
+
+
+def get_params(user: str) -> dict:
+    """Tuned model / decision parameters stored in the profile (empty if never tuned)."""
+    return dict(load_profile(user).get("params") or {})
+
+
+def set_params(user: str, params: dict) -> None:
+    _append_events(user, [{"op": "set_key", "key": "params", "value": params}])
+
+
+def list_users() -> List[str]:
+    users = set(ps.users(INDEX_DIR))
+    if _use_sqlite():
+        users.update(ss.users(PROFILE_DB))
+    return sorted(users)
 
 
 def rms(y: np.ndarray) -> float:
@@ -85,6 +268,7 @@ def rms(y: np.ndarray) -> float:
 
 
 def record_block(seconds: float) -> np.ndarray:
+    sd = _sounddevice()
     sd.default.samplerate = SAMPLE_RATE
     sd.default.channels = CHANNELS
     data = sd.rec(int(seconds * SAMPLE_RATE), dtype="float32")
@@ -92,6 +276,20 @@ def record_block(seconds: float) -> np.ndarray:
     return data.squeeze()
 
 
+def capture_utterance(stream_factory=None, extractor=None) -> Optional[np.ndarray]:
+    """
+    Record one spoken command. With STREAMING_CAPTURE the stream is
+    endpointed (returns right after the speaker stops, None if nobody
+    spoke); otherwise a fixed REC_LEN_SEC block is recorded.
+    stream_factory replaces sd.InputStream (e.g. streaming.wav_stream_factory).
+    extractor (features.StreamingFeatures) is fed during endpointed capture.
+    """
+    if not STREAMING_CAPTURE and stream_factory is None:
+        return record_block(REC_LEN_SEC)
+    listener = streaming.StreamingListener(SAMPLE_RATE, REC_LEN_SEC, stream_factory)
+    return listener.capture(LISTEN_TIMEOUT_SEC, extractor)
+
+
 def read_wav(path: Path) -> np.ndarray:
     y, sr = sf.read(str(path), dtype="float32", always_2d=False)
     if y.ndim > 1:
@@ -101,7 +299,27 @@ def read_wav(path: Path) -> np.ndarray:
     return y.astype(np.float32)
 
 
-def preprocess_audio(y: np.ndarray) -> np.ndarray:
+def feature_version(mode: Optional[str] = None) -> str:
+    return FEATURE_VERSIONS[mode or FEATURE_MODE]
+
+
+def feature_mode_of(version: Optional[str]) -> str:
+    """Pipeline a model was trained with; models without a version predate "valid"."""
+    for mode, v in FEATURE_VERSIONS.items():
+        if v == version:
+            return mode
+    if version is None:
+        return "padded"
+    raise ValueError(f"unknown feature version {version!r}")
+
+
+def feature_dim(mode: Optional[str] = None) -> int:
+    if (mode or FEATURE_MODE) == "sequence":
+        return features.SEQ_FRAMES * features.N_MFCC
+    return 4 * features.N_MFCC
+
+
+def preprocess_audio(y: np.ndarray, pad: bool = True) -> np.ndarray:
     if y.size == 0:
         return y
 
@@ -117,7 +335,7 @@ def preprocess_audio(y: np.ndarray) -> np.ndarray:
 
     # duration control
     target_len = int(REC_LEN_SEC * SAMPLE_RATE)
-    if len(y) < target_len:
+    if pad and len(y) < target_len:
         y = np.pad(y, (0, target_len - len(y)))
     if len(y) > target_len:
         y = y[:target_len]
@@ -125,17 +343,29 @@ def preprocess_audio(y: np.ndarray) -> np.ndarray:
     return y.astype(np.float32)
 
 
-def extract_features_from_audio(y: np.ndarray) -> np.ndarray:
+def extract_features_from_audio(y: np.ndarray, mode: Optional[str] = None) -> np.ndarray:
     """
     Extract MFCC + delta statistics → fixed-length feature vector.
+    `mode` is the feature pipeline ("padded" / "valid" / "sequence", default
+    FEATURE_MODE); "sequence" gives the flattened MFCC frame sequence.
     """
-    y = preprocess_audio(y)
+    mode = mode or FEATURE_MODE
+    with metrics.timer("preprocess"):
+        y = preprocess_audio(y, pad=mode == "padded")
     if y.size == 0:
-        return np.zeros(80, dtype=np.float32)
+        return np.zeros(feature_dim(mode), dtype=np.float32)
+    if mode == "valid":
+        with metrics.timer("mfcc"):
+            return features.extract_features_valid([y], SAMPLE_RATE)[0]
+    if mode == "sequence":
+        with metrics.timer("mfcc"):
+            return features.extract_sequences([y], SAMPLE_RATE).reshape(-1)
 
     n_mfcc = 20
-    mfcc = librosa.feature.mfcc(y=y, sr=SAMPLE_RATE, n_mfcc=n_mfcc)
-    delta = librosa.feature.delta(mfcc)
+    with metrics.timer("mfcc"):
+        mfcc = librosa.feature.mfcc(y=y, sr=SAMPLE_RATE, n_mfcc=n_mfcc)
+    with metrics.timer("delta"):
+        delta = librosa.feature.delta(mfcc)
 
     feats = np.concatenate(
         [
@@ -148,57 +378,281 @@ def extract_features_from_audio(y: np.ndarray) -> np.ndarray:
     return feats.astype(np.float32)
 
 
-def extract_features_from_path(path: Path) -> np.ndarray:
+def extract_features_from_path(path: Path, mode: Optional[str] = None) -> np.ndarray:
     y = read_wav(path)
-    return extract_features_from_audio(y)
+    return extract_features_from_audio(y, mode)
+
 
+def extract_features_batch(clips: List[np.ndarray], mode: Optional[str] = None) -> np.ndarray:
+    """
+    Batched extract_features_from_audio(): every clip is preprocessed (and,
+    in "padded" mode, padded to REC_LEN_SEC), then all of them are
+    featurized together with NumPy matrix ops (see features.py). Returns an
+    (N, feature_dim(mode)) matrix.
+    """
+    mode = mode or FEATURE_MODE
+    ys = [preprocess_audio(y, pad=mode == "padded") for y in clips]
+    if mode == "valid":
+        return features.extract_features_valid(ys, SAMPLE_RATE)
+    if mode == "sequence":
+        return features.extract_sequences(ys, SAMPLE_RATE).reshape(len(ys), -1)
+    out = np.zeros((len(ys), 80), dtype=np.float32)
+    ok = [i for i, y in enumerate(ys) if y.size]
+    if ok:
+        out[ok] = features.extract_features_batch(np.stack([ys[i] for i in ok]), SAMPLE_RATE)
+    return out
+
+
+def _featurize_chunk(paths: List[str], mode: Optional[str] = None):
+    """
+    Worker task: read + batch-featurize a few files; None for unreadable
+    ones. Also returns (read_sec, featurize_sec), since metrics recorded in
+    a worker process would be lost.
+    """
+    out: List[Optional[np.ndarray]] = [None] * len(paths)
+    clips, ok = [], []
+    t0 = time.perf_counter()
+    for i, p in enumerate(paths):
+        try:
+            clips.append(read_wav(Path(p)))
+            ok.append(i)
+        except Exception as e:
+            print(Y + f"  Skipping unreadable file {p}: {e}" + R)
+    t1 = time.perf_counter()
+    if clips:
+        for i, feats in zip(ok, extract_features_batch(clips, mode)):
+            out[i] = feats
+    return out, (t1 - t0, time.perf_counter() - t1)
+
+
+def extract_features_parallel(
+    paths: List[Path],
+    workers: Optional[int] = None,
+    executor: Optional[str] = None,
+    chunksize: Optional[int] = None,
+    mode: Optional[str] = None,
+) -> List[Optional[np.ndarray]]:
+    """
+    Featurize many WAVs on a worker pool. Results come back in the same
+    order as `paths`; missing or corrupt files give None instead of
+    aborting the whole run.
+    """
+    workers = workers if workers is not None else FEATURE_WORKERS
+    workers = workers or os.cpu_count() or 1
+    executor = executor or FEATURE_EXECUTOR
+    chunksize = max(1, chunksize or FEATURE_CHUNKSIZE)
+
+    names = [str(p) for p in paths]
+    chunks = [names[i:i + chunksize] for i in range(0, len(names), chunksize)]
+    modes = [mode or FEATURE_MODE] * len(chunks)
+    if workers <= 1 or len(chunks) <= 1:
+        results = list(map(_featurize_chunk, chunks, modes))
+    else:
+        pool_cls = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        try:
+            with pool_cls(max_workers=min(workers, len(chunks))) as pool:
+                results = list(pool.map(_featurize_chunk, chunks, modes))
+        except BrokenProcessPool:
+            print(Y + "  Worker pool crashed; extracting serially." + R)
+            results = list(map(_featurize_chunk, chunks, modes))
 
+    for _, (read_sec, feat_sec) in results:
+        metrics.observe("train_read", read_sec)
+        metrics.observe("train_featurize", feat_sec)
+    return [feats for chunk, _ in results for feats in chunk]
 
 
-# ===== Model training & prediction =====
-def train_model(user: str) -> None:
+# ===== Feature cache =====
+def load_feature_cache(user: str, mode: Optional[str] = None) -> fc.FeatureCache:
     user = normalize_text(user)
-    prof = load_profile(user)
-    examples = prof.get("examples", [])
+    # saves merge under the profile lock, so concurrent writers keep each other's entries
+    return fc.FeatureCache(feature_cache_path(user, mode), feature_version(mode),
+                           lock=lambda: profile_lock(user))
 
-    if len(examples) < 2:
-        print(Y + "Not enough examples to train a model (need ≥ 2)." + R)
-        return
 
-    X_list: List[np.ndarray] = []
-    y_list: List[str] = []
+def evict_features(user: str, paths) -> int:
+    """Drop cached features (of every mode) for audio that was removed from disk."""
+    paths = list(paths)
+    n = 0
+    for mode in {FEATURE_MODE, "sequence"}:
+        cache = load_feature_cache(user, mode)
+        n = max(n, cache.evict(paths))
+        cache.save()
+    return n
 
-    print(C + f"Training RandomForest for user '{user}' on {len(examples)} samples…" + R)
 
+def featurize_cached(cache: fc.FeatureCache, paths: List[Path]) -> List[Optional[np.ndarray]]:
+    """
+    Features for `paths` (in order): cache hits are reused, misses are
+    extracted in parallel and stored. Unreadable files give None.
+    """
+    out = [cache.get(p) for p in paths]
+    missing = [i for i, f in enumerate(out) if f is None]
+    if missing:
+        fresh = extract_features_parallel([paths[i] for i in missing],
+                                          mode=feature_mode_of(cache.version))
+        for i, feats in zip(missing, fresh):
+            if feats is not None:
+                out[i] = feats
+                cache.put(paths[i], feats)
+    return out
+
+
+
+# ===== Model training & prediction =====
+def training_matrix(user: str, examples: List[dict], mode: Optional[str] = None):
+    """
+    Feature matrix for a user's examples in `mode` (default FEATURE_MODE),
+    from that mode's feature cache (misses are extracted and cached). Returns (X, labels, label_paths) with
+    label_paths[label] = the paths of that label's rows; files that are
+    missing (and not restored features-only, see snapshot.py) or
+    unreadable are left out.
+    """
+    cache = load_feature_cache(user, mode)
+    paths: List[Path] = []
+    path_labels: List[str] = []
     for ex in examples:
         p = Path(ex["path"])
-        lbl = ex["label"]
-        if not p.exists():
+        if not p.exists() and not cache.detached(p):
+            continue
+        paths.append(p)
+        path_labels.append(ex["label"])
+
+    with metrics.timer("train_features"):
+        all_feats = featurize_cached(cache, paths)
+
+    X_list: List[np.ndarray] = []
+    y_list: List[str] = []
+    label_paths: Dict[str, List[str]] = {}
+    for feats, p, lbl in zip(all_feats, paths, path_labels):
+        if feats is None:
             continue
-        feats = extract_features_from_path(p)
         X_list.append(feats)
         y_list.append(lbl)
+        label_paths.setdefault(lbl, []).append(str(p))
 
-    if len(X_list) < 2:
-        print(Y + "Not enough valid audio files to train." + R)
-        return
+    # forget files that are no longer part of the profile
+    cache.retain(ex["path"] for ex in examples)
+    cache.save()
+    print(f"  features: {cache.hits} cached, {cache.misses} extracted")
 
-    X = np.vstack(X_list)
-    labels = np.array(y_list)
+    X = np.vstack(X_list) if X_list else np.zeros((0, feature_dim(mode)), dtype=np.float32)
+    return X, np.array(y_list), label_paths
 
-    le = LabelEncoder()
-    y_enc = le.fit_transform(labels)
 
-    clf = RandomForestClassifier(
-        n_estimators=N_TREES,
-        max_depth=MAX_DEPTH,
+def model_params(user: str, mode: Optional[str] = None, params: Optional[dict] = None) -> dict:
+    """
+    Forest size/depth for training: the tuned values stored in the profile
+    (see tuning.py) when they were tuned for this training mode, else the
+    module defaults.
+    """
+    mode = mode or TRAIN_MODE
+    params = params if params is not None else get_params(user)
+    default_trees = N_TREES if mode == "full" else incremental.SUB_TREES
+    if params.get("train_mode") != mode:
+        return {"n_trees": default_trees, "max_depth": MAX_DEPTH}
+    return {"n_trees": params.get("n_trees", default_trees), "max_depth": params.get("max_depth", MAX_DEPTH)}
+
+
+def engine_name(params: Optional[dict] = None) -> str:
+    """The matcher engine for a user: params["engine"] if set, else ENGINE."""
+    return (params or {}).get("engine") or ENGINE
+
+
+def make_forest(n_trees: int, max_depth, n_jobs=FIT_N_JOBS, random_state: int = RANDOM_STATE):
+    return sk_ensemble.RandomForestClassifier(
+        n_estimators=n_trees,
+        max_depth=max_depth,
         class_weight="balanced",
-        random_state=RANDOM_STATE,
+        random_state=random_state,
+        n_jobs=n_jobs,
     )
-    clf.fit(X, y_enc)
 
-    joblib.dump({"model": clf, "label_encoder": le}, model_path(user))
+
+def train_model(user: str, mode: Optional[str] = None) -> bool:
+    """
+    Retrain the user's model from the profile examples. Returns True if a
+    new model was written (atomically replacing the old one). `mode`
+    overrides TRAIN_MODE ("full" or "incremental"). Returns False if there
+    is not enough usable data left; the old model is then deleted, so it
+    cannot keep serving labels that were removed.
+    """
+    user = normalize_text(user)
+    mode = mode or TRAIN_MODE
+    prof = load_profile(user)
+    examples = prof.get("examples", [])
+
+    if len(examples) < 2:
+        print(Y + "Not enough examples to train a model (need ≥ 2)." + R)
+        delete_models(user)
+        return False
+
+    engine = engines.get(engine_name(prof.get("params")))
+    print(C + f"Training {engine.name} model for user '{user}' on {len(examples)} samples…" + R)
+    t_start = time.perf_counter()
+
+    X, labels, label_paths = training_matrix(user, examples, engine.feature_mode)
+    if len(X) < 2:
+        print(Y + "Not enough valid audio files to train." + R)
+        delete_models(user)
+        return False
+
+    hp = model_params(user, mode, prof.get("params", {}))
+    with metrics.timer("train_fit"):
+        bundle = engine.train(user, X, labels, label_paths, hp, mode)
+    if bundle is None:
+        print(G + "Model already up to date." + R)
+        return True
+
+    ensure_dirs()
+    with metrics.timer("train_dump"):
+        engine.save(user, bundle)
+        # drop other engines' models so get_model() never serves a stale one
+        for other in engines.ENGINES.values():
+            if other is not engine:
+                for f in other.model_files(user):
+                    if f.exists():
+                        f.unlink()
+    metrics.observe("train_total", time.perf_counter() - t_start, user=user, n=len(X), mode=mode)
     print(G + "Model trained and saved." + R)
+    return True
+
+
+def _fit_incremental(user: str, X: np.ndarray, labels: np.ndarray, label_paths: Dict[str, List[str]],
+                     hp: dict):
+    """
+    Update the user's one-vs-rest model to the current examples, refitting
+    only the labels that changed; falls back to a full fit when there is no
+    previous incremental model, it has drifted too far or its size/depth
+    no longer match `hp`. Returns None when the saved model already
+    matches the examples.
+    """
+    prev = load_model(user)
+    model = prev.get("model") if prev else None
+    if isinstance(model, incremental.OneVsRestForest):
+        plan = model.plan(label_paths)
+        if prev.get("feature_version") != feature_version():
+            print(f"  full refit: feature pipeline changed to {feature_version()}")
+        elif (model.sub_trees, model.max_depth) != (hp["n_trees"], hp["max_depth"]):
+            print(f"  full refit: forest size/depth changed to {hp['n_trees']}/{hp['max_depth']}")
+        elif model.n_updates >= MAX_INCREMENTAL_UPDATES:
+            print(f"  full refit: {model.n_updates} incremental updates since the last one")
+        elif model.drift + plan["fraction"] > MAX_DRIFT:
+            print(f"  full refit: {model.drift + plan['fraction']:.0%} of examples changed")
+        elif not plan["changed"] and not plan["removed"]:
+            return None
+        else:
+            model.set_params(n_jobs=FIT_N_JOBS)
+            model.update(X, labels, label_paths, plan)
+            print(
+                f"  incremental: refit {plan['changed'] or 'none'}, dropped {plan['removed'] or 'none'}"
+                f" (update {model.n_updates}/{MAX_INCREMENTAL_UPDATES})"
+            )
+            return model
+
+    model = incremental.OneVsRestForest(sub_trees=hp["n_trees"], max_depth=hp["max_depth"],
+                                        random_state=RANDOM_STATE, n_jobs=FIT_N_JOBS)
+    return model.fit(X, labels, label_paths)
 
 
 def load_model(user: str):
@@ -209,22 +663,87 @@ def load_model(user: str):
     return joblib.load(path)
 
 
-def rf_predict_proba(user: str, y_audio: np.ndarray):
-    bundle = load_model(user)
+def export_compact(user: str, bundle: Optional[dict] = None) -> Optional[Path]:
+    """Write the flat-array copy of the user's model (from `bundle` or the joblib file)."""
+    user = normalize_text(user)
+    bundle = bundle or load_model(user)
+    if bundle is None:
+        return None
+    path = compact_model_path(user)
+    with metrics.timer("export_compact"):
+        cf.save(path, cf.flatten(bundle["model"], bundle["label_encoder"].classes_,
+                                 bundle.get("feature_version")))
+    return path
+
+
+_models = mr.ModelRegistry(MODEL_CACHE_BYTES)
+
+
+def _predict_model_path(user: str) -> Path:
+    """
+    The file get_model() loads: whichever engine's model exists (train_model
+    keeps only one), the RF compact export when enabled and present.
+    """
+    for engine in engines.ENGINES.values():
+        path = engine.prediction_file(user)
+        if path is not None:
+            return path
+    return model_path(user)
+
+
+def _load_cached_bundle(user: str):
+    path = _predict_model_path(user)
+    if not path.exists():
+        return None
+    engine = next(e for e in engines.ENGINES.values() if path in e.model_files(user))
+    bundle = dict(engine.load(path))
+    bundle["feature_mode"] = feature_mode_of(bundle.get("feature_version"))
+    prof = load_profile(user)
+    bundle["scripts"] = dict(prof["scripts"])
+    bundle["params"] = dict(prof.get("params") or {})
+    return bundle
+
+
+def get_model(user: str):
+    """
+    Cached model for prediction: returns {"model", "classes", "scripts", "params",
+    "feature_mode"} for the user, or None if no model is trained. Reloads only when the
+    model file or the profile (snapshot or journal) changed on disk.
+    """
+    user = normalize_text(user)
+    watch = [_predict_model_path(user)]
+    if _use_sqlite(user):
+        return _models.get(user, watch, _load_cached_bundle, token=ss.revision(PROFILE_DB, user))
+    for p in (profile_path(user), ps.journal_path(INDEX_DIR, user)):
+        if p.exists():
+            watch.append(p)
+    return _models.get(user, watch, _load_cached_bundle)
+
+
+def rf_predict_proba(user: str, y_audio: np.ndarray, feats: Optional[np.ndarray] = None):
+    bundle = get_model(user)
     if bundle is None:
         return None, None, None
-    clf: RandomForestClassifier = bundle["model"]
-    le: LabelEncoder = bundle["label_encoder"]
+    clf = bundle["model"]              # CompactForest / RandomForestClassifier
 
-    feats = extract_features_from_audio(y_audio).reshape(1, -1)
-    proba = clf.predict_proba(feats)[0]  # shape (n_classes,)
-    classes = le.inverse_transform(np.arange(len(proba)))
-    return classes, proba, bundle
+    if feats is None:
+        feats = extract_features_from_audio(y_audio, bundle["feature_mode"])
+    feats = feats.reshape(1, -1)
+    with metrics.timer("predict_proba"):
+        proba = clf.predict_proba(feats)[0]  # shape (n_classes,)
+    return bundle["classes"], proba, bundle
 
 
-def decide_from_proba(classes: np.ndarray, proba: np.ndarray) -> str:
+def decision_thresholds(params: Optional[dict] = None):
+    """(min_proba, margin): tuned values from `params` if present, else the module defaults."""
+    params = params or {}
+    return params.get("min_proba", MIN_PROBA), params.get("margin_proba", MARGIN_PROBA)
+
+
+def decide_from_proba(classes: np.ndarray, proba: np.ndarray, params: Optional[dict] = None) -> str:
     if classes is None or proba is None or len(proba) == 0:
         return "UNKNOWN"
+    min_proba, margin = decision_thresholds(params)
     idx_sorted = np.argsort(proba)[::-1]
     top1 = idx_sorted[0]
     label1 = classes[top1]
@@ -234,11 +753,30 @@ def decide_from_proba(classes: np.ndarray, proba: np.ndarray) -> str:
     else:
         p2 = 0.0
 
-    if p1 >= MIN_PROBA and (p1 - p2) >= MARGIN_PROBA:
+    if p1 >= min_proba and (p1 - p2) >= margin:
         return str(label1)
     return "UNKNOWN"
 
 
+def decide_batch(classes: np.ndarray, P: np.ndarray, params: Optional[dict] = None) -> np.ndarray:
+    """
+    decide_from_proba() for every row of P (n, n_classes) at once. Returns
+    an object array of labels / "UNKNOWN".
+    """
+    P = np.asarray(P, dtype=np.float64)
+    out = np.full(len(P), "UNKNOWN", dtype=object)
+    if classes is None or P.ndim != 2 or P.shape[1] == 0:
+        return out
+    min_proba, margin = decision_thresholds(params)
+    top = P.argmax(axis=1)
+    p1 = P[np.arange(len(P)), top]
+    p2 = np.partition(P, -2, axis=1)[:, -2] if P.shape[1] > 1 else np.zeros(len(P))
+    ok = (p1 >= min_proba) & ((p1 - p2) >= margin)
+    names = np.array([str(c) for c in classes], dtype=object)
+    out[ok] = names[top[ok]]
+    return out
+
+
 # ===== Enrollment logic (with script_id) =====
 def enroll_from_mic(user: str, label: str, script_id: str) -> None:
     """
@@ -248,13 +786,7 @@ def enroll_from_mic(user: str, label: str, script_id: str) -> None:
     user = normalize_text(user)
     label = normalize_text(label)
     script_id = script_id.strip()
-
-    prof = load_profile(user)
-    examples = prof["examples"]
-    scripts = prof["scripts"]
-
-    # store/overwrite script_id for this label
-    scripts[label] = script_id
+    examples = []
 
     stash_dir = AUDIO_DIR / user / label
     stash_dir.mkdir(parents=True, exist_ok=True)
@@ -266,21 +798,27 @@ def enroll_from_mic(user: str, label: str, script_id: str) -> None:
         + R
     )
 
-    for i in range(ENROLL_SAMPLES):
+    i = 0
+    while i < ENROLL_SAMPLES:
         input(f"Sample {i+1}/{ENROLL_SAMPLES} – press ENTER, then speak...")
-        y = record_block(REC_LEN_SEC)
+        y = capture_utterance()
+        if y is None:
+            print(Y + "   No speech detected; try again." + R)
+            continue
+        i += 1
         val = rms(y)
         print(f"   rms={val:.5f}")
         if val < RMS_GATE:
             print(Y + "   Too quiet; sample kept anyway for now." + R)
 
-        fname = stash_dir / f"{len(list(stash_dir.glob('*.wav'))) + 1:03d}.wav"
-        sf.write(str(fname), y, SAMPLE_RATE)
+        import ingest  # imports this module; load on demand
+        with profile_lock(user):     # allocate_indices needs it; uploads may run meanwhile
+            fname = stash_dir / f"{ingest.allocate_indices(stash_dir)[0]:03d}.wav"
+            sf.write(str(fname), y, SAMPLE_RATE)
         examples.append({"path": str(fname), "label": label})
 
-    prof["examples"] = examples
-    prof["scripts"] = scripts
-    save_profile(user, prof)
+    # store/overwrite script_id for this label
+    add_examples(user, examples, scripts={label: script_id})
     train_model(user)
 
 
@@ -292,13 +830,7 @@ def enroll_from_dir(user: str, label: str, script_id: str, dir_path: Path) -> No
     user = normalize_text(user)
     label = normalize_text(label)
     script_id = script_id.strip()
-
-    prof = load_profile(user)
-    examples = prof["examples"]
-    scripts = prof["scripts"]
-
-    # store/overwrite script_id for this label
-    scripts[label] = script_id
+    examples = []
 
     wavs = sorted(p for p in dir_path.glob("*.wav") if p.is_file())
     if not wavs:
@@ -307,13 +839,21 @@ def enroll_from_dir(user: str, label: str, script_id: str, dir_path: Path) -> No
 
     print(C + f"Adding {len(wavs)} files for label '{label}'…" + R)
 
-    for w in wavs:
+    # featurize up front (in parallel) so corrupt files are caught here
+    # and train_model only hits the cache
+    cache = load_feature_cache(user)
+    feats = featurize_cached(cache, wavs)
+    cache.save()
+
+    for w, f in zip(wavs, feats):
+        if f is None:
+            print(Y + f"  Skipped: {w.name}" + R)
+            continue
         examples.append({"path": str(w), "label": label})
         print(f"  Added: {w.name}")
 
-    prof["examples"] = examples
-    prof["scripts"] = scripts
-    save_profile(user, prof)
+    # store/overwrite script_id for this label
+    add_examples(user, examples, scripts={label: script_id})
     train_model(user)
 
 
@@ -331,12 +871,12 @@ def predict_from_file(user: str, wav_path: Path) -> None:
     val = rms(y)
     print(f"rms={val:.5f}")
 
-    classes, proba, _ = rf_predict_proba(user, y)
+    classes, proba, bundle = rf_predict_proba(user, y)
     if classes is None:
         print(Y + "No model trained yet for this user. Enroll some commands first." + R)
         return
 
-    decision = decide_from_proba(classes, proba)
+    decision = decide_from_proba(classes, proba, bundle["params"])
     print(B + "Probabilities:" + R)
     for c, p in sorted(zip(classes, proba), key=lambda x: x[1], reverse=True):
         sid = scripts.get(c, "")
@@ -353,44 +893,55 @@ def predict_from_file(user: str, wav_path: Path) -> None:
         print(Y + "DECISION: UNKNOWN" + R)
 
 
-def listen_once(user: str) -> None:
+def listen_once(user: str, stream_factory=None) -> None:
     """
-    Auto-listen mode: immediately records one window, classifies once,
+    Auto-listen mode: immediately records one utterance, classifies once,
     then returns to the main menu. Also shows script_id.
     """
     user = normalize_text(user)
-    bundle = load_model(user)
+    bundle = get_model(user)
     if bundle is None:
         print(Y + "No model trained yet for this user. Enroll some commands first." + R)
         return
 
-    prof = load_profile(user)
-    scripts = prof["scripts"]
+    scripts = bundle["scripts"]
 
     print(C + "\nAuto-listen mode\n" + R)
-    print(f"Recording now (~{REC_LEN_SEC:.1f} seconds)...\n")
+    print(f"Recording now (up to {REC_LEN_SEC:.1f} seconds)...\n")
 
-    sd.default.samplerate = SAMPLE_RATE
-    sd.default.channels = CHANNELS
+    extractor = None
+    if STREAMING_FEATURES and bundle["feature_mode"] != "sequence":
+        extractor = features.StreamingFeatures(SAMPLE_RATE, int(REC_LEN_SEC * SAMPLE_RATE),
+                                               pad=bundle["feature_mode"] == "padded")
 
     # **Start recording immediately**
-    block = sd.rec(int(REC_LEN_SEC * SAMPLE_RATE), dtype="float32")
-    sd.wait()
-    y = block.squeeze()
+    with metrics.timer("capture"):
+        y = capture_utterance(stream_factory, extractor)
+    if y is None:
+        print(Y + "No speech detected; no command recognized." + R)
+        return
+    t_captured = time.perf_counter()
 
-    val = rms(y)
+    with metrics.timer("rms_gate"):
+        val = rms(y)
     print(f"rms={val:.5f}")
 
     if val < RMS_GATE:
         print(Y + "Too quiet; no command recognized." + R)
         return
 
-    classes, proba, _ = rf_predict_proba(user, y)
+    feats = None
+    if extractor is not None and extractor.n >= len(y):
+        # the frames were transformed during capture; only the edges are left
+        with metrics.timer("stream_features"):
+            feats = extractor.summary(len(y))
+    classes, proba, _ = rf_predict_proba(user, y, feats)
     if classes is None:
         print(Y + "Model disappeared; try re-training." + R)
         return
 
-    decision = decide_from_proba(classes, proba)
+    with metrics.timer("decision"):
+        decision = decide_from_proba(classes, proba, bundle["params"])
 
     print(B + "Probabilities:" + R)
     for c, p in sorted(zip(classes, proba), key=lambda x: x[1], reverse=True):
@@ -398,11 +949,16 @@ def listen_once(user: str) -> None:
         label_display = f"{c} (script_id={sid})" if sid else c
         print(f"  {label_display:25s} {p:.3f}")
 
+    # time from end of speech to the decision being acted on
+    metrics.observe("post_capture", time.perf_counter() - t_captured, user=user, decision=decision)
+
     if decision != "UNKNOWN":
         script_id = scripts.get(decision, "")
         if script_id:
             print(G + f"\n[DETECTED] {decision} (script_id={script_id})" + R)
-            ha.TriggerScript(script_id)
+            # queued to a background sender; don't block on the HTTP call
+            with metrics.timer("ha_dispatch"):
+                ha.dispatch_script(script_id)
         else:
             print(G + f"\n[DETECTED] {decision}" + R)
     else:
@@ -412,32 +968,39 @@ def listen_once(user: str) -> None:
 
 def list_labels(user: str) -> None:
     user = normalize_text(user)
-    prof = load_profile(user)
-    examples = prof["examples"]
-    scripts = prof["scripts"]
+    counts = label_counts(user)
+    scripts = load_profile(user)["scripts"] if counts else {}
 
-    labels = sorted(set(ex["label"] for ex in examples))
-    if not labels:
+    if not counts:
         print(Y + "No commands enrolled yet." + R)
         return
 
     print(B + "Commands for this user:" + R)
-    for lbl in labels:
-        n = sum(1 for ex in examples if ex["label"] == lbl)
+    for lbl, n in counts.items():
         sid = scripts.get(lbl, "")
         extra = f" (script_id={sid})" if sid else ""
         print(f"  - {lbl}  ({n} samples){extra}")
 
 
+def delete_models(user: str) -> None:
+    """Remove every engine's model files for user and drop the loaded model."""
+    for engine in engines.ENGINES.values():
+        for m in engine.model_files(user):
+            if m.exists():
+                m.unlink()
+    _models.invalidate(user)
+
+
 def reset_user(user: str) -> None:
     user = normalize_text(user)
-    p = profile_path(user)
-    if p.exists():
-        p.unlink()
+    ps.delete(INDEX_DIR, user)
+    if _use_sqlite():
+        ss.delete(PROFILE_DB, user)
 
-    m = model_path(user)
-    if m.exists():
-        m.unlink()
+    delete_models(user)
+    for fcache in {feature_cache_path(user), feature_cache_path(user, "sequence")}:
+        if fcache.exists():
+            fcache.unlink()
 
     d = AUDIO_DIR / user
     if d.exists():
@@ -454,6 +1017,84 @@ def reset_user(user: str) -> None:
     print(G + f"Reset profile for '{user}'." + R)
 
 
+# ===== Snapshots =====
+def export_user(user: str, dest: Path, include_audio: bool = True) -> Optional[dict]:
+    """Write a user's snapshot archive to dest (see snapshot.py)."""
+    import snapshot  # imports this module; load on demand
+    try:
+        result = snapshot.export_to(normalize_text(user), dest, include_audio)
+    except (OSError, snapshot.SnapshotError) as e:
+        print(Y + f"Export failed: {e}" + R)
+        return None
+    print(G + f"Exported '{normalize_text(user)}' to {result['path']} "
+          f"({result['bytes'] / 1e6:.1f} MB, {result['seconds']:.1f}s)." + R)
+    return result
+
+
+def import_user(src: Path, user: Optional[str] = None, overwrite: bool = False) -> Optional[dict]:
+    """Restore a snapshot archive, as `user` if given (see snapshot.py)."""
+    import snapshot  # imports this module; load on demand
+    try:
+        result = snapshot.import_from(src, user, overwrite)
+    except (OSError, snapshot.SnapshotError) as e:
+        print(Y + f"Import failed: {e}" + R)
+        return None
+    print(G + f"Imported '{result['user']}': {result['examples']} examples, "
+          f"{len(result['models'])} model file(s) ({result['seconds']:.1f}s)." + R)
+    return result
+
+
+# ===== Warm start =====
+def warm_up(users: Optional[List[str]] = None, verbose: bool = True) -> dict:
+    """
+    Pay start-up costs before the first button press: import the deferred
+    libraries, run a dummy clip through both feature paths (compiles
+    librosa's numba kernels, builds the mel/DCT tables) and load every
+    user's model (or `users`, in that order) into the registry, as far as
+    MODEL_CACHE_BYTES allows: the last ones loaded are the ones kept.
+    Returns the timings.
+    """
+    t0 = time.perf_counter()
+    librosa.effects, sk_ensemble.RandomForestClassifier, joblib.load, engines.ENGINES  # force imports
+    t1 = time.perf_counter()
+
+    rng = np.random.default_rng(0)
+    t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    dummy = (0.5 * np.sin(2 * np.pi * 220.0 * t) + 0.01 * rng.standard_normal(t.size)).astype(np.float32)
+    feats = extract_features_from_audio(dummy)
+    extract_features_batch([dummy])
+    t2 = time.perf_counter()
+
+    loaded = []
+    for user in (users if users is not None else list_users()):
+        bundle = get_model(user)
+        if bundle is None:
+            continue
+        bundle["model"].predict_proba(feats.reshape(1, -1))
+        loaded.append(normalize_text(user))
+    # the registry is an LRU capped at MODEL_CACHE_BYTES: report what stayed
+    resident = set(_models.users())
+    loaded = [u for u in loaded if u in resident]
+    t3 = time.perf_counter()
+
+    report = {
+        "imports_sec": t1 - t0,
+        "features_sec": t2 - t1,
+        "models_sec": t3 - t2,
+        "warm_up_sec": t3 - t0,
+        "since_import_sec": t3 - _IMPORTED_AT,
+        "users": loaded,
+    }
+    metrics.observe("warm_up", report["warm_up_sec"])
+    if verbose:
+        print(
+            G + f"Ready in {report['since_import_sec']:.2f}s "
+            f"(imports {report['imports_sec']:.2f}s, features {report['features_sec']:.2f}s, "
+            f"models {report['models_sec']:.2f}s; {len(loaded)} user(s) preloaded)" + R
+        )
+    return report
+
+
 # ===== Menu =====
 def main() -> None:
     print(B + "\nSound Matcher Demo (librosa + RandomForest)" + R)
@@ -467,9 +1108,12 @@ def main() -> None:
         print("  2) Create a command from folder of WAVs")
         print("  3) Predict from one WAV file")
         print("  4) Listen once (press ENTER to talk)")
-        print("  5) List commands")
-        print("  6) Reset this user")
-        print("  7) Quit")
+        print("  5) Continuous listening (hands-free, Ctrl+C to stop)")
+        print("  6) List commands")
+        print("  7) Export this user to a snapshot file")
+        print("  8) Import a snapshot file")
+        print("  9) Reset this user")
+        print("  10) Quit")
         choice = input("> ").strip()
 
         if choice == "1":
@@ -487,14 +1131,33 @@ def main() -> None:
         elif choice == "4":
             listen_once(user)
         elif choice == "5":
-            list_labels(user)
+            import continuous  # imports this module; load on demand
+            listener = continuous.ContinuousListener(user)
+            try:
+                listener.run()
+            except KeyboardInterrupt:
+                pass
+            except RuntimeError as e:
+                print(Y + str(e) + R)
+            listener.print_stats()
         elif choice == "6":
-            reset_user(user)
+            list_labels(user)
         elif choice == "7":
+            dest = input(f"Snapshot file [{user}.tar]: ").strip() or f"{user}.tar"
+            audio = input("Include raw audio? [Y/n]: ").strip().lower() not in ("n", "no")
+            export_user(user, Path(dest), include_audio=audio)
+        elif choice == "8":
+            src = input("Snapshot file: ").strip()
+            import_user(Path(src), user, overwrite=input(
+                f"Replace '{user}' if it exists? [y/N]: ").strip().lower() in ("y", "yes"))
+        elif choice == "9":
+            reset_user(user)
+        elif choice == "10":
+            ha.flush()
             print("Bye!")
             break
         else:
-            print(Y + "Enter 1–7." + R)
+            print(Y + "Enter 1–10." + R)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,229 @@
+"""
+sqlite_store.py
+
+Optional SQLite backend for profiles (sound_profiles/profiles.sqlite),
+selected with sound_matcher.PROFILE_BACKEND = "sqlite".
+
+Same event API as profile_store.py (load / save / append / delete), but the
+examples, per-label counts and script mappings live in indexed tables, so
+label listings, counts, deletes and script lookups are queries instead of
+scans over the full example list:
+
+  users    (user PK, rev)                     rev bumps on every change
+  examples (id PK, user, label, path)         index on (user, label)
+  labels   (user, label, n)                   per-label example count
+  scripts  (user, label, script_id)
+  meta     (user, key, value JSON)            any other profile keys
+"""
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+_local = threading.local()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user TEXT PRIMARY KEY,
+    rev  INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS examples (
+    id    INTEGER PRIMARY KEY AUTOINCREMENT,
+    user  TEXT NOT NULL,
+    label TEXT NOT NULL,
+    path  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS examples_user_label ON examples (user, label);
+CREATE INDEX IF NOT EXISTS examples_user_path ON examples (user, path);
+CREATE TABLE IF NOT EXISTS labels (
+    user  TEXT NOT NULL,
+    label TEXT NOT NULL,
+    n     INTEGER NOT NULL,
+    PRIMARY KEY (user, label)
+);
+CREATE TABLE IF NOT EXISTS scripts (
+    user      TEXT NOT NULL,
+    label     TEXT NOT NULL,
+    script_id TEXT NOT NULL,
+    PRIMARY KEY (user, label)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    user  TEXT NOT NULL,
+    key   TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (user, key)
+);
+"""
+
+
+def connect(db_path: Path) -> sqlite3.Connection:
+    """One connection per thread and database file."""
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    key = str(db_path)
+    conn = conns.get(key)
+    if conn is None:
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(key, timeout=30.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        conns[key] = conn
+    return conn
+
+
+class _Tx:
+    """BEGIN IMMEDIATE ... COMMIT / ROLLBACK."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, *_):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _bump(conn: sqlite3.Connection, user: str) -> None:
+    conn.execute(
+        "INSERT INTO users (user, rev) VALUES (?, 1) "
+        "ON CONFLICT(user) DO UPDATE SET rev = rev + 1",
+        (user,),
+    )
+
+
+def _add_count(conn: sqlite3.Connection, user: str, label: str, delta: int) -> None:
+    conn.execute(
+        "INSERT INTO labels (user, label, n) VALUES (?, ?, ?) "
+        "ON CONFLICT(user, label) DO UPDATE SET n = n + excluded.n",
+        (user, label, delta),
+    )
+    conn.execute("DELETE FROM labels WHERE user = ? AND label = ? AND n <= 0", (user, label))
+
+
+def _apply(conn: sqlite3.Connection, user: str, ev: dict) -> None:
+    op = ev.get("op")
+    if op == "add_examples":
+        counts: Dict[str, int] = {}
+        rows = []
+        for ex in ev["examples"]:
+            rows.append((user, ex["label"], ex["path"]))
+            counts[ex["label"]] = counts.get(ex["label"], 0) + 1
+        conn.executemany("INSERT INTO examples (user, label, path) VALUES (?, ?, ?)", rows)
+        for label, n in counts.items():
+            _add_count(conn, user, label, n)
+    elif op == "remove_label":
+        args = (user, ev["label"])
+        conn.execute("DELETE FROM examples WHERE user = ? AND label = ?", args)
+        conn.execute("DELETE FROM labels WHERE user = ? AND label = ?", args)
+        conn.execute("DELETE FROM scripts WHERE user = ? AND label = ?", args)
+    elif op == "remove_paths":
+        for path in ev["paths"]:
+            rows = conn.execute(
+                "SELECT label FROM examples WHERE user = ? AND path = ?", (user, path)
+            ).fetchall()
+            conn.execute("DELETE FROM examples WHERE user = ? AND path = ?", (user, path))
+            for (label,) in rows:
+                _add_count(conn, user, label, -1)
+    elif op == "rename_paths":
+        conn.executemany(
+            "UPDATE examples SET path = ? WHERE user = ? AND path = ?",
+            [(new, user, old) for old, new in ev["paths"].items()],
+        )
+    elif op == "set_script":
+        conn.execute(
+            "INSERT OR REPLACE INTO scripts (user, label, script_id) VALUES (?, ?, ?)",
+            (user, ev["label"], ev["script_id"]),
+        )
+    elif op == "set_key":
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (user, key, value) VALUES (?, ?, ?)",
+            (user, ev["key"], json.dumps(ev["value"])),
+        )
+
+
+# ===== profile_store-compatible API =====
+def load(db_path: Path, user: str) -> dict:
+    conn = connect(db_path)
+    prof = {}
+    for key, value in conn.execute("SELECT key, value FROM meta WHERE user = ?", (user,)):
+        prof[key] = json.loads(value)
+    prof["examples"] = [
+        {"path": path, "label": label}
+        for label, path in conn.execute(
+            "SELECT label, path FROM examples WHERE user = ? ORDER BY id", (user,)
+        )
+    ]
+    prof["scripts"] = dict(
+        conn.execute("SELECT label, script_id FROM scripts WHERE user = ?", (user,))
+    )
+    return prof
+
+
+def save(db_path: Path, user: str, prof: dict) -> None:
+    conn = connect(db_path)
+    with _Tx(conn):
+        for table in ("examples", "labels", "scripts", "meta"):
+            conn.execute(f"DELETE FROM {table} WHERE user = ?", (user,))
+        _apply(conn, user, {"op": "add_examples", "examples": prof.get("examples", [])})
+        for label, script_id in prof.get("scripts", {}).items():
+            _apply(conn, user, {"op": "set_script", "label": label, "script_id": script_id})
+        for key, value in prof.items():
+            if key not in ("examples", "scripts"):
+                _apply(conn, user, {"op": "set_key", "key": key, "value": value})
+        _bump(conn, user)
+
+
+def append(db_path: Path, user: str, events: Iterable[dict]) -> None:
+    events = list(events)
+    if not events:
+        return
+    conn = connect(db_path)
+    with _Tx(conn):
+        for ev in events:
+            _apply(conn, user, ev)
+        _bump(conn, user)
+
+
+def delete(db_path: Path, user: str) -> None:
+    conn = connect(db_path)
+    with _Tx(conn):
+        for table in ("examples", "labels", "scripts", "meta", "users"):
+            conn.execute(f"DELETE FROM {table} WHERE user = ?", (user,))
+
+
+# ===== Indexed queries =====
+def exists(db_path: Path, user: str) -> bool:
+    row = connect(db_path).execute("SELECT 1 FROM users WHERE user = ?", (user,)).fetchone()
+    return row is not None
+
+
+def revision(db_path: Path, user: str) -> int:
+    row = connect(db_path).execute("SELECT rev FROM users WHERE user = ?", (user,)).fetchone()
+    return row[0] if row else 0
+
+
+def users(db_path: Path) -> List[str]:
+    return [u for (u,) in connect(db_path).execute("SELECT user FROM users ORDER BY user")]
+
+
+def label_counts(db_path: Path, user: str) -> Dict[str, int]:
+    return dict(
+        connect(db_path).execute(
+            "SELECT label, n FROM labels WHERE user = ? ORDER BY label", (user,)
+        )
+    )
+
+
+def label_paths(db_path: Path, user: str, label: str) -> List[str]:
+    return [
+        p
+        for (p,) in connect(db_path).execute(
+            "SELECT path FROM examples WHERE user = ? AND label = ? ORDER BY id", (user, label)
+        )
+    ]
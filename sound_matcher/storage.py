@@ -0,0 +1,381 @@
+"""
+storage.py
+
+Retention and compaction of enrollment audio under AUDIO_DIR/<user>/.
+
+    python3 storage.py usage [--user alice]
+    python3 storage.py compact --user alice [--max-per-label 40] [--dry-run]
+    python3 storage.py compact --all
+
+compact_user() runs three passes, each under the user's profile_lock:
+ 1. cap_labels: labels with more than MAX_PER_LABEL examples are cut down.
+    KEEP_POLICY "recent" keeps the newest (profile order is enrollment
+    order); "diverse" keeps the KEEP_RECENT newest, then repeatedly the
+    example farthest from everything kept so far in (standardized, cached)
+    feature space, so near-duplicate re-recordings go first.
+ 2. transcode: stored clips are re-encoded as STORAGE_FORMAT /
+    STORAGE_SUBTYPE through soundfile (FLAC is lossless and about half the
+    size of PCM16 WAV). Encoding happens outside the lock; the profile is
+    pointed at the new files before the old ones are deleted. When the
+    decoded samples are unchanged the cached features are re-keyed, else
+    the new files are featurized again.
+ 3. collect_orphans: audio files (AUDIO_EXTS) under the user's folder
+    that no example references (and older than ORPHAN_MIN_AGE_SEC, so an enrollment in
+    progress is never touched) are deleted. Anything else there (the
+    per-group metadata.json, ingest's file counter) is left alone.
+
+Only files inside AUDIO_DIR/<user>/ are ever deleted or rewritten; examples
+enrolled from an outside folder (enroll_from_dir) can be dropped from the
+profile by the cap but their files are left alone. A retrain runs when the
+cap removed examples. Moving files changes the example paths, so the next
+retrain after a transcode refits the labels involved (from cached features).
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import soundfile as sf
+
+import engines
+import metrics
+import sound_matcher as sm
+
+STORAGE_FORMAT = "FLAC"      # "FLAC" or "WAV"
+STORAGE_SUBTYPE = "PCM_16"   # sample format inside the container
+MAX_PER_LABEL = 40           # examples kept per label (0 = no cap)
+KEEP_POLICY = "diverse"      # "diverse" or "recent"
+KEEP_RECENT = 5              # newest examples the diverse policy always keeps
+ORPHAN_MIN_AGE_SEC = 3600.0  # younger unreferenced files are left alone
+
+_SUFFIX = {"FLAC": ".flac", "WAV": ".wav"}
+AUDIO_EXTS = set(_SUFFIX.values())  # what collect_orphans / usage look at
+
+
+# ===== Helpers =====
+def _user_dir(user: str) -> Path:
+    return sm.AUDIO_DIR / sm.normalize_text(user)
+
+
+def _owned(root: Path, path: Path) -> bool:
+    """True if path lies inside root (the user's audio folder)."""
+    try:
+        Path(path).resolve().relative_to(root.resolve())
+        return True
+    except ValueError:
+        return False
+
+
+def _size(path: Path) -> int:
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+
+def _audio_files(root: Path) -> List[Path]:
+    """Audio files under root; other files there are not ours to collect."""
+    if not root.exists():
+        return []
+    return sorted(f for f in root.rglob("*") if f.is_file() and f.suffix.lower() in AUDIO_EXTS)
+
+
+def _by_label(examples: List[dict]) -> Dict[str, List[dict]]:
+    out: Dict[str, List[dict]] = {}
+    for ex in examples:
+        out.setdefault(ex["label"], []).append(ex)
+    return out
+
+
+# ===== Retention =====
+def select_keep(X: np.ndarray, k: int, recent: int = KEEP_RECENT) -> np.ndarray:
+    """
+    Indices (ascending) of the k rows of X to keep, rows in enrollment
+    order: the `recent` newest, then farthest-point sampling on the
+    standardized features.
+    """
+    n = len(X)
+    if n <= k:
+        return np.arange(n)
+    Z = (X - X.mean(axis=0)) / (X.std(axis=0) + 1e-8)
+    kept = list(range(n - max(1, min(recent, k)), n))
+    dist = np.full(n, np.inf)
+    for i in kept:
+        dist = np.minimum(dist, np.linalg.norm(Z - Z[i], axis=1))
+    dist[kept] = -1.0
+    while len(kept) < k:
+        i = int(np.argmax(dist))
+        kept.append(i)
+        dist = np.minimum(dist, np.linalg.norm(Z - Z[i], axis=1))
+        dist[kept] = -1.0
+    return np.sort(np.array(kept))
+
+
+def cap_labels(user: str, max_per_label: int = MAX_PER_LABEL, policy: str = KEEP_POLICY,
+               dry_run: bool = False) -> dict:
+    """
+    Drop examples beyond max_per_label per label. Returns {"removed":
+    [paths], "deleted_bytes"}.
+    """
+    if policy not in ("diverse", "recent"):
+        raise ValueError(f"unknown keep policy {policy!r}")
+    user = sm.normalize_text(user)
+    root = _user_dir(user)
+    removed: List[str] = []
+    if max_per_label <= 0:
+        return {"removed": removed, "deleted_bytes": 0}
+
+    with sm.profile_lock(user):
+        groups = _by_label(sm.load_profile(user).get("examples", []))
+        cache = sm.load_feature_cache(user)
+        for label, exs in groups.items():
+            if len(exs) <= max_per_label:
+                continue
+            paths = [Path(ex["path"]) for ex in exs]
+            feats = sm.featurize_cached(cache, paths) if policy == "diverse" else []
+            valid = [i for i, f in enumerate(feats) if f is not None]
+            if not valid:
+                keep = set(range(len(exs) - max_per_label, len(exs)))
+            else:
+                X = np.vstack([feats[i] for i in valid])
+                keep = {valid[j] for j in select_keep(X, max_per_label)}
+            removed += [str(p) for i, p in enumerate(paths) if i not in keep]
+
+        deleted = 0
+        if removed and not dry_run:
+            sm.remove_examples(user, removed)
+            cache.evict(removed)
+            for p in removed:
+                if _owned(root, Path(p)) and os.path.exists(p):
+                    deleted += _size(Path(p))
+                    os.unlink(p)
+        if not dry_run:
+            cache.save()
+    return {"removed": removed, "deleted_bytes": deleted}
+
+
+# ===== Transcoding =====
+def _needs_transcode(path: Path, fmt: str, subtype: str) -> bool:
+    try:
+        info = sf.info(str(path))
+    except Exception:
+        return False        # unreadable: leave it for training to skip
+    return (info.format, info.subtype, path.suffix.lower()) != (fmt, subtype, _SUFFIX[fmt])
+
+
+def transcode(user: str, fmt: str = STORAGE_FORMAT, subtype: str = STORAGE_SUBTYPE,
+              dry_run: bool = False) -> dict:
+    """
+    Re-encode the user's stored clips as fmt/subtype. Returns {"files",
+    "bytes_before", "bytes_after", "lossless", "refeaturized"} (bytes_before
+    covers every file that needed it, also ones skipped).
+    """
+    fmt = fmt.upper()
+    if fmt not in _SUFFIX:
+        raise ValueError(f"unsupported storage format {fmt!r}")
+    user = sm.normalize_text(user)
+    root = _user_dir(user)
+    examples = sm.load_profile(user).get("examples", [])
+    todo = [Path(ex["path"]) for ex in examples
+            if _owned(root, Path(ex["path"])) and Path(ex["path"]).exists()]
+    todo = [p for p in todo if _needs_transcode(p, fmt, subtype)]
+    result = {"files": len(todo), "bytes_before": sum(_size(p) for p in todo),
+              "bytes_after": 0, "lossless": 0, "refeaturized": 0}
+    if dry_run or not todo:
+        return result
+
+    # encode next to the originals without the lock
+    staged = []
+    for old in todo:
+        new = old.with_suffix(_SUFFIX[fmt])
+        if new != old and new.exists():
+            continue        # name taken by another file; leave this one as is
+        tmp = new.with_name(new.name + ".tmp")
+        try:
+            with metrics.timer("storage_transcode"):
+                y, sr = sf.read(str(old), dtype="float32")
+                sf.write(str(tmp), y, sr, format=fmt, subtype=subtype)
+                same = np.array_equal(sf.read(str(tmp), dtype="float32")[0], y)
+        except Exception as e:
+            print(sm.Y + f"  Skipped {old}: {e}" + sm.R)
+            if tmp.exists():
+                tmp.unlink()
+            continue
+        staged.append((old, new, tmp, same))
+
+    with sm.profile_lock(user):
+        current = {ex["path"] for ex in sm.load_profile(user).get("examples", [])}
+        cache = sm.load_feature_cache(user)
+        moved: Dict[str, str] = {}
+        stale: List[Path] = []
+        refeaturize: List[Path] = []
+        done = 0
+        for old, new, tmp, same in staged:
+            if str(old) not in current:     # removed meanwhile
+                tmp.unlink()
+                continue
+            os.replace(tmp, new)
+            done += 1
+            result["bytes_after"] += _size(new)
+            if new != old:
+                moved[str(old)] = str(new)
+                stale.append(old)
+            if same and cache.move(old, new):
+                result["lossless"] += 1
+            else:
+                cache.evict([old])
+                refeaturize.append(new)
+        # the profile points at the new files before the old ones go;
+        # a crash in between leaves orphans for collect_orphans
+        if moved:
+            sm.rename_examples(user, moved)
+        for old in stale:
+            old.unlink()
+        if refeaturize:
+            sm.featurize_cached(cache, refeaturize)
+            result["refeaturized"] = len(refeaturize)
+        cache.save()
+    result["files"] = done
+    return result
+
+
+# ===== Garbage collection =====
+def collect_orphans(user: str, min_age_sec: float = ORPHAN_MIN_AGE_SEC, dry_run: bool = False) -> dict:
+    """
+    Delete audio files under the user's folder that no example references.
+    Returns {"removed": [paths], "deleted_bytes"}.
+    """
+    user = sm.normalize_text(user)
+    root = _user_dir(user)
+    removed: List[str] = []
+    deleted = 0
+    if not root.exists():
+        return {"removed": removed, "deleted_bytes": 0}
+
+    with sm.profile_lock(user):
+        referenced = {str(Path(ex["path"]).resolve()) for ex in sm.load_profile(user).get("examples", [])}
+        cutoff = time.time() - min_age_sec
+        for f in _audio_files(root):
+            if str(f.resolve()) in referenced or f.stat().st_mtime > cutoff:
+                continue
+            removed.append(str(f))
+            deleted += _size(f)
+            if not dry_run:
+                f.unlink()
+        if not dry_run:
+            for d in sorted((d for d in root.rglob("*") if d.is_dir()), reverse=True):
+                if not any(d.iterdir()):
+                    d.rmdir()
+    return {"removed": removed, "deleted_bytes": deleted}
+
+
+# ===== Reporting =====
+def usage(user: Optional[str] = None) -> dict:
+    """
+    Disk usage per user: per label examples / files / bytes, unreferenced
+    (orphan) bytes in the audio folder, and model + feature-cache bytes.
+    """
+    users = [sm.normalize_text(user)] if user else sorted(
+        set(sm.list_users()) | ({d.name for d in sm.AUDIO_DIR.iterdir() if d.is_dir()}
+                                if sm.AUDIO_DIR.exists() else set()))
+
+    report = {}
+    for u in users:
+        root = _user_dir(u)
+        labels = {}
+        referenced = set()
+        for label, exs in _by_label(sm.load_profile(u).get("examples", [])).items():
+            sizes = [_size(Path(ex["path"])) for ex in exs]
+            referenced.update(str(Path(ex["path"]).resolve()) for ex in exs)
+            labels[label] = {
+                "examples": len(exs),
+                "files": sum(1 for s in sizes if s),
+                "bytes": sum(sizes),
+                "external": sum(1 for ex in exs if not _owned(root, Path(ex["path"]))),
+            }
+        orphans = [f for f in _audio_files(root) if str(f.resolve()) not in referenced]
+        models = sum(_size(f) for e in engines.ENGINES.values() for f in e.model_files(u))
+        entry = {
+            "labels": labels,
+            "audio_bytes": sum(v["bytes"] for v in labels.values()),
+            "orphan_files": len(orphans),
+            "orphan_bytes": sum(_size(f) for f in orphans),
+            "model_bytes": models,
+            "feature_bytes": sum(_size(p) for p in {sm.feature_cache_path(u),
+                                                     sm.feature_cache_path(u, "sequence")}),
+        }
+        entry["total_bytes"] = (entry["audio_bytes"] + entry["orphan_bytes"]
+                                + entry["model_bytes"] + entry["feature_bytes"])
+        report[u] = entry
+    return report
+
+
+# ===== Compaction =====
+def compact_user(user: str, max_per_label: int = MAX_PER_LABEL, policy: str = KEEP_POLICY,
+                 fmt: str = STORAGE_FORMAT, subtype: str = STORAGE_SUBTYPE, gc: bool = True,
+                 retrain: bool = True, dry_run: bool = False) -> dict:
+    """Cap, transcode and garbage-collect one user's audio; retrains if examples were dropped."""
+    user = sm.normalize_text(user)
+    t0 = time.perf_counter()
+    before = usage(user)[user]["total_bytes"]
+    capped = cap_labels(user, max_per_label, policy, dry_run)
+    coded = transcode(user, fmt, subtype, dry_run)
+    orphans = collect_orphans(user, dry_run=dry_run) if gc else {"removed": [], "deleted_bytes": 0}
+    after = usage(user)[user]["total_bytes"]
+    print(
+        sm.G + f"Storage for '{user}': {len(capped['removed'])} examples over the cap, "
+        f"{coded['files']} files transcoded, {len(orphans['removed'])} orphans; "
+        f"{before / 1e6:.1f} MB -> {after / 1e6:.1f} MB" + (" (dry run)" if dry_run else "") + sm.R
+    )
+    if capped["removed"] and retrain and not dry_run:
+        sm.train_model(user)
+    metrics.observe("storage_compact", time.perf_counter() - t0, user=user)
+    return {
+        "user": user,
+        "dry_run": dry_run,
+        "capped": capped,
+        "transcoded": coded,
+        "orphans": orphans,
+        "bytes_before": before,
+        "bytes_after": after,
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    us = sub.add_parser("usage", help="report disk usage")
+    us.add_argument("--user", default=None)
+    cp = sub.add_parser("compact", help="cap, transcode and garbage-collect")
+    who = cp.add_mutually_exclusive_group(required=True)
+    who.add_argument("--user")
+    who.add_argument("--all", action="store_true", help="every user with a profile or audio folder")
+    cp.add_argument("--max-per-label", type=int, default=MAX_PER_LABEL, help="0 = no cap")
+    cp.add_argument("--policy", choices=["diverse", "recent"], default=KEEP_POLICY)
+    cp.add_argument("--format", choices=sorted(_SUFFIX), default=STORAGE_FORMAT)
+    cp.add_argument("--subtype", default=STORAGE_SUBTYPE)
+    cp.add_argument("--no-gc", action="store_true", help="leave unreferenced files alone")
+    cp.add_argument("--no-train", action="store_true", help="do not retrain after capping")
+    cp.add_argument("--dry-run", action="store_true", help="report only, change nothing")
+    args = ap.parse_args()
+
+    if args.cmd == "usage":
+        print(json.dumps(usage(args.user), indent=2))
+        return 0
+    users = list(usage()) if args.all else [args.user]
+    with contextlib.redirect_stdout(sys.stderr):
+        results = [compact_user(u, args.max_per_label, args.policy, args.format, args.subtype,
+                                not args.no_gc, not args.no_train, args.dry_run) for u in users]
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""
+streaming.py
+
+Streaming capture for push-to-talk: instead of blocking on a fixed
+sd.rec() window, audio is pulled from an input stream callback into a
+preallocated ring buffer while a frame-level energy detector looks for the
+start and end of the utterance. Capture returns as soon as the speaker
+stops, with a short pre-roll so the onset is not clipped.
+
+The stream is created through a factory with the same keyword arguments as
+sounddevice.InputStream, so ArrayInputStream / wav_stream_factory can be
+used to replay WAV files through the exact same code path (no microphone).
+"""
+
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+# ===== Endpointing defaults =====
+FRAME_SEC = 0.02            # analysis frame for the energy detector
+PRE_ROLL_SEC = 0.25         # audio kept from before the detected onset
+HANGOVER_SEC = 0.35         # trailing silence that ends an utterance
+ONSET_FRAMES = 3            # consecutive voiced frames needed for an onset
+MIN_RMS = 0.003             # absolute floor for "voiced"
+ONSET_RATIO = 3.0           # voiced = rms > noise_floor * ONSET_RATIO
+END_RATIO = 2.0             # hysteresis: stays voiced above noise_floor * END_RATIO
+NOISE_ALPHA = 0.05          # noise floor EMA speed while idle
+
+
+class RingBuffer:
+    """Fixed-size float32 ring buffer addressed by absolute sample index."""
+
+    def __init__(self, capacity: int):
+        self.capacity = int(capacity)
+        self.buf = np.zeros(self.capacity, dtype=np.float32)
+        self.written = 0        # total samples ever written
+
+    def write(self, x: np.ndarray) -> None:
+        n = len(x)
+        if n >= self.capacity:
+            x = x[-self.capacity:]
+            self.written += n - self.capacity
+            n = self.capacity
+        start = self.written % self.capacity
+        first = min(n, self.capacity - start)
+        self.buf[start:start + first] = x[:first]
+        if first < n:
+            self.buf[:n - first] = x[first:]
+        self.written += n
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        """Copy samples [start, end) (absolute indices) still held in the buffer."""
+        start = max(start, self.written - self.capacity, 0)
+        end = min(end, self.written)
+        if end <= start:
+            return np.zeros(0, dtype=np.float32)
+        s = start % self.capacity
+        n = end - start
+        if s + n <= self.capacity:
+            return self.buf[s:s + n].copy()
+        first = self.capacity - s
+        return np.concatenate([self.buf[s:], self.buf[:n - first]])
+
+
+class EnergyEndpointer:
+    """
+    Frame-level energy VAD with an adaptive noise floor.
+
+    States: "idle" (waiting for onset) -> "speech" -> "done".
+    onset / end are absolute sample indices once known.
+    """
+
+    def __init__(self, sample_rate: int, max_len_sec: float):
+        self.frame_len = int(FRAME_SEC * sample_rate)
+        self.max_len = int(max_len_sec * sample_rate)
+        self.hangover = max(1, int(round(HANGOVER_SEC / FRAME_SEC)))
+        self.state = "idle"
+        self.onset: Optional[int] = None
+        self.end: Optional[int] = None
+        self.noise = None
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._pos = 0            # absolute index of the first pending sample
+        self._run = 0            # consecutive voiced frames (idle)
+        self._run_start = 0
+        self._silent = 0         # consecutive unvoiced frames (speech)
+        self._last_voiced_end = 0
+
+    def _voiced(self, level: float, ratio: float) -> bool:
+        floor = self.noise if self.noise is not None else 0.0
+        return level > max(MIN_RMS, floor * ratio)
+
+    def push(self, x: np.ndarray) -> str:
+        if self.state == "done":
+            return self.state
+        if self._pending.size:
+            x = np.concatenate([self._pending, x])
+        n_frames = len(x) // self.frame_len
+        if n_frames:
+            frames = x[: n_frames * self.frame_len].reshape(n_frames, self.frame_len)
+            levels = np.sqrt(np.mean(frames * frames, axis=1))
+            for i, level in enumerate(levels):
+                self._frame(float(level), self._pos + i * self.frame_len)
+                if self.state == "done":
+                    break
+        self._pending = x[n_frames * self.frame_len:].copy()
+        self._pos += n_frames * self.frame_len
+        return self.state
+
+    def _frame(self, level: float, pos: int) -> None:
+        if self.state == "idle":
+            if self._voiced(level, ONSET_RATIO):
+                if self._run == 0:
+                    self._run_start = pos
+                self._run += 1
+                if self._run >= ONSET_FRAMES:
+                    self.state = "speech"
+                    self.onset = self._run_start
+                    self._last_voiced_end = pos + self.frame_len
+            else:
+                self._run = 0
+                self.noise = level if self.noise is None else (
+                    (1 - NOISE_ALPHA) * self.noise + NOISE_ALPHA * level
+                )
+            return
+
+        # state == "speech"
+        if self._voiced(level, END_RATIO):
+            self._silent = 0
+            self._last_voiced_end = pos + self.frame_len
+        else:
+            self._silent += 1
+        too_long = pos + self.frame_len - self.onset >= self.max_len
+        if self._silent >= self.hangover or too_long:
+            self.finish()
+
+    def finish(self) -> None:
+        """Close the utterance (e.g. the stream ended mid-speech)."""
+        if self.state == "speech":
+            self.end = self._last_voiced_end
+            self.state = "done"
+
+
+class StreamingListener:
+    """
+    Capture one utterance from an input stream.
+
+    stream_factory is called like sounddevice.InputStream(samplerate=...,
+    channels=..., dtype=..., blocksize=..., callback=...).
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        max_len_sec: float,
+        stream_factory: Optional[Callable] = None,
+        blocksize: int = 0,
+    ):
+        self.sample_rate = sample_rate
+        self.max_len_sec = max_len_sec
+        self.stream_factory = stream_factory or _sounddevice_stream
+        self.blocksize = blocksize or int(FRAME_SEC * sample_rate)
+        capacity = int((PRE_ROLL_SEC + max_len_sec + HANGOVER_SEC + 1.0) * sample_rate)
+        self.ring = RingBuffer(capacity)
+
+    def capture(self, timeout_sec: float = 5.0, extractor=None) -> Optional[np.ndarray]:
+        """
+        Block until one utterance has been spoken and return it (pre-roll
+        included), or None if no onset was detected within timeout_sec.
+        If an extractor (features.StreamingFeatures) is given, the utterance
+        is pushed into it from the onset on while recording continues, so
+        extractor.summary(len(y)) is ready right after capture returns.
+        Also returns None if the utterance was overwritten in the ring
+        buffer; if samples were lost before reaching the extractor it stops
+        being fed (extractor.n < len(y)), so callers fall back to batch
+        features.
+        """
+        vad = EnergyEndpointer(self.sample_rate, self.max_len_sec)
+        done = threading.Event()
+        self.ring.written = 0
+
+        def callback(indata, frames, time_info, status):
+            if vad.state == "done":
+                return      # keep the utterance; audio after the endpoint is not needed
+            x = np.asarray(indata, dtype=np.float32)
+            if x.ndim > 1:
+                x = x[:, 0]
+            self.ring.write(x)
+            if vad.push(x) == "done":
+                done.set()
+
+        stream = self.stream_factory(
+            samplerate=self.sample_rate,
+            channels=1,
+            dtype="float32",
+            blocksize=self.blocksize,
+            callback=callback,
+        )
+        deadline = time.monotonic() + timeout_sec
+        fed = None      # absolute sample up to which the extractor has been fed
+        lost = False    # samples were overwritten before the extractor got them
+
+        def feed() -> None:
+            nonlocal fed, lost
+            if extractor is None or vad.onset is None or lost:
+                return
+            if fed is None:
+                fed = max(0, vad.onset - int(PRE_ROLL_SEC * self.sample_rate))
+            written = self.ring.written
+            if written - fed > self.ring.capacity:
+                lost = True     # samples from fed on were already overwritten
+                return
+            now = written if vad.end is None else min(written, vad.end)
+            if now > fed:
+                extractor.push(self.ring.read(fed, now))
+                fed = now
+
+        with stream:
+            while not done.wait(0.01):
+                feed()
+                if not getattr(stream, "active", True):
+                    break       # finite source (file replay) ran out
+                if vad.state == "idle" and time.monotonic() > deadline:
+                    break
+                if vad.state == "speech" and time.monotonic() > deadline + self.max_len_sec:
+                    break
+
+        vad.finish()
+        if vad.onset is None or vad.end is None:
+            return None
+        feed()
+        start = max(0, vad.onset - int(PRE_ROLL_SEC * self.sample_rate))
+        if self.ring.written - start > self.ring.capacity:
+            return None     # the start of the utterance was overwritten
+        return self.ring.read(start, vad.end)
+
+
+def _sounddevice_stream(**kwargs):
+    import sounddevice as sd
+    return sd.InputStream(**kwargs)
+
+
+# ===== Fake streams (replay audio without a microphone) =====
+class ArrayInputStream:
+    """
+    Minimal stand-in for sounddevice.InputStream that feeds a numpy array to
+    the callback in blocksize chunks from a background thread. With
+    realtime=True the chunks are paced at the sample rate.
+    """
+
+    def __init__(self, data: np.ndarray, samplerate: int, callback, blocksize: int = 0,
+                 realtime: bool = False, **_):
+        self.data = np.asarray(data, dtype=np.float32).reshape(-1, 1)
+        self.samplerate = samplerate
+        self.callback = callback
+        self.blocksize = blocksize or 1024
+        self.realtime = realtime
+        self.active = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self) -> None:
+        for i in range(0, len(self.data), self.blocksize):
+            if self._stop.is_set():
+                break
+            block = self.data[i:i + self.blocksize]
+            self.callback(block, len(block), None, None)
+            if self.realtime:
+                time.sleep(len(block) / self.samplerate)
+        self.active = False
+
+    def start(self) -> None:
+        self.active = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.active = False
+
+    def close(self) -> None:
+        self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def array_stream_factory(y: np.ndarray, realtime: bool = False) -> Callable:
+    def factory(**kwargs):
+        return ArrayInputStream(y, realtime=realtime, **kwargs)
+    return factory
+
+
+def wav_stream_factory(path: Path, sample_rate: int, realtime: bool = False) -> Callable:
+    """Factory replaying a WAV file (resampled to sample_rate) as a live stream."""
+    import soundfile as sf
+    y, sr = sf.read(str(path), dtype="float32", always_2d=False)
+    if y.ndim > 1:
+        y = y[:, 0]
+    if sr != sample_rate:
+        import librosa
+        y = librosa.resample(y, orig_sr=sr, target_sr=sample_rate)
+    return array_stream_factory(y, realtime=realtime)
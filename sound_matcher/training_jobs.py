@@ -0,0 +1,125 @@
+"""
+training_jobs.py
+
+Background training scheduler used by server.py.
+
+ - one worker thread per user, so retrains for a user never overlap
+ - besides "train", extra per-user tasks (e.g. "tune") can be registered;
+   they run on the same worker, in submission order
+ - back-to-back requests for a user that is already queued are coalesced
+   into the queued job of the same task (same job id is returned)
+ - every job has an id and a structured state:
+     queued -> running -> done | failed
+   with submit/start/finish timestamps and durations; a task that raises
+   or returns False (train_model: no model could be trained) is failed
+"""
+
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+MAX_FINISHED_JOBS = 200     # finished jobs kept for /jobs/<id> lookups
+
+
+class TrainingScheduler:
+    def __init__(self, train_fn: Callable[[str], object],
+                 tasks: Optional[Dict[str, Callable[[str], object]]] = None):
+        self.train_fn = train_fn
+        self.tasks = {"train": train_fn, **(tasks or {})}
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        # user -> {task: queued job id}, in submission order
+        self._queued: Dict[str, "OrderedDict[str, str]"] = {}
+        self._workers: Dict[str, threading.Thread] = {}
+
+    # ----- public API -----
+    def submit(self, user: str, reason: str = "", task: str = "train") -> dict:
+        """Queue a retrain (or another task) for user; returns a snapshot of the (possibly coalesced) job."""
+        if task not in self.tasks:
+            raise ValueError(f"unknown task {task!r}")
+        with self._lock:
+            job_id = self._queued.get(user, {}).get(task)
+            if job_id is not None:
+                job = self._jobs[job_id]
+                job["coalesced"] += 1
+                if reason:
+                    job["reasons"].append(reason)
+                return dict(job)
+
+            job = {
+                "id": uuid.uuid4().hex[:12],
+                "user": user,
+                "task": task,
+                "state": "queued",
+                "reasons": [reason] if reason else [],
+                "coalesced": 0,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "queue_sec": None,
+                "run_sec": None,
+                "result": None,
+                "error": None,
+            }
+            self._jobs[job["id"]] = job
+            self._queued.setdefault(user, OrderedDict())[task] = job["id"]
+            self._trim()
+
+            if user not in self._workers:
+                t = threading.Thread(target=self._worker, args=(user,), daemon=True)
+                self._workers[user] = t
+                t.start()
+            return dict(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def jobs(self, user: Optional[str] = None) -> list:
+        with self._lock:
+            return [dict(j) for j in self._jobs.values() if user is None or j["user"] == user]
+
+    def busy(self, user: str) -> bool:
+        with self._lock:
+            return user in self._workers
+
+    # ----- internals -----
+    def _worker(self, user: str) -> None:
+        while True:
+            with self._lock:
+                pending = self._queued.get(user)
+                if not pending:
+                    self._queued.pop(user, None)
+                    del self._workers[user]
+                    return
+                _, job_id = pending.popitem(last=False)
+                job = self._jobs[job_id]
+                job["state"] = "running"
+                job["started_at"] = time.time()
+                job["queue_sec"] = job["started_at"] - job["submitted_at"]
+
+            try:
+                result = self.tasks[job["task"]](user)
+                if result is False:
+                    state, error = "failed", "no model trained: not enough usable examples"
+                else:
+                    state, error = "done", None
+            except Exception as e:
+                traceback.print_exc()
+                result, state, error = None, "failed", str(e)
+
+            with self._lock:
+                job["state"] = state
+                job["result"] = result
+                job["error"] = error
+                job["finished_at"] = time.time()
+                job["run_sec"] = job["finished_at"] - job["started_at"]
+
+    def _trim(self) -> None:
+        finished = [j for j, job in self._jobs.items() if job["state"] in ("done", "failed")]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
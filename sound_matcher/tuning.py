@@ -0,0 +1,219 @@
+"""
+tuning.py
+
+Per-user tuning of forest size/depth and of the decision thresholds.
+
+    python3 tuning.py --user alice
+
+ 1. The user's feature matrix comes from the feature cache (no audio is
+    re-decoded unless it was never featurized).
+ 2. Every (trees, depth) pair in TREE_GRID x DEPTH_GRID is evaluated with
+    stratified k-fold cross-validation; all (config, fold) fits run in
+    parallel across cores. Each config yields out-of-fold probabilities
+    for every example.
+ 3. The cheapest config (fewest trees x depth actually reached, i.e. the
+    work per prediction) whose accuracy is within ACCURACY_TOLERANCE of the
+    best one is chosen.
+ 4. On that config's out-of-fold probabilities, MIN_PROBA / MARGIN_PROBA
+    are picked to minimise FALSE_TRIGGER_COST * wrong-script rate +
+    UNKNOWN rate.
+
+The result is stored in the profile under "params" (train_model and the
+decision functions read it from there) and the model is retrained with it.
+Profiles only contain enrolled commands, so "false triggers" here are
+confusions between commands; background noise is not part of the estimate.
+"""
+
+import argparse
+import contextlib
+import json
+import sys
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+import incremental
+import lazy_import
+import metrics
+import sound_matcher as sm
+
+joblib = lazy_import.lazy("joblib")
+sk_model_selection = lazy_import.lazy("sklearn.model_selection")
+
+TREE_GRID = (10, 25, 50, 100, 200)   # trees (per label in incremental mode)
+DEPTH_GRID = (6, 10, 16, None)
+FOLDS = 5
+ACCURACY_TOLERANCE = 0.01            # accept configs this far below the best accuracy
+FALSE_TRIGGER_COST = 5.0             # a wrong script firing is worth this many UNKNOWNs
+MIN_PROBA_GRID = np.round(np.arange(0.30, 0.951, 0.05), 2)
+MARGIN_GRID = np.round(np.arange(0.0, 0.501, 0.05), 2)
+TUNE_N_JOBS = -1                     # parallel (config, fold) fits (-1 = all cores)
+
+
+# ===== Cross-validation =====
+def _fit_fold(mode: str, n_trees: int, max_depth, X: np.ndarray, labels: np.ndarray,
+              classes: np.ndarray, train_idx: np.ndarray, test_idx: np.ndarray):
+    """Fit on one fold; returns (test_idx, proba over `classes`, mean tree depth)."""
+    Xtr, ytr = X[train_idx], labels[train_idx]
+    if mode == "incremental":
+        model = incremental.OneVsRestForest(sub_trees=n_trees, max_depth=max_depth,
+                                            random_state=sm.RANDOM_STATE, n_jobs=1)
+        model.fit(Xtr, ytr, {lbl: [] for lbl in np.unique(ytr)})
+        model_classes = list(model.classes_)
+        trees = [t for f in model.forests.values() for t in f.estimators_]
+    else:
+        model_classes = list(np.unique(ytr))
+        model = sm.make_forest(n_trees, max_depth, n_jobs=1)
+        model.fit(Xtr, np.searchsorted(model_classes, ytr))
+        trees = model.estimators_
+
+    # map the fold model's columns onto the full class list
+    P = np.zeros((len(test_idx), len(classes)))
+    P[:, np.searchsorted(classes, model_classes)] = model.predict_proba(X[test_idx])
+    depth = float(np.mean([t.tree_.max_depth for t in trees]))
+    return test_idx, P, depth
+
+
+def cross_validate(X: np.ndarray, labels: np.ndarray, configs: Sequence[tuple], mode: str,
+                   folds: int = FOLDS, n_jobs: int = TUNE_N_JOBS) -> List[dict]:
+    """Out-of-fold probabilities, accuracy and cost for every (n_trees, max_depth) config."""
+    classes = np.unique(labels)
+    min_count = int(min(np.sum(labels == c) for c in classes))
+    folds = max(2, min(folds, min_count))
+    splits = list(sk_model_selection.StratifiedKFold(
+        n_splits=folds, shuffle=True, random_state=sm.RANDOM_STATE).split(X, labels))
+
+    tasks = [(cfg, tr, te) for cfg in configs for tr, te in splits]
+    out = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(_fit_fold)(mode, cfg[0], cfg[1], X, labels, classes, tr, te)
+        for cfg, tr, te in tasks
+    )
+
+    results = []
+    for i, cfg in enumerate(configs):
+        P = np.zeros((len(X), len(classes)))
+        depths = []
+        for test_idx, p, depth in out[i * folds:(i + 1) * folds]:
+            P[test_idx] = p
+            depths.append(depth)
+        n_trees_total = cfg[0] * (len(classes) if mode == "incremental" else 1)
+        results.append({
+            "n_trees": cfg[0],
+            "max_depth": cfg[1],
+            "accuracy": float(np.mean(classes[P.argmax(axis=1)] == labels)),
+            # node visits per prediction: what inference time scales with
+            "cost": n_trees_total * float(np.mean(depths)),
+            "folds": folds,
+            "proba": P,
+        })
+    return results
+
+
+def choose_config(results: List[dict], tolerance: float = ACCURACY_TOLERANCE) -> dict:
+    best = max(r["accuracy"] for r in results)
+    ok = [r for r in results if r["accuracy"] >= best - tolerance]
+    return min(ok, key=lambda r: (r["cost"], r["n_trees"]))
+
+
+def choose_thresholds(P: np.ndarray, labels: np.ndarray, classes: np.ndarray,
+                      false_cost: float = FALSE_TRIGGER_COST) -> dict:
+    """Grid search over (min_proba, margin) on out-of-fold probabilities."""
+    top = P.argmax(axis=1)
+    p1 = P[np.arange(len(P)), top]
+    p2 = np.partition(P, -2, axis=1)[:, -2] if P.shape[1] > 1 else np.zeros(len(P))
+    correct = classes[top] == labels
+
+    best = None
+    for mp in MIN_PROBA_GRID:
+        for mg in MARGIN_GRID:
+            accept = (p1 >= mp) & ((p1 - p2) >= mg)
+            false_rate = float(np.mean(accept & ~correct))
+            unknown_rate = float(np.mean(~accept))
+            cost = false_cost * false_rate + unknown_rate
+            # ties go to the stricter thresholds
+            key = (round(cost, 12), -mp, -mg)
+            if best is None or key < best[0]:
+                best = (key, {"min_proba": float(mp), "margin_proba": float(mg),
+                              "false_trigger_rate": false_rate, "unknown_rate": unknown_rate})
+    return best[1]
+
+
+# ===== Job =====
+def tune_user(user: str, mode: Optional[str] = None, trees: Sequence[int] = TREE_GRID,
+              depths: Sequence = DEPTH_GRID, folds: int = FOLDS, retrain: bool = True) -> dict:
+    """
+    Tune and store the user's params; returns them (plus the per-config
+    table). Raises ValueError when there is not enough data to cross-validate.
+    """
+    user = sm.normalize_text(user)
+    mode = mode or sm.TRAIN_MODE
+    t0 = time.perf_counter()
+    prof = sm.load_profile(user)
+    if sm.engine_name(prof.get("params")) != "rf":
+        raise ValueError("tuning searches RandomForest settings; this user uses the "
+                         f"'{sm.engine_name(prof.get('params'))}' engine")
+    X, labels, _ = sm.training_matrix(user, prof.get("examples", []))
+    classes = np.unique(labels)
+    if len(classes) < 2 or min(np.sum(labels == c) for c in classes) < 2:
+        raise ValueError("tuning needs at least 2 commands with 2 examples each")
+
+    configs = [(t, d) for t in trees for d in depths]
+    print(sm.C + f"Tuning '{user}': {len(configs)} configs x {folds}-fold CV on {len(X)} examples…" + sm.R)
+    with metrics.timer("tune_cv"):
+        results = cross_validate(X, labels, configs, mode, folds)
+    chosen = choose_config(results)
+    thresholds = choose_thresholds(chosen["proba"], labels, classes)
+
+    params = {
+        "train_mode": mode,
+        "n_trees": chosen["n_trees"],
+        "max_depth": chosen["max_depth"],
+        "min_proba": thresholds["min_proba"],
+        "margin_proba": thresholds["margin_proba"],
+        "cv_accuracy": chosen["accuracy"],
+        "cv_false_trigger_rate": thresholds["false_trigger_rate"],
+        "cv_unknown_rate": thresholds["unknown_rate"],
+        "cv_folds": chosen["folds"],
+        "n_examples": int(len(X)),
+        "tuned_at": time.time(),
+    }
+    sm.set_params(user, params)
+    print(
+        sm.G + f"Chosen: {params['n_trees']} trees, depth {params['max_depth']}, "
+        f"min_proba {params['min_proba']:.2f}, margin {params['margin_proba']:.2f} "
+        f"(CV accuracy {params['cv_accuracy']:.3f})" + sm.R
+    )
+    if retrain:
+        sm.train_model(user, mode)
+    metrics.observe("tune_total", time.perf_counter() - t0, user=user)
+
+    table = [{k: r[k] for k in ("n_trees", "max_depth", "accuracy", "cost")} for r in results]
+    return {"params": params, "configs": table}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--user", required=True)
+    ap.add_argument("--mode", choices=["full", "incremental"], default=None,
+                    help="training mode to tune for (default sound_matcher.TRAIN_MODE)")
+    ap.add_argument("--trees", type=int, nargs="+", default=list(TREE_GRID))
+    ap.add_argument("--depths", type=int, nargs="+", default=None,
+                    help="max depths to try (0 = unlimited)")
+    ap.add_argument("--folds", type=int, default=FOLDS)
+    ap.add_argument("--no-train", action="store_true", help="store the params without retraining")
+    args = ap.parse_args()
+
+    depths = [d or None for d in args.depths] if args.depths else list(DEPTH_GRID)
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            result = tune_user(args.user, args.mode, args.trees, depths, args.folds, not args.no_train)
+        except ValueError as e:
+            print(sm.Y + str(e) + sm.R)
+            return 2
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())